@@ -42,6 +42,19 @@ class InstagramMediaCommentAdmin(admin.ModelAdmin):
     date_hierarchy = 'send_at'
     ordering = ('-send_at',)
 
+@admin.register(DraftReply)
+class DraftReplyAdmin(admin.ModelAdmin):
+    list_display = ('content', 'review', 'comment', 'generated_at')
+    search_fields = ('content',)
+    date_hierarchy = 'generated_at'
+    ordering = ('-generated_at',)
+
+@admin.register(DashboardSnapshot)
+class DashboardSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('user', 'review_count', 'unanswered_review_count', 'comment_count', 'updated_at')
+    search_fields = ('user__username',)
+    ordering = ('-updated_at',)
+
 @admin.register(Photo)
 class PhotoAdmin(admin.ModelAdmin):
     list_display = ('title', 'url', 'upload_at', 'author')
@@ -0,0 +1,173 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DashboardSnapshot, InstagramMedia, InstagramMediaComment, Review
+
+import datetime
+
+# Days of comment volume kept in the snapshot
+DASHBOARD_COMMENT_DAYS = getattr(settings, 'DASHBOARD_COMMENT_DAYS', 30)
+
+
+def locked_snapshot(user_id):
+    """
+    Returns the dashboard snapshot of a user, locked until the end of the transaction, or None if it does not exist.
+
+    Must be called in a transaction.
+    """
+    return (DashboardSnapshot.objects.select_for_update(of=('self',))
+            .select_related('last_review', 'last_media', 'last_comment').filter(user_id=user_id).first())
+
+
+def count_review(snapshot, review, sign=1):
+    """
+    Adds a review to the figures of a snapshot, or removes it when `sign` is -1.
+    """
+    snapshot.review_count += sign
+    snapshot.rating_total += sign * review.star_rating
+    if 1 <= review.star_rating <= 5:
+        snapshot.star_counts[review.star_rating - 1] += sign
+    if not review.reply:
+        snapshot.unanswered_review_count += sign
+
+
+def record_reviews(user_id, created, updated, previous):
+    """
+    Updates the dashboard snapshot of a user with reviews just saved, or builds it if the user has none yet.
+
+    Parameters:
+    - user_id (int): The ID of the owner of the location of the reviews.
+    - created (list): The new reviews.
+    - updated (list): The edited reviews.
+    - previous (dict): The stored version of the edited reviews, by primary key, as filled by `UpsertManager.upsert`.
+    """
+    if not created and not updated:
+        return
+
+    with transaction.atomic(savepoint=False):
+        snapshot = locked_snapshot(user_id)
+        if snapshot is None:
+            # The rows just saved are counted with the older ones
+            rebuild_snapshot(user_id)
+            return
+        for review in created:
+            count_review(snapshot, review)
+        for review in updated:
+            count_review(snapshot, previous[review.pk], sign=-1)
+            count_review(snapshot, review)
+
+        # Ties are broken on the primary key, as in the ordering of the models
+        newest = max(created + updated, key=lambda review: (review.pub_at, review.pk))
+        last = snapshot.last_review
+        if last is None or (newest.pub_at, newest.pk) > (last.pub_at, last.pk):
+            snapshot.last_review = newest
+        snapshot.save()
+
+
+def record_medias(user_id, created_medias, created_comments):
+    """
+    Updates the dashboard snapshot of a user with the Instagram medias and comments just saved, or builds it if the
+    user has none yet.
+
+    Parameters:
+    - user_id (int): The ID of the owner of the Instagram account.
+    - created_medias (list): The new medias.
+    - created_comments (list): The new comments.
+    """
+    if not created_medias and not created_comments:
+        return
+
+    with transaction.atomic(savepoint=False):
+        snapshot = locked_snapshot(user_id)
+        if snapshot is None:
+            rebuild_snapshot(user_id)
+            return
+        if created_medias:
+            newest = max(created_medias, key=lambda media: (media.published_at, media.pk))
+            last = snapshot.last_media
+            if last is None or (newest.published_at, newest.pk) > (last.published_at, last.pk):
+                snapshot.last_media = newest
+
+        if created_comments:
+            newest = max(created_comments, key=lambda comment: (comment.send_at, comment.pk))
+            last = snapshot.last_comment
+            if last is None or (newest.send_at, newest.pk) > (last.send_at, last.pk):
+                snapshot.last_comment = newest
+
+            snapshot.comment_count += len(created_comments)
+            for comment in created_comments:
+                day = comment.send_at.date().isoformat()
+                snapshot.comments_per_day[day] = snapshot.comments_per_day.get(day, 0) + 1
+            snapshot.comments_per_day = recent_days(snapshot.comments_per_day)
+        snapshot.save()
+
+
+def recent_days(counts):
+    """
+    Returns the counts by ISO date of the last DASHBOARD_COMMENT_DAYS days only.
+    """
+    first_day = (timezone.now() - datetime.timedelta(days=DASHBOARD_COMMENT_DAYS)).date().isoformat()
+    return {day: count for day, count in sorted(counts.items()) if day > first_day}
+
+
+def rebuild_snapshot(user_id):
+    """
+    Computes the dashboard snapshot of a user from all of the stored reviews, medias and comments.
+
+    Used once per user, for the data saved before the snapshot existed, the syncs keep it up to date after.
+
+    Parameters:
+    - user_id (int): The ID of the user.
+
+    Returns:
+    - DashboardSnapshot: The saved snapshot.
+    """
+    reviews = Review.objects.filter(location__owner_id=user_id)
+    comments = InstagramMediaComment.objects.filter(media_related__author_id=user_id)
+    first_day = timezone.now() - datetime.timedelta(days=DASHBOARD_COMMENT_DAYS)
+
+    with transaction.atomic():
+        # Two first loads of the dashboard may build it at the same time: the row is created once, the other one gets
+        # it, then they take the lock in turn
+        DashboardSnapshot.objects.get_or_create(user_id=user_id)
+        snapshot = locked_snapshot(user_id)
+        totals = reviews.aggregate(count=Count('pk'), rating=Sum('star_rating'))
+        stars = dict(reviews.order_by().values_list('star_rating').annotate(count=Count('pk')))
+        snapshot.review_count = totals['count']
+        snapshot.rating_total = totals['rating'] or 0
+        snapshot.star_counts = [stars.get(rating, 0) for rating in range(1, 6)]
+        snapshot.unanswered_review_count = reviews.filter(reply='').count()
+        snapshot.last_review = reviews.last()
+
+        snapshot.last_media = InstagramMedia.objects.filter(author_id=user_id).last()
+        snapshot.last_comment = comments.last()
+        snapshot.comment_count = comments.count()
+        per_day = (comments.filter(send_at__gt=first_day).order_by().annotate(day=TruncDate('send_at'))
+                   .values_list('day').annotate(count=Count('pk')))
+        snapshot.comments_per_day = recent_days({day.isoformat(): count for day, count in per_day})
+        snapshot.save()
+    return snapshot
+
+
+def comment_days(snapshot):
+    """
+    Returns the number of comments of each of the last DASHBOARD_COMMENT_DAYS days of a snapshot, oldest first,
+    with the height of its bar in percent of the busiest day.
+    """
+    today = timezone.now().date()
+    days = [today - datetime.timedelta(days=offset) for offset in range(DASHBOARD_COMMENT_DAYS - 1, -1, -1)]
+    counts = [snapshot.comments_per_day.get(day.isoformat(), 0) for day in days]
+    busiest = max(counts, default=0) or 1
+    return [{'day': day, 'count': count, 'height': round(100 * count / busiest)} for day, count in zip(days, counts)]
+
+
+def get_snapshot(user):
+    """
+    Returns the dashboard snapshot of a user with its last review, media and comment, building it if needed.
+    """
+    snapshot = (DashboardSnapshot.objects.select_related('last_review', 'last_media', 'last_comment')
+                .filter(user=user).first())
+    return snapshot or rebuild_snapshot(user.pk)
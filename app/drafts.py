@@ -0,0 +1,99 @@
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from itertools import groupby
+
+from .llm import (get_openai_comment_answer, get_openai_comment_answers, get_openai_review_answer,
+                  get_openai_review_answers)
+from .models import DraftReply, Review, InstagramMediaComment
+
+
+def draft_review_replies(user):
+    """
+    Generates a draft reply for every unanswered review of the user that has none yet.
+
+    A draft made with other preferences than the current ones of the user is generated again. The reviews are
+    answered in batches, so a backfill of hundreds of reviews costs a few requests to OpenAI.
+
+    Parameters:
+    - user (CustomUser): The owner of the locations.
+
+    Returns:
+    - list: The created or updated DraftReply objects.
+    """
+    preferences = user.answerGenerationPreferences
+    reviews = list(Review.objects.filter(location__owner=user, reply='').exclude(comment='')
+                   .filter(Q(draft__isnull=True) | ~Q(draft__preferences=preferences))
+                   .select_related('draft'))
+    if not reviews:
+        return []
+
+    answers = get_openai_review_answers({review.review_id: review.comment for review in reviews}, preferences)
+
+    created = []
+    updated = []
+    for review in reviews:
+        draft = getattr(review, 'draft', None)
+        if draft is None:
+            created.append(DraftReply(review=review, content=answers[review.review_id], preferences=preferences))
+        else:
+            draft.content = answers[review.review_id]
+            draft.preferences = preferences
+            draft.generated_at = timezone.now()
+            updated.append(draft)
+
+    with transaction.atomic():
+        DraftReply.objects.bulk_create(created)
+        DraftReply.objects.bulk_update(updated, ['content', 'preferences', 'generated_at'])
+    return created + updated
+
+
+def draft_comment_replies(comments):
+    """
+    Generates a draft reply for the given Instagram comments that have none yet, e.g. the comments a sync just saved.
+
+    The comments of a post are answered in batches, like the reviews, and with the preferences of the author of the
+    post, so a post with many new comments costs a few requests to OpenAI.
+
+    Parameters:
+    - comments (list): The InstagramMediaComment objects to draft a reply to.
+
+    Returns:
+    - list: The created DraftReply objects.
+    """
+    comments = (InstagramMediaComment.objects.filter(pk__in=[comment.pk for comment in comments], draft__isnull=True)
+                .select_related('media_related__author').order_by('media_related'))
+
+    drafts = []
+    for media, media_comments in groupby(comments, key=lambda comment: comment.media_related):
+        media_comments = list(media_comments)
+        preferences = media.author.answerGenerationPreferences
+        answers = get_openai_comment_answers({comment.pk: comment.content for comment in media_comments},
+                                             media.caption, preferences)
+        drafts.extend(DraftReply(comment=comment, content=answers[comment.pk], preferences=preferences)
+                      for comment in media_comments)
+    return DraftReply.objects.bulk_create(drafts)
+
+
+def regenerate_draft(draft, user, deadline=None):
+    """
+    Replaces the content of a draft with a newly generated answer.
+
+    Parameters:
+    - draft (DraftReply): The draft to regenerate.
+    - user (CustomUser): The user asking for it, whose preferences are used.
+    - deadline (float): The seconds the completion may take, see app.llm.LLMClient.
+
+    Returns:
+    - DraftReply: The updated draft.
+    """
+    draft.preferences = user.answerGenerationPreferences
+    if draft.review_id:
+        draft.content = get_openai_review_answer(draft.review.comment, draft.preferences, refresh=True,
+                                                 deadline=deadline)
+    else:
+        draft.content = get_openai_comment_answer(draft.comment.content, draft.comment.media_related.caption,
+                                                  draft.preferences, refresh=True, deadline=deadline)
+    draft.save()
+    return draft
@@ -0,0 +1,323 @@
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from requests.adapters import HTTPAdapter
+
+from .dashboard import record_reviews
+from .models import Categorie, Service, Location, Review
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests, httplib2, datetime, functools
+
+# Roots of the Google APIs, e.g. the URLs of the local simulator of the simulate_apis command.
+# The Business Information API defaults to the endpoint of its discovery document.
+GOOGLE_BUSINESS_API_URL = getattr(settings, 'GOOGLE_BUSINESS_API_URL', 'https://mybusiness.googleapis.com/v4')
+GOOGLE_BUSINESS_INFORMATION_API_URL = getattr(settings, 'GOOGLE_BUSINESS_INFORMATION_API_URL', None)
+GOOGLE_TOKEN_URI = getattr(settings, 'GOOGLE_TOKEN_URI', 'https://oauth2.googleapis.com/token')
+
+# Biggest pages accepted by the reviews and locations endpoints
+REVIEWS_PAGE_SIZE = 50
+LOCATIONS_PAGE_SIZE = 100
+
+# Number of locations whose reviews are fetched at the same time, and seconds after which a request to the Google
+# APIs is given up.
+GOOGLE_API_MAX_WORKERS = getattr(settings, 'GOOGLE_API_MAX_WORKERS', 8)
+GOOGLE_API_TIMEOUT = getattr(settings, 'GOOGLE_API_TIMEOUT', 10)
+
+# Keep-alive connections shared by every call to the Google Business API
+google_session = requests.Session()
+for scheme in ('https://', 'http://'):
+    google_session.mount(scheme, HTTPAdapter(pool_connections=1, pool_maxsize=GOOGLE_API_MAX_WORKERS))
+
+STAR_RATING_MAP = {
+    'ONE': 1,
+    'TWO': 2,
+    'THREE': 3,
+    'FOUR': 4,
+    'FIVE': 5
+}
+
+
+def get_access_token(token):
+    """
+    Returns a valid access token for a Google social token, refreshing and storing it when it expired.
+
+    Parameters:
+    - token (SocialToken): The Google social token of the user.
+
+    Returns:
+    - str: The access token.
+    """
+    if not token.expires_at or token.expires_at > timezone.now() + datetime.timedelta(minutes=1):
+        return token.token
+
+    credentials = Credentials(
+        token=None,
+        refresh_token=token.token_secret,
+        token_uri=GOOGLE_TOKEN_URI,
+        client_id=settings.CLIENT_ID,
+        client_secret=settings.CLIENT_SECRET
+    )
+    credentials.refresh(Request())
+
+    token.token = credentials.token
+    token.expires_at = timezone.make_aware(credentials.expiry, datetime.timezone.utc) if credentials.expiry else None
+    token.save(update_fields=['token', 'expires_at'])
+    return token.token
+
+
+# Endpoint overrides of the APIs called through googleapiclient
+API_ENDPOINTS = {
+    'mybusinessbusinessinformation': GOOGLE_BUSINESS_INFORMATION_API_URL,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_service(name, version):
+    """
+    Returns the Google API service object of the given API, built once per process.
+
+    The service is built from the discovery document shipped with googleapiclient, without credentials: they are
+    given to each request through `execute(http=authorized_http(credentials))`. The requests go to the endpoint set
+    in `API_ENDPOINTS`, if any.
+
+    Parameters:
+    - name (str): The name of the API, e.g. 'mybusinessbusinessinformation'.
+    - version (str): The version of the API, e.g. 'v1'.
+
+    Returns:
+    - Resource: The service object.
+    """
+    endpoint = API_ENDPOINTS.get(name)
+    client_options = {'api_endpoint': endpoint} if endpoint else None
+    return build(name, version, http=httplib2.Http(timeout=GOOGLE_API_TIMEOUT), static_discovery=True, client_options=client_options)
+
+
+def authorized_http(credentials):
+    """
+    Returns an HTTP client signing the requests of a cached service object with the given credentials.
+
+    httplib2 clients are not thread-safe, so a new one is made for each call.
+    """
+    return AuthorizedHttp(credentials, http=httplib2.Http(timeout=GOOGLE_API_TIMEOUT))
+
+
+def get_locations(access_token, token, account_id):
+    """
+    Retrieves the list of every location associated with the given account ID, following the `nextPageToken`.
+
+    Parameters:
+    - access_token (str): The access token for authentication.
+    - token (Token): The token object containing the token secret for refreshing the access token.
+    - account_id (str): The ID of the account to retrieve locations from.
+
+    Returns:
+    - locations (dict): A dictionary containing the retrieved locations data under the 'locations' key.
+
+    Example:
+    access_token = "your_access_token"
+    token = Token("your_token_secret")
+    account_id = "your_account_id"
+    locations = get_locations(access_token, token, account_id)
+    """
+    credentials = Credentials(
+        token=access_token,
+        refresh_token=token.token_secret,
+        token_uri=GOOGLE_TOKEN_URI,
+        client_id=settings.CLIENT_ID,
+        client_secret=settings.CLIENT_SECRET
+    )
+    service = get_service('mybusinessbusinessinformation', 'v1')
+    http = authorized_http(credentials)
+
+    parentIUD = f"accounts/{account_id}"
+    locations = []
+    page_token = None
+    while True:
+        page = service.accounts().locations().list(
+            parent=parentIUD, readMask="name,title,categories,profile", pageSize=LOCATIONS_PAGE_SIZE,
+            pageToken=page_token
+        ).execute(http=http)
+        locations.extend(page.get('locations', []))
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            return {'locations': locations}
+
+
+def save_locations(locations, owner):
+    """
+    Saves the locations of an owner, with their categories and services, in the database.
+
+    Everything is written in bulk in one transaction, whatever the number of locations. A location already owned by
+    another user is left as it is, with its reviews: connecting the same Google location again does not take it over.
+
+    Parameters:
+    - locations (list): The location payloads returned by the Business Information API.
+    - owner (User): The owner of the locations.
+
+    Returns:
+    - list: The saved `Location` objects of the owner, in the same order as `locations`.
+
+    Example Usage:
+    locations = [{'name': 'locations/12345', 'title': 'My restaurant', 'categories': {'primaryCategory': {'name': 'categories/gcid:restaurant', 'displayName': 'Restaurant', 'serviceTypes': [{'serviceTypeId': 'job_type_id:12345', 'displayName': 'Delivery'}]}}}]
+    owner = User.objects.get(username='admin')
+    saved_locations = save_locations(locations, owner)
+    """
+    categories = {}
+    services = {}
+    location_rows = []
+    location_services = []
+    owned_by_others = set(
+        Location.objects.filter(location_id__in=[location['name'].split('/')[-1] for location in locations])
+        .exclude(owner=owner).values_list('location_id', flat=True)
+    )
+    for location in locations:
+        location_id = location['name'].split('/')[-1]
+        if location_id in owned_by_others:
+            continue
+        primary_category = location.get('categories', {}).get('primaryCategory')
+
+        categorie_id = None
+        if primary_category:
+            categorie_id = primary_category['name'].replace("categories/gcid:", '')
+            categories[categorie_id] = Categorie(categorie_id=categorie_id, name=primary_category['displayName'])
+
+            for service_data in primary_category.get('serviceTypes', []):
+                service_id = service_data['serviceTypeId'].replace('job_type_id:', '')
+                services[service_id] = Service(service_id=service_id, name=service_data['displayName'])
+                location_services.append(Location.services.through(location_id=location_id, service_id=service_id))
+
+        location_rows.append(Location(location_id=location_id, name=location['title'], owner=owner,
+                                      categorie_id=categorie_id))
+
+    with transaction.atomic():
+        Categorie.objects.upsert(list(categories.values()), ['name'])
+        Service.objects.upsert(list(services.values()), ['name'])
+        Location.objects.upsert(location_rows, ['name', 'categorie'])
+        Location.services.through.objects.bulk_create(location_services, ignore_conflicts=True)
+
+    saved = Location.objects.in_bulk([location.location_id for location in location_rows])
+    return [saved[location.location_id] for location in location_rows]
+
+
+def save_reviews(reviews_data, location_instance):
+    """
+    Saves reviews data in the database.
+
+    The stored reviews are loaded in one query and compared on their Google `updateTime`, then only the new and
+    the edited reviews are written, in bulk and in one transaction, along with the dashboard snapshot of the owner.
+
+    Parameters:
+    reviews_data (dict): A dictionary containing the reviews data.
+    location_instance (Location): An instance of the Location model.
+
+    Returns:
+    tuple: The list of created reviews and the list of updated reviews.
+    """
+    reviews = []
+    for review in reviews_data.get('reviews', []):
+        reviews.append(Review(
+            review_id=review['reviewId'],
+            reviewer_name=review['reviewer']['displayName'],
+            reviewer_picture_url=review['reviewer'].get('profilePhotoUrl', ''),
+            star_rating=STAR_RATING_MAP.get(review['starRating'], 0),
+            comment=review.get('comment', ''),
+            reply=review.get('reviewReply', {}).get('comment', ''),
+            location=location_instance,
+            pub_at=parse_datetime(review['createTime']),
+            updated_at=parse_datetime(review['updateTime']),
+        ))
+
+    previous = {}
+    with transaction.atomic():
+        created, updated = Review.objects.upsert(
+            reviews,
+            ['reviewer_name', 'reviewer_picture_url', 'star_rating', 'comment', 'reply', 'location', 'pub_at',
+             'updated_at'],
+            compare=['updated_at', 'location'],
+            previous=previous,
+        )
+        record_reviews(location_instance.owner_id, created, updated, previous)
+    return created, updated
+
+
+def fetch_reviews(access_token, account_id, location_id, since=None, timeout=GOOGLE_API_TIMEOUT):
+    """
+    Fetches the reviews of a location, following the `nextPageToken` of every page.
+
+    The reviews come newest update first, so when `since` is given the paging stops at the first review that was
+    not updated after it.
+
+    Parameters:
+    - access_token (str): The Google access token.
+    - account_id (str): The ID of the Google Business account.
+    - location_id (str): The ID of the location.
+    - since (datetime): The update time of the newest review already stored, or None to fetch them all.
+    - timeout (float): Seconds to wait for each page before giving up.
+
+    Returns:
+    - list: The review payloads updated after `since`, newest first.
+
+    Raises:
+    - requests.HTTPError: If the API answers with an error status.
+    - requests.Timeout: If a page does not arrive in time.
+    """
+    url = f'{GOOGLE_BUSINESS_API_URL}/accounts/{account_id}/locations/{location_id}/reviews'
+    headers = {'Authorization': f'Bearer {access_token}'}
+    params = {'pageSize': REVIEWS_PAGE_SIZE, 'orderBy': 'updateTime desc'}
+
+    reviews = []
+    while True:
+        response = google_session.get(url, headers=headers, params=params, timeout=timeout)
+        response.raise_for_status()
+        page = response.json()
+
+        for review in page.get('reviews', []):
+            if since and parse_datetime(review['updateTime']) <= since:
+                return reviews
+            reviews.append(review)
+
+        if not page.get('nextPageToken'):
+            return reviews
+        params['pageToken'] = page['nextPageToken']
+
+
+def sync_reviews(access_token, account_id, locations, max_workers=GOOGLE_API_MAX_WORKERS):
+    """
+    Saves the reviews of locations updated since their last sync, then moves their sync cursor forward.
+
+    The reviews of the locations are fetched concurrently, then saved from the calling thread. The cursor of a
+    location is the update time of the newest review received, as given by Google, so it does not depend on the
+    server clock.
+
+    Parameters:
+    - access_token (str): The Google access token.
+    - account_id (str): The ID of the Google Business account.
+    - locations (list): The `Location` objects to synchronise.
+    - max_workers (int): The maximum number of locations fetched at the same time.
+
+    Returns:
+    - dict: The review payloads received for each location, newest first.
+    """
+    if not locations:
+        return {}
+
+    def fetch(location):
+        return fetch_reviews(access_token, account_id, location.location_id, since=location.reviews_synced_at)
+
+    received = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(locations))) as executor:
+        for location, reviews in zip(locations, executor.map(fetch, locations)):
+            if reviews:
+                save_reviews({'reviews': reviews}, location)
+                location.reviews_synced_at = max(parse_datetime(review['updateTime']) for review in reviews)
+                location.save(update_fields=['reviews_synced_at'])
+            received[location] = reviews
+    return received
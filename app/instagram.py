@@ -0,0 +1,275 @@
+from allauth.socialaccount.models import SocialToken
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from requests.adapters import HTTPAdapter
+
+from users.models import CustomUser
+from .dashboard import record_medias
+from .models import InstagramMedia, InstagramMediaComment
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests, datetime
+
+# Root of the Graph API, e.g. the URL of the local simulator of the simulate_apis command
+GRAPH_API_URL = getattr(settings, 'GRAPH_API_URL', 'https://graph.facebook.com/v18.0')
+
+# Users whose last Instagram sync is older than this are refreshed by the sync_instagram command.
+INSTAGRAM_SYNC_MAX_AGE = getattr(settings, 'INSTAGRAM_SYNC_MAX_AGE', datetime.timedelta(minutes=15))
+
+# Number of Graph API requests made at the same time, and seconds after which one of them is given up.
+GRAPH_API_MAX_WORKERS = getattr(settings, 'GRAPH_API_MAX_WORKERS', 8)
+GRAPH_API_TIMEOUT = getattr(settings, 'GRAPH_API_TIMEOUT', 10)
+
+# Medias per page, with their first comments expanded in the same request
+GRAPH_API_PAGE_SIZE = 50
+MEDIA_FIELDS = f'id,caption,media_type,media_url,timestamp,comments.limit({GRAPH_API_PAGE_SIZE}){{id,text,timestamp}}'
+
+# Keep-alive connections shared by every Graph API call of the process
+graph_session = requests.Session()
+for scheme in ('https://', 'http://'):
+    graph_session.mount(scheme, HTTPAdapter(pool_connections=1, pool_maxsize=GRAPH_API_MAX_WORKERS))
+
+
+def graph_fetch(url, params=None, timeout=GRAPH_API_TIMEOUT):
+    """
+    Makes a GET request to a Graph API URL over the shared keep-alive session.
+
+    Parameters:
+    - url (str): The full URL, e.g. the `paging.next` URL of a previous response.
+    - params (dict): Extra query parameters.
+    - timeout (float): Seconds to wait for the Graph API before giving up.
+
+    Returns:
+    - dict: The decoded JSON response.
+
+    Raises:
+    - requests.HTTPError: If the Graph API answers with an error status.
+    """
+    response = graph_session.get(url, params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def graph_get(path, token, timeout=GRAPH_API_TIMEOUT, **params):
+    """
+    Makes a GET request to a Graph API node or edge.
+
+    Parameters:
+    - path (str): The path of the Graph API node or edge, e.g. 'me/accounts'.
+    - token (str): The Facebook access token.
+    - timeout (float): Seconds to wait for the Graph API before giving up.
+    - params: Extra query parameters such as `fields`.
+
+    Returns:
+    - dict: The decoded JSON response.
+    """
+    return graph_fetch(f'{GRAPH_API_URL}/{path}', params={'access_token': token, **params}, timeout=timeout)
+
+
+def graph_pages(page, timeout=GRAPH_API_TIMEOUT):
+    """
+    Iterates over the items of a paginated Graph API edge, following the `paging.next` cursors.
+
+    Parameters:
+    - page (dict): The first page of the edge.
+    - timeout (float): Seconds to wait for each following page.
+
+    Yields:
+    - dict: Every item of every page.
+    """
+    while page:
+        yield from page.get('data', [])
+        next_url = page.get('paging', {}).get('next')
+        page = graph_fetch(next_url, timeout=timeout) if next_url else None
+
+
+def fetch_medias(insta_id, token, max_workers=GRAPH_API_MAX_WORKERS, timeout=GRAPH_API_TIMEOUT):
+    """
+    Fetches every media of an Instagram Business Account with all of their comments.
+
+    The comments are expanded in the media request itself, so an account costs one request per page of
+    `GRAPH_API_PAGE_SIZE` medias. Only the medias having more comments than the expansion returned need extra
+    requests, which are made concurrently.
+
+    Parameters:
+    - insta_id (str): The Instagram Business Account ID.
+    - token (str): The Facebook access token.
+    - max_workers (int): The maximum number of comment requests in flight at the same time.
+    - timeout (float): Seconds to wait for each request.
+
+    Returns:
+    - list: The media payloads, each with the complete list of its comments in `comments['data']`.
+    """
+    first_page = graph_get(f'{insta_id}/media', token, timeout=timeout, fields=MEDIA_FIELDS, limit=GRAPH_API_PAGE_SIZE)
+    medias = list(graph_pages(first_page, timeout=timeout))
+
+    truncated = [media for media in medias if media.get('comments', {}).get('paging', {}).get('next')]
+    if truncated:
+        def remaining_comments(media):
+            next_page = graph_fetch(media['comments']['paging']['next'], timeout=timeout)
+            return list(graph_pages(next_page, timeout=timeout))
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(truncated))) as executor:
+            for media, comments in zip(truncated, executor.map(remaining_comments, truncated)):
+                media['comments']['data'].extend(comments)
+
+    return medias
+
+
+def request_facebook_page(token):
+    """
+    Requests the first Facebook page of the user, with its Instagram Business Account expanded.
+
+    Parameters:
+    - token (str): The Facebook access token.
+
+    Returns:
+    - dict: The page, with its 'id', 'name' and 'instagram_business_account'.
+    """
+    # The Instagram account is expanded on the page list, one request instead of one per page
+    pages_data = graph_get('me/accounts', token, fields='id,name,instagram_business_account')
+    return pages_data['data'][0]
+
+
+def get_instagram_account(user, token):
+    """
+    Returns the Instagram Business Account ID of a user, asking the Graph API only the first time.
+
+    The page ID, page name and Instagram Business Account ID are stored on the user, until `forget_instagram_account`
+    clears them when the Facebook account is re-linked or its token refreshed.
+
+    Parameters:
+    - user (CustomUser): The user owning the Instagram account.
+    - token (str): The Facebook access token of the user.
+
+    Returns:
+    - str: The Instagram Business Account ID.
+    """
+    if not user.instagram_business_account_id:
+        page = request_facebook_page(token)
+        user.facebook_page_id = page['id']
+        user.facebook_page_name = page['name']
+        user.instagram_business_account_id = page['instagram_business_account']['id']
+        user.save(update_fields=['facebook_page_id', 'facebook_page_name', 'instagram_business_account_id'])
+    return user.instagram_business_account_id
+
+
+def forget_instagram_account(user):
+    """
+    Clears the stored Facebook page and Instagram Business Account of a user, so the next sync resolves them again.
+    """
+    user.facebook_page_id = ''
+    user.facebook_page_name = ''
+    user.instagram_business_account_id = ''
+    user.save(update_fields=['facebook_page_id', 'facebook_page_name', 'instagram_business_account_id'])
+
+
+def parse_graph_timestamp(timestamp):
+    return datetime.datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S%z")
+
+
+def save_medias(user, medias):
+    """
+    Saves the medias of a user, with their comments, in the database.
+
+    Everything is written in one transaction, with a handful of queries whatever the number of medias and
+    comments. Only the new and the changed rows are written, and the new ones are counted in the dashboard
+    snapshot of the user.
+
+    Parameters:
+    - user: The user owning the Instagram account.
+    - medias (list): The media payloads returned by the Graph API, with their comments expanded.
+
+    Returns:
+    - tuple: The lists of the created or updated InstagramMedia and InstagramMediaComment instances.
+    """
+    media_rows = []
+    comment_rows = []
+    for media in medias:
+        media_rows.append(InstagramMedia(
+            instagram_media_id=media['id'],
+            author=user,
+            caption=media.get('caption', ''),
+            media_type=media['media_type'],
+            media_url=media.get('media_url', ''),
+            published_at=parse_graph_timestamp(media['timestamp']),
+        ))
+        for comment in media.get('comments', {}).get('data', []):
+            comment_rows.append(InstagramMediaComment(
+                instagram_media_comment_id=comment['id'],
+                content=comment['text'],
+                send_at=parse_graph_timestamp(comment['timestamp']),
+                media_related_id=media['id'],
+            ))
+
+    with transaction.atomic():
+        created_medias, updated_medias = InstagramMedia.objects.upsert(
+            media_rows, ['author', 'caption', 'media_type', 'media_url', 'published_at'])
+        created_comments, updated_comments = InstagramMediaComment.objects.upsert(
+            comment_rows, ['content', 'send_at', 'media_related'])
+        record_medias(user.pk, created_medias, created_comments)
+
+    return created_medias + updated_medias, created_comments + updated_comments
+
+
+def request_instagram_media(user, token, insta_id):
+    """
+    Fetches every media of an Instagram Business Account and saves them, with their comments, in the database.
+
+    Parameters:
+    - user: The user owning the Instagram account.
+    - token (str): The Facebook access token of the user.
+    - insta_id (str): The Instagram Business Account ID.
+
+    Returns:
+    - tuple: The lists of the created or updated InstagramMedia and InstagramMediaComment instances.
+    """
+    # The medias are fetched by other threads, but saved from this one only
+    return save_medias(user, fetch_medias(insta_id, token))
+
+
+def sync_instagram(user):
+    """
+    Refreshes the Instagram medias and comments of a user from the Graph API.
+
+    The user's `instagram_synced_at` watermark is moved forward once the medias are saved, so views and the
+    sync_instagram command can tell how fresh the stored data is.
+
+    Parameters:
+    - user (CustomUser): The user to synchronise, with a linked Facebook account.
+
+    Returns:
+    - tuple: The lists of the created or updated InstagramMedia and InstagramMediaComment instances, or None if
+      the user has no Facebook token.
+    """
+    token = SocialToken.objects.filter(account__user=user, account__provider='facebook').first()
+    if token is None:
+        return None
+
+    insta_id = get_instagram_account(user, token.token)
+    saved = request_instagram_media(user, token.token, insta_id)
+
+    user.instagram_synced_at = timezone.now()
+    user.save(update_fields=['instagram_synced_at'])
+    return saved
+
+
+def users_due_for_instagram_sync(max_age=INSTAGRAM_SYNC_MAX_AGE):
+    """
+    Returns the users with a linked Facebook account whose Instagram data is older than `max_age`.
+
+    Parameters:
+    - max_age (timedelta): The maximum age of the stored Instagram data.
+
+    Returns:
+    - QuerySet: The users to synchronise, the stalest first.
+    """
+    threshold = timezone.now() - max_age
+    return (CustomUser.objects.filter(socialaccount__provider='facebook', is_active=True)
+            .exclude(instagram_synced_at__gt=threshold)
+            .order_by(F('instagram_synced_at').asc(nulls_first=True))
+            .distinct())
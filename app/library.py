@@ -0,0 +1,361 @@
+from django.conf import settings
+from django.core.cache import caches
+from google.auth.credentials import Signing
+from google.auth.transport.requests import Request
+from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
+
+from .thumbnails import is_thumbnail, schedule_thumbnails, thumbnail_prefix, thumbnails_ready
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import datetime, functools, hashlib, json, posixpath, uuid
+
+# Files listed per page of the library
+GCS_LIBRARY_PAGE_SIZE = getattr(settings, 'GCS_LIBRARY_PAGE_SIZE', 100)
+
+# Seconds a folder listing is served from the 'library' cache, shared by every worker. The uploads and deletes of
+# the app refresh it right away, this only bounds how long changes made by other tools take to show.
+GCS_LISTING_CACHE_TIMEOUT = getattr(settings, 'GCS_LISTING_CACHE_TIMEOUT', 30)
+
+# Files bigger than this are sent with a resumable upload, one chunk in memory at a time. Must be a multiple of
+# 256 KB. The smaller ones are sent in a single request.
+GCS_UPLOAD_CHUNK_SIZE = getattr(settings, 'GCS_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+
+# Number of files sent at the same time by `upload_files`
+GCS_UPLOAD_MAX_WORKERS = getattr(settings, 'GCS_UPLOAD_MAX_WORKERS', 4)
+
+# The library page uploads the files straight from the browser to the bucket, which needs its CORS settings to allow
+# the site. Turned off, the files are posted to the server and uploaded by `upload_files`.
+GCS_DIRECT_UPLOADS = getattr(settings, 'GCS_DIRECT_UPLOADS', True)
+
+# Number of objects deleted, moved or copied at the same time by `bulk_operation`
+GCS_BULK_MAX_WORKERS = getattr(settings, 'GCS_BULK_MAX_WORKERS', 8)
+
+BULK_ACTIONS = ('delete', 'move', 'copy')
+
+# Lifetime of the upload URLs given to the browsers
+GCS_SIGNED_URL_EXPIRATION = getattr(settings, 'GCS_SIGNED_URL_EXPIRATION', datetime.timedelta(minutes=15))
+
+# Host the signed URLs point to, e.g. the URL of a local GCS emulator
+GCS_API_ACCESS_ENDPOINT = getattr(settings, 'GCS_API_ACCESS_ENDPOINT', 'https://storage.googleapis.com')
+
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """
+    Returns the Google Cloud Storage client of the process, created once.
+    """
+    return storage.Client()
+
+
+@functools.lru_cache(maxsize=None)
+def get_bucket():
+    """
+    Returns the handle of the library bucket, made without any request: `client.bucket()` does not fetch the
+    bucket metadata like `client.get_bucket()`.
+    """
+    return get_client().bucket(settings.GS_BUCKET_NAME)
+
+
+def parent_prefixes(name):
+    """
+    Returns the prefixes of every folder containing an object, from the root, e.g. '', 'a/' and 'a/b/' for 'a/b/c'.
+    """
+    parts = name.split('/')[:-1]
+    return [''] + ['/'.join(parts[:i]) + '/' for i in range(1, len(parts) + 1)]
+
+
+def cache_key(*parts):
+    # Object names can be longer than the keys the cache tables accept
+    return 'gcs:' + hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def listing_version(prefix):
+    return caches['library'].get_or_set(cache_key('listing-version', prefix), uuid.uuid4().hex, None)
+
+
+def invalidate_listing(*names):
+    """
+    Drops the cached listings showing objects, after they were uploaded or deleted.
+
+    Every folder containing an object is refreshed, since a new object can also make its folders appear.
+
+    Parameters:
+    - names (str): The names of the objects.
+    """
+    prefixes = {prefix for name in names for prefix in parent_prefixes(name)}
+    versions = {cache_key('listing-version', prefix): uuid.uuid4().hex for prefix in prefixes}
+    caches['library'].set_many(versions, None)
+
+
+def list_folder(prefix='', page_token=None, page_size=GCS_LIBRARY_PAGE_SIZE):
+    """
+    Lists one page of the files and subfolders of a folder of the library bucket.
+
+    Only the folder itself is listed, with the '/' delimiter, whatever the number of objects below it. The page is
+    kept in the 'library' cache for GCS_LISTING_CACHE_TIMEOUT seconds, or until an object of the folder is uploaded or deleted
+    with `invalidate_listing`.
+
+    Parameters:
+    - prefix (str): The path of the folder, ending with '/', or '' for the root of the bucket.
+    - page_token (str): The `next_page_token` of the previous page, or None for the first page.
+    - page_size (int): The maximum number of files and folders of the page.
+
+    Returns:
+    - dict: The 'files' of the page, as dicts with their 'name', 'size', 'content_type', 'updated' date and whether
+      their 'thumbnails' are ready, the 'folders' as full prefixes, and the 'next_page_token', None on the last page.
+      A page cached before the thumbnails of a new image were made shows the image until it expires.
+    """
+    cache = caches['library']
+    key = cache_key('listing', listing_version(prefix), prefix, page_token, page_size)
+    listing = cache.get(key)
+    if listing is not None:
+        return listing
+
+    iterator = get_bucket().list_blobs(prefix=prefix, delimiter='/', max_results=page_size, page_token=page_token)
+    page = next(iterator.pages)
+    files = [{'name': blob.name, 'size': blob.size, 'content_type': blob.content_type, 'updated': blob.updated,
+              'thumbnails': thumbnails_ready(blob.metadata)}
+             # The placeholder object of the folder itself is not a file
+             for blob in page if blob.name != prefix]
+    # The thumbnails are shown with their images, not as a folder of their own
+    folders = sorted(folder for folder in page.prefixes if not is_thumbnail(folder))
+    listing = {'files': files, 'folders': folders, 'next_page_token': iterator.next_page_token}
+
+    cache.set(key, listing, GCS_LISTING_CACHE_TIMEOUT)
+    return listing
+
+
+def upload_file(uploaded_file, prefix='', refresh_listing=True):
+    """
+    Uploads a file to the library bucket, streaming it from its handle.
+
+    Files bigger than GCS_UPLOAD_CHUNK_SIZE are sent with a resumable upload, in chunks of that size, so the memory
+    used does not depend on the size of the file, and a failed chunk is retried alone. The thumbnails of images are
+    made in the background.
+
+    Parameters:
+    - uploaded_file (UploadedFile): The file received by Django, in memory or spooled to disk.
+    - prefix (str): The folder to upload the file to, ending with '/', or '' for the root of the bucket.
+    - refresh_listing (bool): Invalidate the cached listing. The threads of `upload_files` leave it to the calling
+      thread.
+
+    Returns:
+    - str: The name of the uploaded object.
+
+    Raises:
+    - ValueError: If the file would be uploaded to the thumbnails folder, which is reserved.
+    """
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    if is_thumbnail(prefix + uploaded_file.name):
+        raise ValueError("The thumbnails folder is reserved")
+    chunk_size = GCS_UPLOAD_CHUNK_SIZE if uploaded_file.size > GCS_UPLOAD_CHUNK_SIZE else None
+    blob = get_bucket().blob(prefix + uploaded_file.name, chunk_size=chunk_size)
+    uploaded_file.seek(0)
+    # Uploading the same file again is harmless, so the chunks are retried even without a generation precondition
+    blob.upload_from_file(uploaded_file, size=uploaded_file.size, content_type=uploaded_file.content_type,
+                          retry=DEFAULT_RETRY)
+    if refresh_listing:
+        invalidate_listing(blob.name)
+    schedule_thumbnails(get_bucket(), blob.name, uploaded_file.content_type)
+    return blob.name
+
+
+def upload_files(uploaded_files, prefix='', max_workers=GCS_UPLOAD_MAX_WORKERS):
+    """
+    Uploads several files to the library bucket concurrently, see `upload_file`.
+
+    Parameters:
+    - uploaded_files (list): The files received by Django.
+    - prefix (str): The folder to upload the files to.
+    - max_workers (int): The maximum number of uploads in flight at the same time.
+
+    Yields:
+    - tuple: Each file, with the exception raised by its upload or None, as soon as its upload is over.
+    """
+    if not uploaded_files:
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(uploaded_files))) as executor:
+        futures = {executor.submit(upload_file, uploaded_file, prefix, refresh_listing=False): uploaded_file
+                   for uploaded_file in uploaded_files}
+        for future in as_completed(futures):
+            if future.exception() is None:
+                # From this thread, which owns the connection to the cache
+                invalidate_listing(future.result())
+            yield futures[future], future.exception()
+
+
+def signing_options():
+    """
+    Returns the extra parameters `generate_signed_url` needs to sign with the credentials of the client.
+
+    Service account keys sign locally. The credentials of App Engine or Compute Engine can not, the URLs are then
+    signed by the IAM API with their service account and access token.
+    """
+    credentials = get_client()._credentials
+    if isinstance(credentials, Signing):
+        return {}
+    if not credentials.valid:
+        credentials.refresh(Request())
+    return {'service_account_email': credentials.service_account_email, 'access_token': credentials.token}
+
+
+def create_upload_url(name, content_type, resumable=False, origin=None):
+    """
+    Returns a URL the browser can upload a file to, straight to the library bucket.
+
+    The browser sends the file with a PUT to a V4 signed URL, or to a resumable upload session, which lets it resume
+    an interrupted upload. The bucket must allow these requests from the origin of the site in its CORS settings.
+
+    Parameters:
+    - name (str): The name of the object to create.
+    - content_type (str): The content type of the file, the upload must send the same.
+    - resumable (bool): Start a resumable upload session instead of signing a URL.
+    - origin (str): The origin of the page uploading the file, allowed by the resumable session.
+
+    Returns:
+    - str: The upload URL.
+    """
+    blob = get_bucket().blob(name)
+    if resumable:
+        return blob.create_resumable_upload_session(content_type=content_type, origin=origin)
+    return blob.generate_signed_url(version='v4', expiration=GCS_SIGNED_URL_EXPIRATION, method='PUT',
+                                    content_type=content_type, api_access_endpoint=GCS_API_ACCESS_ENDPOINT,
+                                    **signing_options())
+
+
+def finish_upload(name):
+    """
+    Refreshes the listing and starts the thumbnails of an object uploaded by a browser.
+
+    Returns:
+    - Blob: The object with its metadata, or None if it was not uploaded.
+    """
+    blob = get_bucket().get_blob(name)
+    if blob is not None:
+        invalidate_listing(name)
+        schedule_thumbnails(get_bucket(), name, blob.content_type)
+    return blob
+
+
+def delete_file(name, refresh_listing=True):
+    """
+    Deletes an object of the library bucket with its thumbnails.
+
+    Parameters:
+    - name (str): The name of the object.
+    - refresh_listing (bool): Invalidate the cached listing. The threads of `bulk_operation` leave it to the calling
+      thread, so they never open database connections of their own.
+    """
+    bucket = get_bucket()
+    bucket.blob(name).delete()
+    for thumbnail in bucket.list_blobs(prefix=thumbnail_prefix(name)):
+        thumbnail.delete()
+    if refresh_listing:
+        invalidate_listing(name)
+
+
+def copy_file(name, new_name, refresh_listing=True):
+    """
+    Copies an object of the library bucket with its thumbnails, inside the bucket without downloading them.
+    """
+    bucket = get_bucket()
+    bucket.copy_blob(bucket.blob(name), bucket, new_name)
+    for thumbnail in bucket.list_blobs(prefix=thumbnail_prefix(name)):
+        bucket.copy_blob(thumbnail, bucket, thumbnail_prefix(new_name) + thumbnail.name[len(thumbnail_prefix(name)):])
+    if refresh_listing:
+        invalidate_listing(new_name)
+
+
+def move_file(name, new_name, refresh_listing=True):
+    """
+    Moves an object of the library bucket with its thumbnails. GCS has no rename, the object is copied then deleted.
+    """
+    copy_file(name, new_name, refresh_listing)
+    delete_file(name, refresh_listing)
+
+
+def expand_items(items, destination=''):
+    """
+    Returns the objects selected in the library, with their name in the destination folder.
+
+    Parameters:
+    - items (list): The names of the selected files, and the prefixes of the selected folders, ending with '/'. A
+      folder stands for every object below it, its subfolders included.
+    - destination (str): The folder the objects are moved or copied to, ending with '/', or '' for the root.
+
+    Returns:
+    - list: The (item, name, new_name) of every object, in the order of the items. A folder keeps its own name in
+      the destination, e.g. 'a/b/c.png' of the folder 'a/b/' becomes 'c/b/c.png' in 'c/'.
+
+    Raises:
+    - ValueError: If an item or the destination is in the thumbnails folder, which is reserved.
+    """
+    if is_thumbnail(destination) or any(is_thumbnail(item) for item in items):
+        raise ValueError("The thumbnails folder is reserved")
+    objects = []
+    for item in items:
+        parent = posixpath.dirname(item.rstrip('/'))
+        parent = parent + '/' if parent else ''
+        if item.endswith('/'):
+            names = [blob.name for blob in get_bucket().list_blobs(prefix=item) if not is_thumbnail(blob.name)]
+        else:
+            names = [item]
+        objects.extend((item, name, destination + name[len(parent):]) for name in names)
+    return objects
+
+
+def bulk_operation(action, items, destination='', max_workers=GCS_BULK_MAX_WORKERS):
+    """
+    Deletes, moves or copies many files and folders of the library bucket, with a bounded number of requests in
+    flight, and reports the result of every object.
+
+    A failed object does not stop the others, it is reported with its error.
+
+    Parameters:
+    - action (str): One of BULK_ACTIONS.
+    - items (list): The names of the selected files, and the prefixes of the selected folders, see `expand_items`.
+    - destination (str): The folder to move or copy to, ending with '/', or '' for the root of the bucket.
+    - max_workers (int): The maximum number of objects handled at the same time.
+
+    Returns:
+    - list: One dict per object, with the selected 'item' it belongs to, its 'name', its 'new_name' and the public
+      'url' of the new object when moved or copied, and the 'error' message or None, in the order of the items.
+    
+    Raises:
+    - ValueError: If an item or the destination is in the thumbnails folder, see `expand_items`.
+    """
+    if destination and not destination.endswith('/'):
+        destination += '/'
+    objects = expand_items(items, destination)
+
+    def run(name, new_name):
+        if action == 'delete':
+            delete_file(name, refresh_listing=False)
+        elif new_name == name:
+            # Moving an object onto itself would delete it
+            raise ValueError("The file is already in this folder")
+        elif action == 'move':
+            move_file(name, new_name, refresh_listing=False)
+        else:
+            copy_file(name, new_name, refresh_listing=False)
+
+    if not objects:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(objects))) as executor:
+        futures = [executor.submit(run, name, new_name) for item, name, new_name in objects]
+    # Every folder changed is refreshed at once, from this thread
+    changed = [name for item, name, new_name in objects]
+    if action != 'delete':
+        changed += [new_name for item, name, new_name in objects]
+    invalidate_listing(*changed)
+    if action == 'delete':
+        return [{'item': item, 'name': name, 'new_name': None, 'url': None,
+                 'error': str(future.exception()) if future.exception() else None}
+                for (item, name, new_name), future in zip(objects, futures)]
+    bucket = get_bucket()
+    return [{'item': item, 'name': name, 'new_name': new_name, 'url': bucket.blob(new_name).public_url,
+             'error': str(future.exception()) if future.exception() else None}
+            for (item, name, new_name), future in zip(objects, futures)]
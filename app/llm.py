@@ -0,0 +1,596 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+import openai, json, hashlib, datetime, random, threading, time
+
+# Approximate number of prompt tokens packed in one batched request, see get_openai_review_answers
+REVIEW_BATCH_TOKEN_BUDGET = getattr(settings, 'REVIEW_BATCH_TOKEN_BUDGET', 3000)
+
+# Generated texts are kept in the 'llm' cache, so the same prompt is only paid for once.
+LLM_CACHE_TIMEOUT = getattr(settings, 'LLM_CACHE_TIMEOUT', int(datetime.timedelta(days=7).total_seconds()))
+
+# Backend generating the texts, e.g. 'app.llm.FakeBackend' with {'latency': 2} to work offline
+LLM_BACKEND = getattr(settings, 'LLM_BACKEND', 'app.llm.OpenAIBackend')
+LLM_BACKEND_OPTIONS = getattr(settings, 'LLM_BACKEND_OPTIONS', {})
+
+# Limits of the OpenAI client shared by the whole process
+OPENAI_MAX_CONCURRENCY = getattr(settings, 'OPENAI_MAX_CONCURRENCY', 4)
+OPENAI_REQUESTS_PER_MINUTE = getattr(settings, 'OPENAI_REQUESTS_PER_MINUTE', 500)
+OPENAI_TOKENS_PER_MINUTE = getattr(settings, 'OPENAI_TOKENS_PER_MINUTE', 60000)
+OPENAI_TIMEOUT = getattr(settings, 'OPENAI_TIMEOUT', 30)
+OPENAI_MAX_RETRIES = getattr(settings, 'OPENAI_MAX_RETRIES', 4)
+
+# Seconds a whole completion may take, waits for the quotas and retries included. The views pass the interactive
+# one, which must stay well under the request deadline of App Engine.
+OPENAI_DEADLINE = getattr(settings, 'OPENAI_DEADLINE', 120)
+OPENAI_INTERACTIVE_DEADLINE = getattr(settings, 'OPENAI_INTERACTIVE_DEADLINE', 20)
+
+COMMENT_ANSWER_MODEL = "gpt-3.5-turbo-1106"
+
+# Tokens booked for the answer of a completion, on top of the prompt
+COMPLETION_TOKENS_ESTIMATE = 300
+
+RETRYABLE_ERRORS = (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.Timeout,
+                    openai.error.APIConnectionError, openai.error.TryAgain)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at a constant rate, used to stay under a per minute quota.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1, timeout=None):
+        """
+        Takes `amount` tokens from the bucket, waiting for them to be refilled if needed.
+
+        Parameters:
+        - amount (float): The number of tokens to take. It is capped to the capacity of the bucket.
+        - timeout (float): The maximum number of seconds to wait, or None to wait as long as needed.
+
+        Returns:
+        - bool: True if the tokens were taken, False if the timeout expired first.
+        """
+        amount = min(amount, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return True
+                wait = (amount - self.tokens) / self.rate
+
+            if deadline is not None:
+                if now + wait > deadline:
+                    return False
+            time.sleep(wait)
+
+
+class OpenAIBackend:
+    """
+    Backend sending the chat completions to the OpenAI API.
+    """
+
+    def create(self, model, messages, timeout=None, **options):
+        return openai.ChatCompletion.create(model=model, messages=messages, api_key=settings.OPENAI_KEY,
+                                            request_timeout=timeout, **options)
+
+
+class FakeBackend:
+    """
+    Deterministic local stand-in for OpenAI, to test and benchmark the generation paths offline.
+
+    It waits `latency` seconds, then answers with `reply`, or with a canned text derived from the prompt. Prompts
+    asking for JSON get a JSON object: one answer per key when the user message is a JSON object, as for batched
+    reviews, or the 'formal', 'friendly' and 'emoji' answers otherwise.
+    """
+
+    def __init__(self, latency=0.0, reply=None):
+        self.latency = latency
+        self.reply = reply
+
+    def create(self, model, messages, timeout=None, stream=False, **options):
+        time.sleep(self.latency)
+        content = self.answer(messages[0]['content'], messages[-1]['content'])
+        if stream:
+            return ({'choices': [{'delta': {'content': word + ' '}}]} for word in content.split())
+        return {'choices': [{'message': {'content': content}}]}
+
+    def answer(self, system, content):
+        reply = self.reply or "Merci pour votre message ! ({0})".format(
+            hashlib.sha256(content.encode()).hexdigest()[:8])
+        if 'JSON' not in system:
+            return reply
+        try:
+            batch = json.loads(content)
+        except ValueError:
+            batch = None
+        keys = list(batch) if isinstance(batch, dict) else ['formal', 'friendly', 'emoji']
+        return json.dumps(dict.fromkeys(keys, reply))
+
+
+class LLMClient:
+    """
+    Client making every chat completion of the process, within its concurrency and rate limits.
+
+    At most `max_concurrency` requests are in flight at the same time, the requests and tokens per minute are kept
+    under their quota with token buckets, every request has a timeout, and rate limits or server errors are retried
+    with an exponential backoff. A call gives up once its `deadline` is over, whatever it was waiting for.
+    """
+
+    def __init__(self, backend=None, max_concurrency=OPENAI_MAX_CONCURRENCY,
+                 requests_per_minute=OPENAI_REQUESTS_PER_MINUTE, tokens_per_minute=OPENAI_TOKENS_PER_MINUTE,
+                 timeout=OPENAI_TIMEOUT, max_retries=OPENAI_MAX_RETRIES, deadline=OPENAI_DEADLINE):
+        self.backend = backend or OpenAIBackend()
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.deadline = deadline
+
+    def chat(self, model, messages, **options):
+        """
+        Sends a chat completion request to the backend.
+
+        Parameters:
+        - model (str): The OpenAI model.
+        - messages (list): The messages of the conversation.
+        - options: Extra parameters of the completion, and the `deadline` of the call in seconds, by default the one
+          of the client.
+
+        Returns:
+        - dict: The completion returned by OpenAI.
+
+        Raises:
+        - openai.error.Timeout: If no slot or quota is available within the timeout, or the deadline is over.
+        - openai.error.OpenAIError: If the request still fails after `max_retries` retries, or can not be retried.
+        """
+        response = self.create(model, messages, **options)
+        self.slots.release()
+        return response
+
+    def stream(self, model, messages, **options):
+        """
+        Sends a chat completion request to the backend and yields the answer as it is generated.
+
+        The request is retried like with `chat` until the first chunk arrives, and keeps its concurrency slot
+        until the whole answer is received.
+
+        Parameters:
+        - model (str): The OpenAI model.
+        - messages (list): The messages of the conversation.
+        - options: Extra parameters of the completion.
+
+        Yields:
+        - str: The successive pieces of the answer.
+        """
+        response = self.create(model, messages, stream=True, **options)
+        try:
+            for chunk in response:
+                content = chunk['choices'][0]['delta'].get('content')
+                if content:
+                    yield content
+        finally:
+            self.slots.release()
+
+    def create(self, model, messages, deadline=None, **options):
+        """
+        Makes the request once the quotas allow it, retrying it when it fails with a transient error.
+
+        Every wait is cut to what is left of the deadline, and no retry is made that could not finish before it.
+        On success the concurrency slot taken for the request is still held, the caller must release it.
+        """
+        tokens = sum(estimate_tokens(message['content']) for message in messages) + COMPLETION_TOKENS_ESTIMATE
+        expires_at = time.monotonic() + (self.deadline if deadline is None else deadline)
+
+        def timeout():
+            return max(min(self.timeout, expires_at - time.monotonic()), 0)
+
+        for attempt in range(self.max_retries + 1):
+            if not self.requests.acquire(timeout=timeout()) or not self.tokens.acquire(tokens, timeout=timeout()):
+                raise openai.error.Timeout("OpenAI rate limit quota not available in time")
+            if not self.slots.acquire(timeout=timeout()):
+                raise openai.error.Timeout("No OpenAI connection available in time")
+            if not timeout():
+                self.slots.release()
+                raise openai.error.Timeout("OpenAI deadline expired")
+            try:
+                return self.backend.create(model, messages, timeout=timeout(), **options)
+            except BaseException as e:
+                # Whatever the error, e.g. a missing key or a broken backend, the slot must not leak
+                self.slots.release()
+                if not isinstance(e, openai.error.OpenAIError) or attempt == self.max_retries \
+                        or not self.is_retryable(e):
+                    raise
+                error = e
+
+            # Exponential backoff with jitter: about 1, 2, 4, 8 seconds
+            backoff = 2 ** attempt + random.random()
+            if backoff >= expires_at - time.monotonic():
+                raise error
+            time.sleep(backoff)
+
+    @staticmethod
+    def is_retryable(error):
+        if isinstance(error, RETRYABLE_ERRORS):
+            return True
+        return isinstance(error, openai.error.APIError) and (error.http_status or 500) >= 500
+
+
+def get_backend():
+    """
+    Returns the backend set by the LLM_BACKEND setting, built with the LLM_BACKEND_OPTIONS setting.
+    """
+    return import_string(LLM_BACKEND)(**LLM_BACKEND_OPTIONS)
+
+
+client = LLMClient(get_backend())
+
+
+def cache_key(model, system, content):
+    """
+    Returns the cache key of a completion, a fingerprint of everything the generated text depends on.
+
+    Parameters:
+    - model (str): The OpenAI model.
+    - system (str): The system prompt, including the user's preferences.
+    - content (str): The user message, e.g. the review or the comment.
+
+    Returns:
+    - str: The cache key.
+    """
+    fingerprint = hashlib.sha256(json.dumps([model, system, content]).encode()).hexdigest()
+    return f'completion:{fingerprint}'
+
+
+def complete(model, system, content, refresh=False, parse=None, **options):
+    """
+    Returns the answer of an OpenAI chat model to a system prompt and a user message.
+
+    The answer is read from the 'llm' cache when the exact same prompt was already sent, and stored in it otherwise.
+    When `parse` is given, a new answer is only stored once it parses, so an answer the caller can not read is
+    generated again on the next call instead of failing until it expires.
+
+    Parameters:
+    - model (str): The OpenAI model.
+    - system (str): The system prompt.
+    - content (str): The user message.
+    - refresh (bool): Ignore the cached answer and generate a new one.
+    - parse (callable): Turns the text into the value returned, raising ValueError if it can not.
+    - options: Extra parameters of the completion, e.g. `response_format`.
+
+    Returns:
+    - str: The generated text, or what `parse` returned for it.
+
+    Raises:
+    - ValueError: If `parse` rejected the answer.
+    """
+    cache = caches['llm']
+    key = cache_key(model, system, content)
+    if not refresh:
+        cached = cache.get(key)
+        if cached is not None:
+            return parse(cached) if parse else cached
+
+    response = client.chat(
+        model=model,
+        messages=[
+            {"role": "system", "content": system},
+            {"role": "user", "content": content},
+        ],
+        **options
+    )
+    answer = response['choices'][0]['message']['content']
+    parsed = parse(answer) if parse else answer
+
+    cache.set(key, answer, LLM_CACHE_TIMEOUT)
+    return parsed
+
+
+def stream_complete(model, system, content, refresh=False, **options):
+    """
+    Yields the answer of an OpenAI chat model to a system prompt and a user message as it is generated.
+
+    A cached answer is yielded at once, and a generated one is stored in the cache once complete.
+
+    Parameters:
+    - model (str): The OpenAI model.
+    - system (str): The system prompt.
+    - content (str): The user message.
+    - refresh (bool): Ignore the cached answer and generate a new one.
+    - options: Extra parameters of the completion.
+
+    Yields:
+    - str: The successive pieces of the answer.
+    """
+    cache = caches['llm']
+    key = cache_key(model, system, content)
+    if not refresh:
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    pieces = []
+    for piece in client.stream(
+        model=model,
+        messages=[
+            {"role": "system", "content": system},
+            {"role": "user", "content": content},
+        ],
+        **options
+    ):
+        pieces.append(piece)
+        yield piece
+
+    cache.set(key, ''.join(pieces), LLM_CACHE_TIMEOUT)
+
+
+def generate_insta_caption(keywords):
+    """
+
+    Generate a caption for an Instagram post based on user-provided keywords.
+
+    Parameters:
+    - keywords (string): The keywords provided by the user to create the caption.
+
+    Returns:
+    - caption (string): The generated caption for the Instagram post.
+
+    Example Usage:
+    >>> keywords = "delicious food, restaurant, trendy"
+    >>> caption = generate_insta_caption(keywords)
+    >>> print(caption)
+    "Indulge in the delicious food at our trendy restaurant. #foodie #restaurant #trendy"
+
+    """
+    return complete(
+        model="gpt-4",
+        system="You are a community manager. You will create a caption for a Instagram post for the new product thanks to the keywords that the user will give to you. The user preferences for the answer are formal and without emojis. But you can use trending hashtags. And the user's business is a restaurant",
+        content=keywords
+    )
+
+
+def get_openai_answer_default(review, deadline=None):
+    """
+    Get responses from OpenAI GPT-3.5-Turbo model for a given review.
+
+    Parameters:
+        review (str): The review text.
+        deadline (float): The seconds the completion may take, see LLMClient.
+
+    Returns:
+        dict: A dictionary containing the formal, friendly, and emoji answers from the model.
+
+    Example:
+        >>> review = "This product is amazing!"
+        >>> answers = get_openai_answer_default(review)
+        >>> answers
+        {'formal': '', 'friendly': '', 'emoji': ''}
+    """
+    parsed_content = complete(
+        model="gpt-3.5-turbo",
+        system="You are the owner of the business responding to those reviews in the corresponding language. I want three answers: one formal labeled 'formal', one more friendly labeled 'friendly', and one with emojis labeled 'emoji'. Provide your answers in JSON format",
+        content=review,
+        parse=parse_json_object,
+        deadline=deadline
+    )
+
+    # Ensure that the keys exist and provide default values if they don't
+    formal_answer = parsed_content.get('formal', '')
+    friendly_answer = parsed_content.get('friendly', '')
+    emoji_answer = parsed_content.get('emoji', '')
+
+    return {
+        'formal': formal_answer,
+        'friendly': friendly_answer,
+        'emoji': emoji_answer
+    }
+
+
+def get_openai_review_answer(review, preferences, refresh=False, deadline=None):
+    """
+    Retrieve an answer from OpenAI's GPT-3.5 Turbo model based on a given review and preferences.
+
+    Parameters:
+    - review (str): The review for which an answer is requested.
+    - preferences (str): The preferences for generating the answer.
+    - refresh (bool): Generate a new answer even if one is cached.
+    - deadline (float): The seconds the completion may take, see LLMClient.
+
+    Returns:
+    - content (str): The generated answer based on the given review and preferences.
+    """
+    return complete(
+        model="gpt-3.5-turbo-1106",
+        system="You are the owner of the business responding to those reviews in the corresponding language. I want an answer generated respecting these preferences : " + preferences,
+        content=review,
+        refresh=refresh,
+        deadline=deadline
+    )
+
+
+def estimate_tokens(text):
+    """
+    Returns a rough count of the tokens of a text, about four characters per token.
+    """
+    return len(text) // 4 + 1
+
+
+def batch_reviews(reviews, token_budget=REVIEW_BATCH_TOKEN_BUDGET):
+    """
+    Splits reviews into batches whose estimated size fits in a token budget.
+
+    Parameters:
+    - reviews (dict): The review texts, by review ID.
+    - token_budget (int): The maximum estimated number of tokens of a batch. A longer review gets a batch of its own.
+
+    Yields:
+    - dict: The review texts of a batch, by review ID.
+    """
+    batch = {}
+    batch_tokens = 0
+    for review_id, review in reviews.items():
+        tokens = estimate_tokens(review_id) + estimate_tokens(review)
+        if batch and batch_tokens + tokens > token_budget:
+            yield batch
+            batch = {}
+            batch_tokens = 0
+        batch[review_id] = review
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def parse_json_object(text):
+    """
+    Returns the JSON object of a text, raising ValueError if the text is not one.
+    """
+    parsed = json.loads(text)
+    if not isinstance(parsed, dict):
+        raise ValueError("Not a JSON object")
+    return parsed
+
+
+def get_openai_review_answers(reviews, preferences, token_budget=REVIEW_BATCH_TOKEN_BUDGET):
+    """
+    Retrieve answers to many reviews with as few requests to OpenAI as possible.
+
+    The reviews are packed into batches that fit in `token_budget`, and each batch asks for a JSON object mapping
+    every review ID to its answer. The reviews of a batch that can not be parsed, or that are missing from it, are
+    answered one by one with get_openai_review_answer.
+
+    Parameters:
+    - reviews (dict): The review texts, by review ID.
+    - preferences (str): The preferences for generating the answers.
+    - token_budget (int): The approximate number of prompt tokens of a batch.
+
+    Returns:
+    - dict: The generated answers, by review ID.
+
+    Example usage:
+    answers = get_openai_review_answers({'r1': 'Great food!', 'r2': 'Too noisy.'}, 'friendly')
+    # Output: {'r1': 'Thank you so much!', 'r2': 'Sorry to hear that...'}
+    """
+    answers = {}
+    for batch in batch_reviews(reviews, token_budget):
+        try:
+            parsed_content = complete(
+                model="gpt-3.5-turbo-1106",
+                system="You are the owner of the business responding to those reviews in the corresponding language. The reviews are given as a JSON object mapping each review ID to its text. Answer with a JSON object mapping each review ID to your answer. I want answers generated respecting these preferences : " + preferences,
+                content=json.dumps(batch, ensure_ascii=False),
+                parse=parse_json_object,
+                response_format={"type": "json_object"}
+            )
+        except ValueError:
+            parsed_content = {}
+
+        for review_id, review in batch.items():
+            answer = parsed_content.get(review_id)
+            if not isinstance(answer, str) or not answer:
+                answer = get_openai_review_answer(review, preferences)
+            answers[review_id] = answer
+    return answers
+
+
+def get_openai_comment_answer(comment, caption, preferences='', refresh=False, deadline=None):
+    """
+
+    This method, `get_openai_comment_answer`, is used to retrieve a response from the OpenAI GPT-3.5-turbo chat-based language model, given a comment and a caption.
+
+    Parameters:
+    - `comment` (str): The comment from the user.
+    - `caption` (str): The caption of the post for context.
+    - `preferences` (str): The preferences of the user for generating the answer, as for the reviews.
+    - `refresh` (bool): Generate a new answer even if one is cached.
+    - `deadline` (float): The seconds the completion may take, see LLMClient.
+
+    Returns:
+    - `content` (str): The response generated by the OpenAI model.
+
+    Example usage:
+    comment = "Great post!"
+    caption = "Check out our new product!"
+    response = get_openai_comment_answer(comment, caption)
+    print(response)
+    # Output: "Thank you! We're glad you like it. Don't forget to use the Instagram code: XXXX when placing an order!"
+
+    Note:
+    - Make sure to set the `settings.OPENAI_KEY` variable with the appropriate OpenAI API key before calling this method.
+
+    """
+    return complete(model=COMMENT_ANSWER_MODEL, system=comment_answer_prompt(caption, preferences), content=comment,
+                    refresh=refresh, deadline=deadline)
+
+
+def get_openai_comment_answers(comments, caption, preferences='', token_budget=REVIEW_BATCH_TOKEN_BUDGET):
+    """
+    Retrieve answers to many comments of a post with as few requests to OpenAI as possible.
+
+    The comments are batched like the reviews of get_openai_review_answers, and the comments of a batch that can
+    not be parsed, or that are missing from it, are answered one by one with get_openai_comment_answer.
+
+    Parameters:
+    - comments (dict): The comment texts, by comment ID.
+    - caption (str): The caption of the post for context.
+    - preferences (str): The preferences of the user for generating the answers.
+    - token_budget (int): The approximate number of prompt tokens of a batch.
+
+    Returns:
+    - dict: The generated answers, by comment ID.
+    """
+    answers = {}
+    for batch in batch_reviews(comments, token_budget):
+        try:
+            parsed_content = complete(
+                model=COMMENT_ANSWER_MODEL,
+                system=comment_answer_prompt(caption, preferences) + ". The comments are given as a JSON object mapping each comment ID to its text. Answer with a JSON object mapping each comment ID to your answer.",
+                content=json.dumps(batch, ensure_ascii=False),
+                parse=parse_json_object,
+                response_format={"type": "json_object"}
+            )
+        except ValueError:
+            parsed_content = {}
+
+        for comment_id, comment in batch.items():
+            answer = parsed_content.get(comment_id)
+            if not isinstance(answer, str) or not answer:
+                answer = get_openai_comment_answer(comment, caption, preferences)
+            answers[comment_id] = answer
+    return answers
+
+
+def stream_openai_comment_answer(comment, caption, preferences='', refresh=False, deadline=None):
+    """
+    Same as get_openai_comment_answer, but yields the answer piece by piece as it is generated.
+
+    Parameters:
+    - `comment` (str): The comment from the user.
+    - `caption` (str): The caption of the post for context.
+    - `preferences` (str): The preferences of the user for generating the answer.
+    - `refresh` (bool): Generate a new answer even if one is cached.
+    - `deadline` (float): The seconds the request may take until its first piece, see LLMClient.
+
+    Yields:
+    - str: The successive pieces of the answer.
+    """
+    return stream_complete(model=COMMENT_ANSWER_MODEL, system=comment_answer_prompt(caption, preferences),
+                           content=comment, refresh=refresh, deadline=deadline)
+
+
+def comment_answer_prompt(caption, preferences=''):
+    prompt = "You are the community Manager of the business. Answer friendly and use Instagram code. This the caption of your post for context : " + caption
+    if preferences:
+        prompt += ". I want answers generated respecting these preferences : " + preferences
+    return prompt
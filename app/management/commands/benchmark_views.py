@@ -0,0 +1,111 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from allauth.socialaccount.models import SocialAccount, SocialToken, SocialApp
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import Client
+from django.urls import reverse
+
+from app import llm
+from app.management.utils import throwaway_database
+from app.models import Location, Review, DraftReply
+from users.models import CustomUser
+
+BENCHMARKED_VIEWS = ['google_manager', 'generate_response', 'config_google']
+
+BENCHMARK_EMAIL = 'benchmark@comai.local'
+
+
+class Command(BaseCommand):
+    help = ("Measures the latency of the Google and Instagram manager views under concurrent load, offline: the "
+            "views run against a throwaway database, the LLM is replaced by the fake backend and Google by canned "
+            "payloads.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--views', nargs='+', choices=BENCHMARKED_VIEWS, default=BENCHMARKED_VIEWS,
+                            help="The views to benchmark.")
+        parser.add_argument('--concurrency', type=int, default=8, help="Number of requests in flight at the same time.")
+        parser.add_argument('--requests', type=int, default=200, help="Number of requests made to each view.")
+        parser.add_argument('--llm-latency', type=float, default=0.5,
+                            help="Seconds the fake LLM backend takes to answer.")
+        parser.add_argument('--reviews', type=int, default=200, help="Number of reviews of the benchmark user.")
+        parser.add_argument('--cached', action='store_true',
+                            help="Send the same comment every time, so the answers come from the LLM cache.")
+
+    def handle(self, *args, **options):
+        with throwaway_database(), mock.patch.object(llm.client, 'backend', llm.FakeBackend(options['llm_latency'])):
+            user = self.create_fixtures(options['reviews'])
+            with mock.patch('app.views.get_locations', return_value={'locations': self.location_payloads()}), \
+                    mock.patch('app.google_business.fetch_reviews', return_value=[]):
+                for view in options['views']:
+                    timings, errors = self.run(view, user, options)
+                    self.report(view, timings, errors, options['concurrency'])
+
+    def location_payloads(self):
+        return [{'name': 'locations/benchmark', 'title': 'Benchmark restaurant',
+                 'categories': {'primaryCategory': {'name': 'categories/gcid:restaurant',
+                                                    'displayName': 'Restaurant'}}}]
+
+    def create_fixtures(self, review_count):
+        user = CustomUser.objects.create_user(email=BENCHMARK_EMAIL, username='benchmark', password='benchmark',
+                                              answerGenerationPreferences='friendly')
+        app = SocialApp.objects.create(provider='google', name='Google', client_id='benchmark')
+        account = SocialAccount.objects.create(user=user, provider='google', uid='benchmark')
+        SocialToken.objects.create(app=app, account=account, token='benchmark', token_secret='benchmark')
+
+        location = Location.objects.create(location_id='benchmark', name='Benchmark restaurant', owner=user)
+        reviews = Review.objects.bulk_create([
+            Review(review_id=f'benchmark-{i}', location=location, reviewer_name=f'Reviewer {i}', star_rating=1 + i % 5,
+                   comment=f"Review number {i}, le repas était très bon !")
+            for i in range(review_count)
+        ])
+        DraftReply.objects.bulk_create([DraftReply(review=review, content="Merci !") for review in reviews])
+        return user
+
+    def run(self, view, user, options):
+        """
+        Makes `--requests` requests to a view from `--concurrency` threads.
+
+        Returns the durations of the requests in seconds, and the number of requests that failed.
+        """
+        session = Client()
+        session.force_login(user)
+
+        def request(i):
+            client = Client(raise_request_exception=False)
+            client.cookies = session.cookies
+            start = time.perf_counter()
+            try:
+                if view == 'generate_response':
+                    comment = "Trop beau !" if options['cached'] else f"Trop beau ! #{i}"
+                    response = client.post(reverse('app:generate_response'), {'comment': comment, 'caption': 'Menu'},
+                                           content_type='application/json')
+                elif view == 'config_google':
+                    response = client.get(reverse('app:configGoogle'))
+                else:
+                    response = client.get(reverse('app:googleManager'))
+                ok = response.status_code == 200
+            except Exception:
+                # e.g. SQLite refusing concurrent writes, Postgres does not
+                ok = False
+            finally:
+                close_old_connections()
+            return time.perf_counter() - start, ok
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(request, range(options['requests'])))
+        return [duration for duration, ok in results if ok], sum(not ok for duration, ok in results)
+
+    def report(self, view, timings, errors, concurrency):
+        if len(timings) < 2:
+            self.stdout.write(f"{view}: {errors} of {errors + len(timings)} requests failed")
+            return
+        percentiles = statistics.quantiles(timings, n=100, method='inclusive')
+        self.stdout.write(
+            f"{view}: {len(timings)} requests at concurrency {concurrency}, "
+            f"p50 {percentiles[49] * 1000:.1f} ms, p95 {percentiles[94] * 1000:.1f} ms, "
+            f"p99 {percentiles[98] * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms, {errors} error(s)"
+        )
@@ -0,0 +1,41 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from app.library import get_bucket
+from app.thumbnails import generate_thumbnails, has_thumbnails, needs_thumbnails, THUMBNAIL_MAX_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Makes the missing thumbnails of the images of the library: the ones uploaded before the thumbnails "
+            "existed, and the ones whose background job was lost with its worker. Safe to run periodically.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='', help="Only the images of this folder, e.g. 'photos/'.")
+        parser.add_argument('--workers', type=int, default=THUMBNAIL_MAX_WORKERS,
+                            help="Number of images resized at the same time.")
+        parser.add_argument('--force', action='store_true',
+                            help="Make the thumbnails again even for the images that have them or that failed.")
+
+    def handle(self, *args, **options):
+        bucket = get_bucket()
+        names = [
+            blob.name for blob in bucket.list_blobs(prefix=options['prefix'])
+            if (has_thumbnails(blob.name, blob.content_type) if options['force']
+                else needs_thumbnails(blob.name, blob.content_type, blob.metadata))
+        ]
+
+        made = failed = 0
+        with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as executor:
+            futures = {executor.submit(generate_thumbnails, bucket, name): name for name in names}
+            for future in as_completed(futures):
+                if future.exception() is None:
+                    made += 1
+                else:
+                    # One broken image must not stop the others
+                    failed += 1
+                    logger.error("Thumbnails failed for %s", futures[future], exc_info=future.exception())
+        self.stdout.write(f"Made the thumbnails of {made} image(s), {failed} failed.")
@@ -0,0 +1,104 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from allauth.socialaccount.models import SocialAccount, SocialApp, SocialToken
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app import google_business, instagram
+from app.google_business import get_locations, get_service, save_locations, sync_reviews
+from app.instagram import sync_instagram
+from app.management.commands.simulate_apis import add_fixture_arguments, fixtures_from_options
+from app.management.utils import throwaway_database
+from app.models import InstagramMedia, InstagramMediaComment, Review
+from app.simulator import SimulatorServer, simulator_settings
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = ("Measures the end-to-end throughput of the Instagram and Google sync against the local API simulator, "
+            "on a throwaway database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Number of users to synchronise.")
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help="Number of users synchronised at the same time. SQLite only supports 1.")
+        parser.add_argument('--passes', type=int, default=2,
+                            help="Number of sync passes, the first one is a full sync and the next ones incremental.")
+        add_fixture_arguments(parser)
+
+    def handle(self, *args, **options):
+        server = SimulatorServer(('127.0.0.1', 0), fixtures_from_options(options), latency=options['latency'])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls = simulator_settings(server.url)
+        try:
+            with throwaway_database(), \
+                    mock.patch.object(instagram, 'GRAPH_API_URL', urls['GRAPH_API_URL']), \
+                    mock.patch.object(google_business, 'GOOGLE_BUSINESS_API_URL', urls['GOOGLE_BUSINESS_API_URL']), \
+                    mock.patch.object(google_business, 'GOOGLE_TOKEN_URI', urls['GOOGLE_TOKEN_URI']), \
+                    mock.patch.dict(google_business.API_ENDPOINTS, mybusinessbusinessinformation=urls[
+                        'GOOGLE_BUSINESS_INFORMATION_API_URL']):
+                get_service.cache_clear()
+                users = self.create_users(options['users'])
+                for number in range(1, options['passes'] + 1):
+                    self.run_pass(f"instagram pass {number}", self.sync_instagram, users, server, options)
+                    self.run_pass(f"google pass {number}", self.sync_google, users, server, options)
+                self.stdout.write(f"Stored {InstagramMedia.objects.count()} medias, "
+                                  f"{InstagramMediaComment.objects.count()} comments and "
+                                  f"{Review.objects.count()} reviews.")
+        finally:
+            get_service.cache_clear()
+            server.shutdown()
+            server.server_close()
+
+    def create_users(self, count):
+        google = SocialApp.objects.create(provider='google', name='Google', client_id='simulated')
+        facebook = SocialApp.objects.create(provider='facebook', name='Facebook', client_id='simulated')
+        users = []
+        for i in range(count):
+            user = CustomUser.objects.create_user(email=f'load-test-{i}@comai.local', username=f'load-test-{i}',
+                                                  password='load-test')
+            for app in (google, facebook):
+                account = SocialAccount.objects.create(user=user, provider=app.provider, uid=f'account-{i}')
+                SocialToken.objects.create(app=app, account=account, token=f'token-{i}', token_secret='simulated')
+            users.append(user)
+        return users
+
+    def sync_instagram(self, user):
+        sync_instagram(user)
+
+    def sync_google(self, user):
+        token = SocialToken.objects.select_related('account').get(account__user=user, account__provider='google')
+        locations = get_locations(token.token, token, token.account.uid)
+        sync_reviews(token.token, token.account.uid, save_locations(locations['locations'], user))
+
+    def run_pass(self, name, sync, users, server, options):
+        """
+        Synchronises every user with `sync` from `--concurrency` threads, then prints the throughput of the pass.
+        """
+        def timed(user):
+            start = time.perf_counter()
+            try:
+                sync(user)
+            finally:
+                close_old_connections()
+            return time.perf_counter() - start
+
+        requests_before = server.requests
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            durations = list(executor.map(timed, users))
+        elapsed = time.perf_counter() - start
+
+        if len(durations) > 1:
+            percentiles = statistics.quantiles(durations, n=100, method='inclusive')
+        else:
+            percentiles = durations * 99
+        self.stdout.write(
+            f"{name}: {len(users)} users in {elapsed:.2f} s ({len(users) / elapsed:.1f} users/s), "
+            f"{server.requests - requests_before} API requests, per user p50 {percentiles[49] * 1000:.0f} ms, "
+            f"p95 {percentiles[94] * 1000:.0f} ms"
+        )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from app.simulator import Fixtures, SimulatorServer, simulator_settings
+
+
+class Command(BaseCommand):
+    help = ("Serves a local simulator of the Graph API and of the Google Business APIs, with generated paginated "
+            "fixtures, to load test the sync code without network access.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        add_fixture_arguments(parser)
+
+    def handle(self, *args, **options):
+        server = SimulatorServer((options['host'], options['port']), fixtures_from_options(options),
+                                 latency=options['latency'])
+        self.stdout.write(f"Simulator listening on {server.url}, point the app at it with these settings:")
+        for name, value in simulator_settings(server.url).items():
+            self.stdout.write(f"    {name} = {value!r}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+def add_fixture_arguments(parser):
+    parser.add_argument('--medias', type=int, default=100, help="Number of medias of each Instagram account.")
+    parser.add_argument('--comments', type=int, default=20, help="Number of comments of each media.")
+    parser.add_argument('--locations', type=int, default=5, help="Number of locations of each Google account.")
+    parser.add_argument('--reviews', type=int, default=200, help="Number of reviews of each location.")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the simulator waits before answering.")
+
+
+def fixtures_from_options(options):
+    return Fixtures(medias=options['medias'], comments=options['comments'], locations=options['locations'],
+                    reviews=options['reviews'])
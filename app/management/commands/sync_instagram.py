@@ -0,0 +1,57 @@
+import datetime
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app.drafts import draft_comment_replies
+from app.instagram import sync_instagram, users_due_for_instagram_sync, INSTAGRAM_SYNC_MAX_AGE
+from users.models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Refreshes the stored Instagram medias and comments of the users whose data is stale."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Email of a single user to synchronise, regardless of the watermark.")
+        parser.add_argument('--max-age', type=int, default=int(INSTAGRAM_SYNC_MAX_AGE.total_seconds()),
+                            help="Age in seconds after which a user's Instagram data is refreshed.")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running and look for stale users every --interval seconds.")
+        parser.add_argument('--interval', type=int, default=60,
+                            help="Seconds to wait between two passes when --loop is set.")
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user = CustomUser.objects.get(email=options['user'])
+            self.sync_user(user)
+            return
+
+        max_age = datetime.timedelta(seconds=options['max_age'])
+        while True:
+            self.sync_stale_users(max_age)
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def sync_stale_users(self, max_age):
+        synced = 0
+        for user in users_due_for_instagram_sync(max_age):
+            try:
+                self.sync_user(user)
+                synced += 1
+            except Exception:
+                # One broken token must not stop the whole pass
+                logger.exception("Instagram sync failed for user %s", user.pk)
+        self.stdout.write(f"Synchronised {synced} Instagram account(s).")
+
+    def sync_user(self, user):
+        saved = sync_instagram(user)
+        if saved:
+            # The replies to the new comments are drafted now so the Instagram manager never waits for the LLM
+            medias, comments = saved
+            draft_comment_replies(comments)
@@ -0,0 +1,49 @@
+import logging
+import time
+
+from allauth.socialaccount.models import SocialToken
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app.drafts import draft_review_replies
+from app.google_business import get_access_token, sync_reviews
+from app.models import Location
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Fetches the Google reviews written or edited since the last sync of every location."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Email of a single user whose locations are synchronised.")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running and synchronise the locations every --interval seconds.")
+        parser.add_argument('--interval', type=int, default=15 * 60,
+                            help="Seconds to wait between two passes when --loop is set.")
+
+    def handle(self, *args, **options):
+        while True:
+            self.sync_locations(options['user'])
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def sync_locations(self, email=None):
+        tokens = SocialToken.objects.select_related('account__user').filter(account__provider='google')
+        if email:
+            tokens = tokens.filter(account__user__email=email)
+
+        received = 0
+        for token in tokens:
+            locations = list(Location.objects.filter(owner=token.account.user))
+            try:
+                synced = sync_reviews(get_access_token(token), token.account.uid, locations)
+                received += sum(len(reviews) for reviews in synced.values())
+                # The replies are drafted now so the Google manager never waits for the LLM
+                draft_review_replies(token.account.user)
+            except Exception:
+                # One revoked token must not stop the whole pass
+                logger.exception("Review sync failed for user %s", token.account.user_id)
+        self.stdout.write(f"Received {received} new or edited review(s).")
@@ -0,0 +1,25 @@
+import contextlib
+import os
+import tempfile
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextlib.contextmanager
+def throwaway_database():
+    """
+    Runs the enclosed block against a new test database, destroyed when the block exits.
+
+    Used by the benchmark commands, so they never touch the real data. With SQLite the database is a file: an
+    in-memory one locks whole tables between threads, a file waits for its locks instead.
+    """
+    setup_test_environment()
+    if connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
@@ -0,0 +1,47 @@
+from django.db import models
+
+BULK_BATCH_SIZE = 500
+
+
+class UpsertManager(models.Manager):
+    """
+    Manager able to write a whole payload of rows with a handful of queries instead of one per row.
+    """
+
+    def upsert(self, rows, fields, compare=None, previous=None):
+        """
+        Insert the new rows and update the changed ones.
+
+        The rows are diffed against the existing primary keys in one query, then written with one
+        bulk_create and one bulk_update. Rows identical to the stored ones are not written at all.
+
+        Parameters:
+        - rows (list): Unsaved model instances with their primary key set.
+        - fields (list): The names of the fields to update.
+        - compare (list): The names of the fields telling whether a row changed, e.g. an update timestamp.
+          Defaults to `fields`.
+        - previous (dict): If given, filled with the stored version of every updated row, by primary key, with its
+          `fields` loaded, e.g. to compute what the update changes.
+
+        Returns:
+        - tuple: The list of created rows and the list of updated rows.
+        """
+        compare = compare or fields
+        attnames = [self.model._meta.get_field(field).attname for field in compare]
+        loaded = attnames if previous is None else attnames + list(fields)
+        existing = self.only(*loaded).in_bulk([row.pk for row in rows])
+
+        created = [row for row in rows if row.pk not in existing]
+        updated = [
+            row for row in rows
+            if row.pk in existing
+            and any(getattr(row, attname) != getattr(existing[row.pk], attname) for attname in attnames)
+        ]
+
+        if previous is not None:
+            previous.update((row.pk, existing[row.pk]) for row in updated)
+
+        self.bulk_create(created, batch_size=BULK_BATCH_SIZE)
+        if updated:
+            self.bulk_update(updated, fields, batch_size=BULK_BATCH_SIZE)
+        return created, updated
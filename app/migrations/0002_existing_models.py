@@ -0,0 +1,101 @@
+# Generated by Django 4.2.4 on 2026-10-18 18:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    # Creates the models that existed before their migration was tracked, only Location was. A database that already
+    # has their tables records it with `manage.py migrate app 0002 --fake`, then applies the next ones normally.
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Categorie',
+            fields=[
+                ('categorie_id', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InstagramMedia',
+            fields=[
+                ('instagram_media_id', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('caption', models.CharField(max_length=1000)),
+                ('media_type', models.CharField(choices=[('CA', 'CAROUSEL_ALBUM'), ('IM', 'IMAGE'), ('VI', 'VIDEO')], max_length=255)),
+                ('media_url', models.CharField(max_length=1000)),
+                ('published_at', models.DateTimeField(auto_now_add=True)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='instagram_post', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Photo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('upload_at', models.DateTimeField(auto_now_add=True)),
+                ('url', models.CharField(max_length=200)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photo_author', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Service',
+            fields=[
+                ('service_id', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Review',
+            fields=[
+                ('review_id', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('reviewer_name', models.CharField(max_length=255)),
+                ('reviewer_picture_url', models.CharField(max_length=255)),
+                ('star_rating', models.IntegerField()),
+                ('comment', models.CharField(max_length=255)),
+                ('pub_at', models.DateTimeField(auto_now_add=True)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_reviews', to='app.location')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PhotoObject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=40)),
+                ('confidence', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('x_min', models.DecimalField(decimal_places=2, max_digits=14, null=True)),
+                ('x_max', models.DecimalField(decimal_places=2, max_digits=14, null=True)),
+                ('y_min', models.DecimalField(decimal_places=2, max_digits=14, null=True)),
+                ('y_max', models.DecimalField(decimal_places=2, max_digits=14, null=True)),
+                ('width', models.DecimalField(decimal_places=2, max_digits=14, null=True)),
+                ('height', models.DecimalField(decimal_places=2, max_digits=14, null=True)),
+                ('is_placed', models.BooleanField(default=False)),
+                ('photo_associated', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='associated_photo', to='app.photo')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InstagramMediaComment',
+            fields=[
+                ('instagram_media_comment_id', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('content', models.CharField(max_length=255)),
+                ('send_at', models.DateTimeField(auto_now_add=True)),
+                ('media_related', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='media_comment', to='app.instagrammedia')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='categorie',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='similar_locations', to='app.categorie'),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='services',
+            field=models.ManyToManyField(related_name='locations', to='app.service'),
+        ),
+    ]
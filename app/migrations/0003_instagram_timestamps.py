@@ -0,0 +1,24 @@
+# Generated by Django 4.2.4 on 2026-10-18 18:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_existing_models'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='instagrammedia',
+            name='published_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='instagrammediacomment',
+            name='send_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.4 on 2026-10-18 18:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_instagram_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='updated_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='pub_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.4 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_review_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='reviews_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='reply',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.4 on 2026-10-18 18:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_reviews_synced_at_review_reply'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DraftReply',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content', models.TextField()),
+                ('preferences', models.CharField(blank=True, max_length=255)),
+                ('generated_at', models.DateTimeField(auto_now=True)),
+                ('comment', models.OneToOneField(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='draft', to='app.instagrammediacomment')),
+                ('review', models.OneToOneField(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='draft', to='app.review')),
+            ],
+        ),
+    ]
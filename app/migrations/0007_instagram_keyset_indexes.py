@@ -0,0 +1,21 @@
+# Generated by Django 4.2.4 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_draftreply'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='instagrammedia',
+            index=models.Index(fields=['author', 'published_at'], name='media_author_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='instagrammediacomment',
+            index=models.Index(fields=['media_related', 'send_at'], name='comment_media_send_at_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.4 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_instagram_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='instagrammedia',
+            options={'ordering': ['published_at', 'instagram_media_id']},
+        ),
+        migrations.AlterModelOptions(
+            name='instagrammediacomment',
+            options={'ordering': ['send_at', 'instagram_media_comment_id']},
+        ),
+        migrations.AlterModelOptions(
+            name='location',
+            options={'ordering': ['name', 'location_id']},
+        ),
+        migrations.AlterModelOptions(
+            name='review',
+            options={'ordering': ['pub_at', 'review_id']},
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['owner', 'name'], name='location_owner_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['location', 'pub_at'], name='review_location_pub_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['location', 'updated_at'], name='review_location_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.4 on 2026-10-18 18:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0008_orderings_and_dashboard_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('review_count', models.IntegerField(default=0)),
+                ('rating_total', models.IntegerField(default=0)),
+                ('star_counts', models.JSONField(default=list)),
+                ('unanswered_review_count', models.IntegerField(default=0)),
+                ('comment_count', models.IntegerField(default=0)),
+                ('comments_per_day', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_comment', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.instagrammediacomment')),
+                ('last_media', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.instagrammedia')),
+                ('last_review', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.review')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dashboard_snapshot', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.4 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_dashboardsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='object_name',
+            field=models.CharField(blank=True, max_length=1024),
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='url',
+            field=models.CharField(max_length=1000),
+        ),
+    ]
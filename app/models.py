@@ -1,11 +1,16 @@
 from django.db import models
+from django.utils import timezone
 from users.models import CustomUser
 
+from .managers import UpsertManager
+
 
 class Categorie(models.Model):
     categorie_id = models.CharField(max_length=50, primary_key=True)
     name = models.CharField(max_length=255)
 
+    objects = UpsertManager()
+
     def __str__(self):
         return self.name
 
@@ -15,6 +20,8 @@ class Service(models.Model):
     service_id = models.CharField(max_length=50, primary_key=True)
     name = models.CharField(max_length=255)
 
+    objects = UpsertManager()
+
     def __str__(self):
         return self.name
 
@@ -24,6 +31,16 @@ class Location(models.Model):
     owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='owned_locations')
     categorie = models.ForeignKey(Categorie, on_delete=models.SET_NULL, related_name='similar_locations', null=True)
     services = models.ManyToManyField(Service, related_name='locations')
+    reviews_synced_at = models.DateTimeField(null=True, blank=True)
+
+    objects = UpsertManager()
+
+    class Meta:
+        ordering = ['name', 'location_id']
+        indexes = [
+            # The locations of an owner, listed by name
+            models.Index(fields=['owner', 'name'], name='location_owner_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -34,8 +51,21 @@ class Review(models.Model):
     reviewer_picture_url = models.CharField(max_length=255)
     star_rating = models.IntegerField()
     comment = models.CharField(max_length=255)
+    reply = models.TextField(blank=True)
     location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='location_reviews')
-    pub_at = models.DateTimeField(auto_now_add=True)
+    pub_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(null=True)
+
+    objects = UpsertManager()
+
+    class Meta:
+        # Oldest first, so `.last()` is the newest review
+        ordering = ['pub_at', 'review_id']
+        indexes = [
+            # The last reviews of a location, and the last edited one
+            models.Index(fields=['location', 'pub_at'], name='review_location_pub_at_idx'),
+            models.Index(fields=['location', 'updated_at'], name='review_location_updated_idx'),
+        ]
 
     def __str__(self):
         return self.reviewer_name + " : " + str(self.star_rating) + "/5 : " + self.comment
@@ -53,7 +83,17 @@ class InstagramMedia(models.Model):
     caption = models.CharField(max_length=1000)
     media_type = models.CharField(max_length=255, choices=MEDIA_TYPE_CHOICES)
     media_url = models.CharField(max_length=1000)
-    published_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(default=timezone.now)
+
+    objects = UpsertManager()
+
+    class Meta:
+        # Oldest first, so `.last()` is the newest media
+        ordering = ['published_at', 'instagram_media_id']
+        indexes = [
+            # Keyset pagination of the medias of a user, see app.pagination
+            models.Index(fields=['author', 'published_at'], name='media_author_published_idx'),
+        ]
 
     def __str__ (self):
         return self.instagram_media_id
@@ -61,16 +101,69 @@ class InstagramMedia(models.Model):
 class InstagramMediaComment(models.Model):
     instagram_media_comment_id = models.CharField(max_length=30, primary_key=True)
     content = models.CharField(max_length=255)
-    send_at = models.DateTimeField(auto_now_add=True)
+    send_at = models.DateTimeField(default=timezone.now)
     media_related = models.ForeignKey(InstagramMedia, on_delete=models.CASCADE, related_name="media_comment", null=True)
 
+    objects = UpsertManager()
+
+    class Meta:
+        # Oldest first, so `.last()` is the newest comment
+        ordering = ['send_at', 'instagram_media_comment_id']
+        indexes = [
+            # Keyset pagination of the comments of a media, see app.pagination
+            models.Index(fields=['media_related', 'send_at'], name='comment_media_send_at_idx'),
+        ]
+
+    def __str__(self):
+        return self.content
+
+class DraftReply(models.Model):
+    review = models.OneToOneField(Review, on_delete=models.CASCADE, related_name='draft', null=True)
+    comment = models.OneToOneField(InstagramMediaComment, on_delete=models.CASCADE, related_name='draft', null=True)
+    content = models.TextField()
+    preferences = models.CharField(max_length=255, blank=True)
+    generated_at = models.DateTimeField(auto_now=True)
+
     def __str__(self):
         return self.content
 
+
+class DashboardSnapshot(models.Model):
+    """
+    Figures shown on the dashboard of a user, kept up to date by the sync of the reviews and of the Instagram
+    medias, so the dashboard reads one row whatever the size of the history. See app.dashboard.
+    """
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='dashboard_snapshot')
+    last_review = models.ForeignKey(Review, on_delete=models.SET_NULL, related_name='+', null=True)
+    last_media = models.ForeignKey(InstagramMedia, on_delete=models.SET_NULL, related_name='+', null=True)
+    last_comment = models.ForeignKey(InstagramMediaComment, on_delete=models.SET_NULL, related_name='+', null=True)
+
+    review_count = models.IntegerField(default=0)
+    rating_total = models.IntegerField(default=0)
+    # Number of reviews per star rating, from 1 to 5 stars
+    star_counts = models.JSONField(default=list)
+    unanswered_review_count = models.IntegerField(default=0)
+
+    comment_count = models.IntegerField(default=0)
+    # Number of comments sent each day, by ISO date, over the last DASHBOARD_COMMENT_DAYS days
+    comments_per_day = models.JSONField(default=dict)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def average_rating(self):
+        return self.rating_total / self.review_count if self.review_count else None
+
+    def __str__(self):
+        return f"Dashboard of {self.user}"
+
+
 class Photo(models.Model):
     title = models.CharField(max_length=255)
     upload_at = models.DateTimeField(auto_now_add=True)
-    url = models.CharField(max_length=200)
+    url = models.CharField(max_length=1000)
+    # Name of the object in the library bucket
+    object_name = models.CharField(max_length=1024, blank=True)
     author = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="photo_author")
 
 
@@ -0,0 +1,80 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+import base64, binascii, json
+
+DEFAULT_PAGE_SIZE = 3
+MAX_PAGE_SIZE = 50
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, pk):
+    """
+    Returns the opaque cursor pointing after the row with the given timestamp and primary key.
+    """
+    return base64.urlsafe_b64encode(json.dumps([timestamp.isoformat(), pk]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns the timestamp and primary key of a cursor made by `encode_cursor`.
+
+    Raises:
+    - InvalidCursor: If the cursor was not made by `encode_cursor`.
+    """
+    try:
+        timestamp, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        timestamp = parse_datetime(timestamp)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidCursor(cursor) from e
+    if timestamp is None:
+        raise InvalidCursor(cursor)
+    return timestamp, pk
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    """
+    Returns the page size asked in a query string parameter, within 1 and `MAX_PAGE_SIZE`.
+    """
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+
+def keyset_page(queryset, field, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Returns a page of rows, newest first, and the cursor of the next page.
+
+    The rows are ordered on `field` then on their primary key, and the page starts right after the row of the cursor
+    instead of skipping an offset, so with an index on the filtered columns and `field`, a page deep in the history
+    costs the same as the first one.
+
+    Parameters:
+    - queryset (QuerySet): The rows to paginate, already filtered. It can be a `values()` queryset, as long as it
+      selects `field` and the primary key.
+    - field (str): The name of the timestamp field the rows are sorted on.
+    - cursor (str): The `next` cursor of the previous page, or None for the first page.
+    - limit (int): The maximum number of rows of the page.
+
+    Returns:
+    - tuple: The list of rows of the page, and the cursor of the next one or None if this is the last page.
+
+    Raises:
+    - InvalidCursor: If the cursor is not valid.
+    """
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f'{field}__lt': timestamp}) | Q(**{field: timestamp, 'pk__lt': pk}))
+
+    # One extra row tells whether there is a next page
+    rows = list(queryset.order_by(f'-{field}', '-pk')[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    pk_name = queryset.model._meta.pk.attname
+    last = rows[-1] if isinstance(rows[-1], dict) else vars(rows[-1])
+    return rows, encode_cursor(last[field], last[pk_name])
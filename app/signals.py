@@ -0,0 +1,21 @@
+from allauth.socialaccount.signals import social_account_added, social_account_updated, social_account_removed
+from django.dispatch import receiver
+
+from .instagram import forget_instagram_account
+
+
+@receiver(social_account_added)
+@receiver(social_account_updated)
+def facebook_account_linked(request, sociallogin, **kwargs):
+    """
+    Forgets the stored Instagram account of a user whose Facebook account was linked again or got a new token,
+    the page it gives access to may have changed.
+    """
+    if sociallogin.account.provider == 'facebook':
+        forget_instagram_account(sociallogin.user)
+
+
+@receiver(social_account_removed)
+def facebook_account_removed(request, socialaccount, **kwargs):
+    if socialaccount.provider == 'facebook':
+        forget_instagram_account(socialaccount.user)
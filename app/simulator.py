@@ -0,0 +1,200 @@
+"""
+Local simulator of the Graph API and of the Google Business APIs, serving generated paginated fixtures.
+
+It lets the sync code be load tested without any network access or real account: point GRAPH_API_URL,
+GOOGLE_BUSINESS_API_URL, GOOGLE_BUSINESS_INFORMATION_API_URL and GOOGLE_TOKEN_URI at it (see `simulator_settings`).
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import datetime, json, re, threading, time
+
+# Page size used when the client does not ask for one
+DEFAULT_PAGE_SIZE = 25
+
+# Date of the newest generated item, the older ones are one hour apart
+NEWEST = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+STAR_RATINGS = ['ONE', 'TWO', 'THREE', 'FOUR', 'FIVE']
+
+
+def simulator_settings(url):
+    """
+    Returns the settings sending every API call of the app to a simulator listening at `url`.
+    """
+    return {
+        'GRAPH_API_URL': f'{url}/graph',
+        'GOOGLE_BUSINESS_API_URL': f'{url}/business/v4',
+        'GOOGLE_BUSINESS_INFORMATION_API_URL': f'{url}/information/',
+        'GOOGLE_TOKEN_URI': f'{url}/token',
+    }
+
+
+def timestamp(index):
+    return (NEWEST - datetime.timedelta(hours=index)).strftime("%Y-%m-%dT%H:%M:%S+0000")
+
+
+class Fixtures:
+    """
+    Deterministic data of the Facebook page and Instagram account of every token, and of every Google account.
+
+    The IDs are derived from the token or the account ID, so any number of users can be synchronised against the
+    same simulator without sharing their rows.
+    """
+
+    def __init__(self, medias=100, comments=20, locations=5, reviews=200):
+        self.medias = medias
+        self.comments = comments
+        self.locations = locations
+        self.reviews = reviews
+
+    def page(self, token):
+        return {'id': f'page-{token}', 'name': f"Simulated page {token}",
+                'instagram_business_account': {'id': f'ig-{token}'}}
+
+    def media(self, insta_id, index):
+        return {'id': f'{insta_id}-media-{index}', 'caption': f"Simulated post #{index}", 'media_type': 'IMAGE',
+                'media_url': f'https://example.com/media-{index}.jpg', 'timestamp': timestamp(index)}
+
+    def comment(self, media_id, index):
+        return {'id': f'{media_id}-comment-{index}', 'text': f"Simulated comment #{index}",
+                'timestamp': timestamp(index)}
+
+    def location(self, account_id, index):
+        return {'name': f'locations/{account_id}-location-{index}', 'title': f"Simulated location #{index}",
+                'categories': {'primaryCategory': {
+                    'name': 'categories/gcid:restaurant', 'displayName': 'Restaurant',
+                    'serviceTypes': [{'serviceTypeId': 'job_type_id:delivery', 'displayName': 'Delivery'}]}}}
+
+    def review(self, location_id, index):
+        return {'reviewId': f'{location_id}-review-{index}',
+                'reviewer': {'displayName': f"Reviewer #{index}", 'profilePhotoUrl': ''},
+                'starRating': STAR_RATINGS[index % 5], 'comment': f"Simulated review #{index}",
+                'createTime': timestamp(index).replace('+0000', 'Z'),
+                'updateTime': timestamp(index).replace('+0000', 'Z')}
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    """
+    Serves the endpoints of the APIs called by the app, with their pagination.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    routes = [
+        ('GET', re.compile(r'^/graph/me/accounts$'), 'facebook_pages'),
+        ('GET', re.compile(r'^/graph/(?P<insta_id>[^/]+)/media$'), 'instagram_medias'),
+        ('GET', re.compile(r'^/graph/(?P<media_id>[^/]+)/comments$'), 'instagram_comments'),
+        ('GET', re.compile(r'^/information/v1/accounts/(?P<account_id>[^/]+)/locations$'), 'google_locations'),
+        ('GET', re.compile(r'^/business/v4/accounts/[^/]+/locations/(?P<location_id>[^/]+)/reviews$'),
+         'google_reviews'),
+        ('POST', re.compile(r'^/token$'), 'google_token'),
+    ]
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        self.query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if method == 'POST':
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        time.sleep(self.server.latency)
+        self.server.count_request()
+        for route_method, pattern, name in self.routes:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                return self.respond(200, getattr(self, name)(**match.groupdict()))
+        self.respond(404, {'error': {'message': f"Unknown path {url.path}"}})
+
+    def respond(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+    def graph_page(self, path, items, offset, limit, query=None):
+        """
+        Returns a Graph API page of `items`, the complete list of the edge, with its `paging.next` URL.
+        """
+        page = {'data': items[offset:offset + limit]}
+        if offset + limit < len(items):
+            query = dict(self.query if query is None else query, after=str(offset + limit), limit=str(limit))
+            page['paging'] = {'next': f"http://{self.headers['Host']}{path}?{urlencode(query)}"}
+        return page
+
+    def google_page(self, key, items):
+        size = int(self.query.get('pageSize', DEFAULT_PAGE_SIZE))
+        offset = int(self.query.get('pageToken') or 0)
+        page = {key: items[offset:offset + size]}
+        if offset + size < len(items):
+            page['nextPageToken'] = str(offset + size)
+        return page
+
+    def facebook_pages(self):
+        return {'data': [self.server.fixtures.page(self.query.get('access_token', ''))]}
+
+    def instagram_medias(self, insta_id):
+        fixtures = self.server.fixtures
+        offset = int(self.query.get('after', 0))
+        limit = int(self.query.get('limit', DEFAULT_PAGE_SIZE))
+        page = self.graph_page(f'/graph/{insta_id}/media', [fixtures.media(insta_id, i) for i in range(fixtures.medias)],
+                               offset, limit)
+
+        # The comments are expanded when asked with `comments.limit(N){...}`, as the Graph API does
+        expansion = re.search(r'comments\.limit\((\d+)\)', self.query.get('fields', ''))
+        if expansion:
+            for media in page['data']:
+                comments = [fixtures.comment(media['id'], i) for i in range(fixtures.comments)]
+                media['comments'] = self.graph_page(f"/graph/{media['id']}/comments", comments, 0,
+                                                    int(expansion.group(1)),
+                                                    query={'access_token': self.query.get('access_token', '')})
+        return page
+
+    def instagram_comments(self, media_id):
+        fixtures = self.server.fixtures
+        comments = [fixtures.comment(media_id, i) for i in range(fixtures.comments)]
+        return self.graph_page(f'/graph/{media_id}/comments', comments, int(self.query.get('after', 0)),
+                               int(self.query.get('limit', DEFAULT_PAGE_SIZE)))
+
+    def google_locations(self, account_id):
+        fixtures = self.server.fixtures
+        return self.google_page('locations', [fixtures.location(account_id, i) for i in range(fixtures.locations)])
+
+    def google_reviews(self, location_id):
+        fixtures = self.server.fixtures
+        return self.google_page('reviews', [fixtures.review(location_id, i) for i in range(fixtures.reviews)])
+
+    def google_token(self):
+        return {'access_token': 'simulated', 'expires_in': 3600, 'token_type': 'Bearer'}
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server of the simulator, counting the requests it served.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, fixtures, latency=0.0):
+        super().__init__(address, SimulatorHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
@@ -0,0 +1,39 @@
+from django import template
+
+from app import library, thumbnails
+
+register = template.Library()
+
+
+def public_url(name):
+    # Made without any request
+    return library.get_bucket().blob(name).public_url
+
+
+@register.filter
+def srcset(name, format):
+    """
+    Returns the `srcset` of the thumbnails of an image of the library in a format, e.g. `{{ name|srcset:'webp' }}`.
+    """
+    return thumbnails.srcset(public_url, name, format)
+
+
+@register.filter
+def thumbnail_url(name):
+    """
+    Returns the URL of the smallest JPEG thumbnail of an image of the library, for the browsers without `srcset`.
+    """
+    return public_url(thumbnails.thumbnail_name(name, thumbnails.THUMBNAIL_WIDTHS[0], 'jpeg'))
+
+
+@register.filter
+def original_url(name):
+    return public_url(name)
+
+
+@register.filter
+def is_image(file):
+    """
+    Returns whether a file of a library listing is an image, shown by its thumbnails once `file.thumbnails` is set.
+    """
+    return thumbnails.has_thumbnails(file['name'], file['content_type'])
@@ -1,3 +1,958 @@
+import datetime
+import io
+import json
+import threading
+from pathlib import Path
+from unittest import mock
+
+import openai
+import requests
+from allauth.socialaccount.models import SocialAccount, SocialApp, SocialLogin, SocialToken
+from allauth.socialaccount.signals import social_account_updated
+from django.core.cache import caches
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template.loader import get_template
 from django.test import TestCase
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from PIL import Image
+
+from users.models import CustomUser
+from .simulator import Fixtures, SimulatorServer
+from .instagram import fetch_medias, get_instagram_account, graph_session, save_medias, users_due_for_instagram_sync
+from .models import (DashboardSnapshot, DraftReply, InstagramMedia, InstagramMediaComment, Location, Photo, Review,
+                     Service)
+from .google_business import get_service, google_session, save_locations, save_reviews, sync_reviews
+from .dashboard import rebuild_snapshot
+from .drafts import draft_comment_replies, draft_review_replies
+from .library import invalidate_listing, list_folder
+from .thumbnails import generate_thumbnails
+from . import llm
+from .llm import (FakeBackend, LLMClient, TokenBucket, get_openai_answer_default, get_openai_review_answer,
+                  get_openai_review_answers)
+
+
+class InstagramSyncTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="insta@user.com", username="insta", password="foo")
+        SocialAccount.objects.create(user=self.user, provider='facebook', uid='1')
+
+    def test_users_due_for_instagram_sync(self):
+        max_age = datetime.timedelta(minutes=15)
+        self.assertIn(self.user, users_due_for_instagram_sync(max_age))
+
+        self.user.instagram_synced_at = timezone.now()
+        self.user.save()
+        self.assertNotIn(self.user, users_due_for_instagram_sync(max_age))
+
+        self.user.instagram_synced_at = timezone.now() - datetime.timedelta(hours=1)
+        self.user.save()
+        self.assertIn(self.user, users_due_for_instagram_sync(max_age))
+
+    def test_users_without_facebook_are_not_synced(self):
+        CustomUser.objects.create_user(email="google@user.com", username="google", password="foo")
+        self.assertEqual(list(users_due_for_instagram_sync()), [self.user])
+
+    def test_instagram_account_is_resolved_once_until_relinked(self):
+        page = {'data': [{'id': 'p1', 'name': 'Restaurant', 'instagram_business_account': {'id': 'ig1'}}]}
+        with mock.patch('app.instagram.graph_get', return_value=page) as graph:
+            self.assertEqual(get_instagram_account(self.user, 'token'), 'ig1')
+            self.assertEqual(get_instagram_account(self.user, 'token'), 'ig1')
+        self.assertEqual(graph.call_count, 1)
+
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.facebook_page_id, self.user.facebook_page_name), ('p1', 'Restaurant'))
+
+        sociallogin = mock.Mock(user=self.user, account=self.user.socialaccount_set.get())
+        social_account_updated.send(sender=SocialLogin, request=None, sociallogin=sociallogin)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.instagram_business_account_id, '')
+
+
+class GraphPaginationTests(TestCase):
+
+    def graph_response(self, payload):
+        response = mock.Mock()
+        response.json.return_value = payload
+        return response
+
+    def test_fetch_medias_follows_media_and_comment_cursors(self):
+        pages = {
+            None: {'data': [{'id': 'm1', 'comments': {'data': [{'id': 'c1'}], 'paging': {'next': 'comments-2'}}}],
+                   'paging': {'next': 'medias-2'}},
+            'medias-2': {'data': [{'id': 'm2'}]},
+            'comments-2': {'data': [{'id': 'c2'}], 'paging': {'next': 'comments-3'}},
+            'comments-3': {'data': [{'id': 'c3'}]},
+        }
+
+        def get(url, params=None, timeout=None):
+            return self.graph_response(pages[None if url.endswith('/media') else url])
+
+        with mock.patch.object(graph_session, 'get', side_effect=get) as session_get:
+            medias = fetch_medias('insta', 'token')
+
+        self.assertEqual([media['id'] for media in medias], ['m1', 'm2'])
+        self.assertEqual([comment['id'] for comment in medias[0]['comments']['data']], ['c1', 'c2', 'c3'])
+        self.assertEqual(session_get.call_count, 4)
+
+
+class SimulatorTests(TestCase):
+
+    def test_fetch_medias_follows_every_page_of_the_simulator(self):
+        server = SimulatorServer(('127.0.0.1', 0), Fixtures(medias=120, comments=60))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            with mock.patch('app.instagram.GRAPH_API_URL', f'{server.url}/graph'):
+                medias = fetch_medias('ig-1', 'token')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(len(medias), 120)
+        self.assertTrue(all(len(media['comments']['data']) == 60 for media in medias))
+        # 3 pages of medias, then the second page of comments of every media
+        self.assertEqual(server.requests, 123)
+
+
+class SaveMediasTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="insta@user.com", username="insta", password="foo")
+        self.medias = [
+            {'id': f'm{i}', 'caption': f'Post {i}', 'media_type': 'IMAGE', 'media_url': f'https://cdn/{i}.jpg',
+             'timestamp': '2023-09-01T10:00:00+0000',
+             'comments': {'data': [{'id': f'm{i}c{j}', 'text': 'Nice !', 'timestamp': '2023-09-02T10:00:00+0000'}
+                                   for j in range(5)]}}
+            for i in range(10)
+        ]
+        rebuild_snapshot(self.user.pk)
+
+    def test_save_medias_writes_in_a_constant_number_of_queries(self):
+        # savepoint, select + insert medias, select + insert comments, select + update snapshot, release
+        with self.assertNumQueries(8):
+            save_medias(self.user, self.medias)
+        self.assertEqual(InstagramMedia.objects.filter(author=self.user).count(), 10)
+        self.assertEqual(InstagramMediaComment.objects.filter(media_related__author=self.user).count(), 50)
+        self.assertEqual(InstagramMedia.objects.get(pk='m0').published_at.year, 2023)
+
+    def test_save_medias_only_writes_changes(self):
+        save_medias(self.user, self.medias)
+        self.medias[3]['caption'] = 'Edited'
+
+        with self.assertNumQueries(5):
+            medias, comments = save_medias(self.user, self.medias)
+        self.assertEqual([media.pk for media in medias], ['m3'])
+        self.assertEqual(comments, [])
+        self.assertEqual(InstagramMedia.objects.get(pk='m3').caption, 'Edited')
+
+
+class SaveReviewsTests(TestCase):
+
+    def setUp(self):
+        owner = CustomUser.objects.create_user(email="google@user.com", username="google", password="foo")
+        self.location = Location.objects.create(location_id='1', name='Restaurant', owner=owner)
+        self.reviews = {'reviews': [
+            {'reviewId': f'r{i}', 'reviewer': {'displayName': f'Reviewer {i}', 'profilePhotoUrl': ''},
+             'starRating': 'FIVE', 'comment': 'Super !', 'createTime': '2023-09-01T10:00:00Z',
+             'updateTime': '2023-09-01T10:00:00Z'}
+            for i in range(20)
+        ]}
+
+    def test_save_reviews_skips_unchanged_reviews(self):
+        created, updated = save_reviews(self.reviews, self.location)
+        self.assertEqual((len(created), len(updated)), (20, 0))
+        self.assertEqual(Review.objects.get(pk='r0').pub_at.year, 2023)
+
+        self.reviews['reviews'][5].update(comment='Finalement bof', starRating='TWO',
+                                          updateTime='2023-09-03T10:00:00Z')
+        with self.assertNumQueries(6):
+            created, updated = save_reviews(self.reviews, self.location)
+        self.assertEqual((created, [review.pk for review in updated]), ([], ['r5']))
+        self.assertEqual(Review.objects.get(pk='r5').star_rating, 2)
+
+    def test_sync_reviews_stops_at_the_sync_cursor(self):
+        save_reviews(self.reviews, self.location)
+        self.location.reviews_synced_at = parse_datetime('2023-09-01T10:00:00Z')
+        new_review = dict(self.reviews['reviews'][0], reviewId='new', updateTime='2023-09-05T10:00:00Z')
+        pages = [{'reviews': [new_review] + self.reviews['reviews'][:3], 'nextPageToken': 'page-2'},
+                 {'reviews': self.reviews['reviews'][3:]}]
+
+        response = mock.Mock()
+        response.json.side_effect = pages
+        with mock.patch.object(google_session, 'get', return_value=response) as session_get:
+            reviews = sync_reviews('token', 'account', [self.location])[self.location]
+
+        self.assertEqual([review['reviewId'] for review in reviews], ['new'])
+        self.assertEqual(session_get.call_count, 1)
+        self.assertEqual(session_get.call_args.kwargs['timeout'], 10)
+        self.assertTrue(Review.objects.filter(pk='new').exists())
+        self.location.refresh_from_db()
+        self.assertEqual(self.location.reviews_synced_at, parse_datetime('2023-09-05T10:00:00Z'))
+
+
+class ConfigGoogleTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="google@user.com", username="google", password="foo")
+        account = SocialAccount.objects.create(user=self.user, provider='google', uid='42')
+        app = SocialApp.objects.create(provider='google', name='Google', client_id='id', secret='secret')
+        SocialToken.objects.create(app=app, account=account, token='token', token_secret='refresh')
+        self.client.force_login(self.user)
+
+    @mock.patch('app.views.get_locations', return_value={'locations': []})
+    def test_account_without_location_gets_an_error(self, get_locations):
+        self.assertContains(self.client.get('/app/config/Google/'), "No location is associated")
+
+    @mock.patch('app.views.sync_reviews', side_effect=requests.Timeout("Read timed out"))
+    @mock.patch('app.views.get_locations', return_value={'locations': [{'name': 'locations/1', 'title': 'Resto'}]})
+    def test_unreachable_reviews_api_gets_an_error(self, get_locations, sync):
+        self.assertContains(self.client.get('/app/config/Google/'), "Failed to retrieve reviews: Read timed out")
+
+    @mock.patch('app.views.get_openai_answer_default', return_value=['Merci'])
+    @mock.patch('app.views.sync_reviews')
+    @mock.patch('app.views.get_locations', return_value={'locations': [{'name': 'locations/1', 'title': 'Resto'}]})
+    def test_last_edited_review_is_shown_before_the_ones_without_update_time(self, get_locations, sync, answer):
+        location = Location.objects.create(location_id='1', name='Resto', owner=self.user)
+        for review_id, comment, updated_at in [('r1', 'Edited', timezone.now()), ('r2', 'Legacy', None)]:
+            Review.objects.create(review_id=review_id, reviewer_name='A', reviewer_picture_url='', star_rating=5,
+                                  comment=comment, location=location, updated_at=updated_at)
+        self.client.get('/app/config/Google/')
+        self.assertEqual(answer.call_args.args, ('Edited',))
+
+
+class DashboardSnapshotTests(TestCase):
+
+    def test_synced_figures_match_a_full_rebuild(self):
+        owner = CustomUser.objects.create_user(email="google@user.com", username="google", password="foo")
+        location = Location.objects.create(location_id='1', name='Restaurant', owner=owner)
+        reviews = [
+            {'reviewId': f'r{i}', 'reviewer': {'displayName': f'Reviewer {i}'}, 'starRating': 'FIVE',
+             'comment': 'Super !', 'createTime': f'2023-09-{i + 1:02}T10:00:00Z',
+             'updateTime': f'2023-09-{i + 1:02}T10:00:00Z'}
+            for i in range(4)
+        ]
+        save_reviews({'reviews': reviews[:2]}, location)
+        reviews[0].update(starRating='ONE', reviewReply={'comment': 'Désolé'}, updateTime='2023-09-10T10:00:00Z')
+        save_reviews({'reviews': reviews}, location)
+        save_medias(owner, [{'id': 'm1', 'media_type': 'IMAGE', 'timestamp': '2023-09-01T10:00:00+0000',
+                             'comments': {'data': [{'id': 'c1', 'text': 'Miam', 'timestamp': timezone.now().strftime(
+                                 '%Y-%m-%dT%H:%M:%S+0000')}]}}])
+
+        snapshot = DashboardSnapshot.objects.get(user=owner)
+        self.assertEqual((snapshot.review_count, snapshot.rating_total, snapshot.unanswered_review_count), (4, 16, 3))
+        self.assertEqual(snapshot.star_counts, [1, 0, 0, 0, 3])
+        self.assertEqual((snapshot.last_review_id, snapshot.last_media_id, snapshot.comment_count), ('r3', 'm1', 1))
+
+        rebuilt = rebuild_snapshot(owner.pk)
+        for field in ['review_count', 'rating_total', 'star_counts', 'unanswered_review_count', 'last_review_id',
+                      'last_media_id', 'last_comment_id', 'comment_count', 'comments_per_day']:
+            self.assertEqual(getattr(rebuilt, field), getattr(snapshot, field), field)
+
+    def test_dashboard_shows_the_stars_and_the_comments_per_day(self):
+        owner = CustomUser.objects.create_user(email="google@user.com", username="google", password="foo",
+                                               first_connection=False)
+        # Created meanwhile by another first load of the dashboard
+        DashboardSnapshot.objects.create(user=owner)
+        snapshot = rebuild_snapshot(owner.pk)
+        snapshot.star_counts = [0, 0, 1, 0, 7]
+        snapshot.comments_per_day = {timezone.now().date().isoformat(): 4}
+        snapshot.save()
+
+        self.client.force_login(owner)
+        response = self.client.get('/app/')
+        self.assertContains(response, '5 <i class="bi bi-star-fill text-primary"></i> : 7')
+        self.assertContains(response, 'style="height: 100%;"', count=1)
+        self.assertContains(response, 'style="height: 0%;"', count=29)
+
+
+class SaveLocationsTests(TestCase):
+
+    def test_save_locations_upserts_every_location(self):
+        owner = CustomUser.objects.create_user(email="google@user.com", username="google", password="foo")
+        locations = [
+            {'name': f'locations/{i}', 'title': f'Restaurant {i}',
+             'categories': {'primaryCategory': {'name': 'categories/gcid:restaurant', 'displayName': 'Restaurant',
+                                                'serviceTypes': [{'serviceTypeId': f'job_type_id:{j}',
+                                                                  'displayName': f'Service {j}'}
+                                                                 for j in range(3)]}}}
+            for i in range(5)
+        ]
+
+        saved = save_locations(locations, owner)
+        locations[0]['title'] = 'Renamed'
+        saved = save_locations(locations, owner)
+
+        self.assertEqual([location.location_id for location in saved], ['0', '1', '2', '3', '4'])
+        self.assertEqual(saved[0].name, 'Renamed')
+        self.assertEqual(Service.objects.count(), 3)
+        self.assertEqual(saved[4].services.count(), 3)
+        self.assertEqual(saved[4].categorie_id, 'restaurant')
+
+    def test_save_locations_leaves_the_locations_of_other_users(self):
+        owner = CustomUser.objects.create_user(email="google@user.com", username="google", password="foo")
+        other = CustomUser.objects.create_user(email="other@user.com", username="other", password="foo")
+        Location.objects.create(location_id='1', name='Taken', owner=other)
+
+        saved = save_locations([{'name': 'locations/1', 'title': 'Mine now'},
+                                {'name': 'locations/2', 'title': 'Mine'}], owner)
+
+        self.assertEqual([location.location_id for location in saved], ['2'])
+        self.assertEqual(Location.objects.get(pk='1').owner, other)
+        self.assertEqual(Location.objects.get(pk='1').name, 'Taken')
+
+
+class GoogleServiceTests(TestCase):
+
+    def test_get_service_is_built_once_without_network(self):
+        with mock.patch('httplib2.Http.request', side_effect=AssertionError("No request expected")):
+            service = get_service('mybusinessbusinessinformation', 'v1')
+            self.assertIs(get_service('mybusinessbusinessinformation', 'v1'), service)
+
+
+class CompletionCacheTests(TestCase):
+
+    def completion(self, text):
+        return {'choices': [{'message': {'content': text}}]}
+
+    def test_same_prompt_is_generated_once(self):
+        with mock.patch('openai.ChatCompletion.create', return_value=self.completion('Merci !')) as create:
+            self.assertEqual(get_openai_review_answer('Super resto', 'friendly'), 'Merci !')
+            self.assertEqual(get_openai_review_answer('Super resto', 'friendly'), 'Merci !')
+            self.assertEqual(create.call_count, 1)
+
+            get_openai_review_answer('Super resto', 'formal')
+            get_openai_review_answer('Super resto', 'friendly', refresh=True)
+            self.assertEqual(create.call_count, 3)
+
+    def test_unparsable_answer_is_not_cached(self):
+        answers = [self.completion('```json\n{"formal": "Merci"}\n```'), self.completion('{"formal": "Merci"}')]
+        with mock.patch('openai.ChatCompletion.create', side_effect=answers) as create:
+            with self.assertRaises(ValueError):
+                get_openai_answer_default('Pas mal')
+            self.assertEqual(get_openai_answer_default('Pas mal')['formal'], 'Merci')
+            self.assertEqual(get_openai_answer_default('Pas mal')['formal'], 'Merci')
+            self.assertEqual(create.call_count, 2)
+
+
+class DraftRepliesTests(TestCase):
+
+    def setUp(self):
+        self.owner = CustomUser.objects.create_user(email="google@user.com", username="google", password="foo",
+                                                    answerGenerationPreferences='friendly')
+        location = Location.objects.create(location_id='1', name='Restaurant', owner=self.owner)
+        Review.objects.create(review_id='unanswered', reviewer_name='A', star_rating=5, comment='Super !',
+                              location=location)
+        Review.objects.create(review_id='answered', reviewer_name='B', star_rating=4, comment='Bien',
+                              reply='Merci', location=location)
+
+    @mock.patch('app.drafts.get_openai_review_answers',
+                side_effect=lambda reviews, preferences: dict.fromkeys(reviews, 'Merci beaucoup !'))
+    def test_only_unanswered_reviews_without_current_draft_are_drafted(self, generate):
+        self.assertEqual([draft.review_id for draft in draft_review_replies(self.owner)], ['unanswered'])
+        self.assertEqual(draft_review_replies(self.owner), [])
+
+        self.owner.answerGenerationPreferences = 'formal'
+        self.assertEqual(len(draft_review_replies(self.owner)), 1)
+        self.assertEqual(DraftReply.objects.get(review_id='unanswered').preferences, 'formal')
+        self.assertEqual(generate.call_count, 2)
+
+    def test_answered_last_review_shows_its_reply(self):
+        self.client.force_login(self.owner)
+        response = self.client.get('/app/googleManager')
+        self.assertContains(response, 'Merci')
+        self.assertNotContains(response, 'en cours de préparation')
+        self.assertNotContains(response, 'regenerate-answer"')
+
+    @mock.patch('app.drafts.get_openai_review_answer', return_value='Merci encore !')
+    def test_only_the_owner_regenerates_a_draft(self, generate):
+        def regenerate():
+            return self.client.post('/app/drafts/regenerate', {'review_id': 'unanswered'},
+                                    content_type='application/json')
+
+        self.assertEqual(regenerate().status_code, 302)
+        other = CustomUser.objects.create_user(email="other@user.com", username="other", password="foo")
+        self.client.force_login(other)
+        self.assertEqual(regenerate().status_code, 404)
+        self.client.force_login(self.owner)
+        self.assertEqual(regenerate().json(), {'response': 'Merci encore !'})
+        generate.assert_called_once_with('Super !', 'friendly', refresh=True, deadline=20)
+
+
+class DraftCommentRepliesTests(TestCase):
+
+    @mock.patch('app.drafts.get_openai_comment_answers',
+                side_effect=lambda comments, caption, preferences: {pk: f'Merci ({caption}, {preferences})'
+                                                                    for pk in comments})
+    def test_only_the_given_comments_are_drafted_in_one_batch_per_post(self, generate):
+        user = CustomUser.objects.create_user(email="insta@user.com", username="insta", password="foo",
+                                              answerGenerationPreferences='formal')
+        for media_id in ('m1', 'm2'):
+            media = InstagramMedia.objects.create(instagram_media_id=media_id, author=user, caption=media_id)
+            InstagramMediaComment.objects.bulk_create([
+                InstagramMediaComment(instagram_media_comment_id=f'{media_id}c{i}', content='Miam', media_related=media)
+                for i in range(3)
+            ])
+        DraftReply.objects.create(comment_id='m1c0', content='Déjà fait')
+
+        new_comments = InstagramMediaComment.objects.exclude(pk__in=['m1c2', 'm2c2'])
+        drafts = draft_comment_replies(list(new_comments))
+        self.assertEqual(sorted(draft.comment_id for draft in drafts), ['m1c1', 'm2c0', 'm2c1'])
+        self.assertEqual(DraftReply.objects.get(comment_id='m2c1').content, 'Merci (m2, formal)')
+        self.assertEqual(DraftReply.objects.get(comment_id='m2c1').preferences, 'formal')
+        self.assertEqual(generate.call_count, 2)
+
+
+class BatchedReviewAnswersTests(TestCase):
+
+    def completion(self, text):
+        return {'choices': [{'message': {'content': text}}]}
+
+    def test_reviews_are_answered_in_batches(self):
+        reviews = {f'r{i}': 'x' * 400 for i in range(10)}
+
+        def create(model, messages, **options):
+            batch = json.loads(messages[1]['content'])
+            return self.completion(json.dumps({review_id: f'Merci {review_id}' for review_id in batch}))
+
+        with mock.patch('openai.ChatCompletion.create', side_effect=create) as chat:
+            answers = get_openai_review_answers(reviews, 'friendly', token_budget=500)
+
+        self.assertEqual(answers['r7'], 'Merci r7')
+        self.assertEqual(len(answers), 10)
+        self.assertEqual(chat.call_count, 3)
+
+    def test_unparsable_batch_falls_back_to_one_request_per_review(self):
+        answers = iter([self.completion('Not JSON'), self.completion('Merci A'), self.completion('Merci B')])
+        with mock.patch('openai.ChatCompletion.create', side_effect=lambda **kwargs: next(answers)):
+            self.assertEqual(get_openai_review_answers({'a': 'Top', 'b': 'Bof'}, 'formal'),
+                             {'a': 'Merci A', 'b': 'Merci B'})
+
+
+class LLMClientTests(TestCase):
+
+    def test_token_bucket_gives_up_after_timeout(self):
+        bucket = TokenBucket(per_minute=60)
+        self.assertTrue(bucket.acquire(60, timeout=0))
+        self.assertFalse(bucket.acquire(30, timeout=0.1))
+
+    @mock.patch('time.sleep')
+    def test_rate_limits_and_server_errors_are_retried(self, sleep):
+        errors = [openai.error.RateLimitError("Slow down"), openai.error.APIError("Oops", http_status=502)]
+
+        def create(**kwargs):
+            if errors:
+                raise errors.pop(0)
+            return {'choices': [{'message': {'content': 'Merci !'}}]}
+
+        with mock.patch('openai.ChatCompletion.create', side_effect=create) as chat:
+            response = LLMClient(max_retries=2).chat('gpt-3.5-turbo', [{'role': 'user', 'content': 'Super'}])
+
+        self.assertEqual(response['choices'][0]['message']['content'], 'Merci !')
+        self.assertEqual(chat.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    @mock.patch('time.sleep')
+    def test_invalid_requests_are_not_retried(self, sleep):
+        error = openai.error.InvalidRequestError("Bad request", param=None)
+        with mock.patch('openai.ChatCompletion.create', side_effect=error) as chat:
+            with self.assertRaises(openai.error.InvalidRequestError):
+                LLMClient().chat('gpt-3.5-turbo', [{'role': 'user', 'content': 'Super'}])
+        self.assertEqual(chat.call_count, 1)
+
+    @mock.patch('time.sleep')
+    def test_no_retry_is_made_past_the_deadline(self, sleep):
+        error = openai.error.RateLimitError("Slow down")
+        with mock.patch('openai.ChatCompletion.create', side_effect=error) as chat:
+            with self.assertRaises(openai.error.RateLimitError):
+                LLMClient(max_retries=4).chat('gpt-3.5-turbo', [{'role': 'user', 'content': 'Super'}], deadline=3)
+        # Backoffs of about 1 and 2 seconds fit in the deadline, not the next one of about 4 seconds
+        self.assertEqual((chat.call_count, sleep.call_count), (3, 2))
+        self.assertLessEqual(chat.call_args.kwargs['request_timeout'], 3)
+
+    def test_any_backend_error_releases_the_slot(self):
+        backend = mock.Mock()
+        backend.create.side_effect = [AttributeError("OPENAI_KEY"), {'choices': [{'message': {'content': 'Merci !'}}]}]
+        client = LLMClient(backend, max_concurrency=1, timeout=0.1)
+        with self.assertRaises(AttributeError):
+            client.chat('gpt-3.5-turbo', [{'role': 'user', 'content': 'Super'}])
+        self.assertEqual(client.chat('gpt-3.5-turbo', [{'role': 'user', 'content': 'Super'}])['choices'][0]
+                         ['message']['content'], 'Merci !')
+        self.assertEqual(backend.create.call_count, 2)
+
+    def test_fake_backend_answers_offline(self):
+        with mock.patch.object(llm.client, 'backend', FakeBackend(reply='Merci !')), \
+                mock.patch('openai.ChatCompletion.create', side_effect=AssertionError("No request expected")):
+            answers = get_openai_review_answers({'r1': 'Super', 'r2': 'Bof'}, 'friendly')
+            streamed = ''.join(llm.client.stream('gpt-3.5-turbo', [{'role': 'user', 'content': 'Super'}]))
+
+        self.assertEqual(answers, {'r1': 'Merci !', 'r2': 'Merci !'})
+        self.assertEqual(streamed.strip(), 'Merci !')
+
+
+class GenerateResponseStreamTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="insta@user.com", username="insta", password="foo")
+        media = InstagramMedia.objects.create(instagram_media_id='m1', author=self.user, caption='Nouveau burger')
+        InstagramMediaComment.objects.create(instagram_media_comment_id='c1', content='Miam', media_related=media)
+        self.client.force_login(self.user)
+
+    def test_answer_is_streamed_and_saved_as_draft(self):
+        chunks = [{'choices': [{'delta': {'content': piece}}]} for piece in ['Merci', ' !']]
+        with mock.patch('openai.ChatCompletion.create', return_value=iter(chunks)):
+            response = self.client.post('/app/InstagramManager/generate_response/stream',
+                                        data={'comment_id': 'c1'}, content_type='application/json')
+            body = b''.join(response.streaming_content).decode()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('data: {"token": "Merci"}\n\n', body)
+        self.assertTrue(body.endswith('event: done\ndata: {}\n\n'))
+        self.assertEqual(DraftReply.objects.get(comment_id='c1').content, 'Merci !')
+
+    def stream(self):
+        response = self.client.post('/app/InstagramManager/generate_response/stream', data={'comment_id': 'c1'},
+                                    content_type='application/json')
+        return response, b''.join(response.streaming_content).decode() if response.streaming else None
+
+    def test_a_failed_generation_ends_the_stream_with_an_error(self):
+        with mock.patch('openai.ChatCompletion.create', side_effect=openai.error.InvalidRequestError("Bad", None)), \
+                self.assertLogs('app.views', 'ERROR'):
+            response, body = self.stream()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('"error": ', body)
+        self.assertTrue(body.endswith('event: done\ndata: {}\n\n'))
+        self.assertFalse(DraftReply.objects.exists())
+
+    def test_only_the_author_of_the_post_streams_an_answer(self):
+        with mock.patch('openai.ChatCompletion.create', side_effect=AssertionError("No request expected")):
+            self.client.logout()
+            self.assertEqual(self.stream()[0].status_code, 302)
+            other = CustomUser.objects.create_user(email="other@user.com", username="other", password="foo")
+            self.client.force_login(other)
+            self.assertEqual(self.stream()[0].status_code, 404)
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="insta@user.com", username="insta", password="foo")
+        media = InstagramMedia.objects.create(instagram_media_id='m1', author=self.user, caption='Nouveau burger')
+        sent_at = timezone.now()
+        # Comments sent at the same time are told apart by their ID
+        InstagramMediaComment.objects.bulk_create([
+            InstagramMediaComment(instagram_media_comment_id=f'c{i:02}', content='Miam', media_related=media,
+                                  send_at=sent_at - datetime.timedelta(minutes=i // 2))
+            for i in range(7)
+        ])
+        DraftReply.objects.create(comment_id='c01', content='Merci !')
+        self.client.force_login(self.user)
+
+    def test_comments_are_paged_with_a_cursor(self):
+        url = '/app/instagramManager/fetch_recent_comments/m1/'
+        ids = []
+        cursor = ''
+        for page in range(3):
+            with self.assertNumQueries(4):
+                data = self.client.get(url, {'limit': 3, 'cursor': cursor}).json()
+            ids += [comment['instagram_media_comment_id'] for comment in data['comments']]
+            cursor = data['next_cursor']
+
+            if page == 0:
+                self.assertEqual([comment['draft'] for comment in data['comments']], ['Merci !', None, None])
+
+        self.assertIsNone(cursor)
+        self.assertEqual(ids, ['c01', 'c00', 'c03', 'c02', 'c05', 'c04', 'c06'])
+        self.assertEqual(self.client.get(url, {'cursor': 'nope'}).status_code, 400)
+
+    def test_anonymous_requests_are_redirected_to_the_login(self):
+        self.client.logout()
+        for url in ['/app/instagramManager/fetch_recent_comments/m1/', '/app/instagramManager/fetch_recent_posts/',
+                    '/app/instagramManager/posts/']:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 302)
+
+
+class HotQueryTests(TestCase):
+    """
+    Query counts of the views read on every page load, which must not grow with the history of the user, and the
+    index used by each of their main queries.
+    """
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="owner@user.com", username="owner", password="foo",
+                                                   first_connection=False)
+        location = Location.objects.create(location_id='1', name='Restaurant', owner=self.user)
+        Review.objects.bulk_create([
+            Review(review_id=f'r{i}', location=location, reviewer_name='Reviewer', star_rating=5, comment='Super !',
+                   pub_at=timezone.now() - datetime.timedelta(days=i))
+            for i in range(30)
+        ])
+        media = InstagramMedia.objects.create(instagram_media_id='m1', author=self.user, caption='Nouveau burger')
+        InstagramMediaComment.objects.bulk_create([
+            InstagramMediaComment(instagram_media_comment_id=f'c{i}', content='Miam', media_related=media)
+            for i in range(30)
+        ])
+        rebuild_snapshot(self.user.pk)
+        self.client.force_login(self.user)
+
+    def test_view_query_counts(self):
+        views = [
+            ('/app/', 4),
+            ('/app/googleManager', 6),
+            ('/app/instagramManager/posts/', 3),
+            ('/app/instagramManager/fetch_recent_comments/m1/', 4),
+        ]
+        for url, queries in views:
+            with self.subTest(url=url), self.assertNumQueries(queries):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_hot_queries_use_their_index(self):
+        queries = [
+            (Location.objects.filter(owner=self.user), 'location_owner_name_idx'),
+            (Review.objects.filter(location_id='1').order_by('-pub_at'), 'review_location_pub_at_idx'),
+            (Review.objects.filter(location_id='1').order_by('-updated_at'), 'review_location_updated_idx'),
+            (InstagramMedia.objects.filter(author=self.user).reverse()[:1], 'media_author_published_idx'),
+            (InstagramMediaComment.objects.filter(media_related='m1').reverse()[:1], 'comment_media_send_at_idx'),
+        ]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # The test tables are tiny, a sequential scan would always win
+                cursor.execute("SET enable_seqscan = off")
+        for queryset, index in queries:
+            with self.subTest(index=index):
+                self.assertIn(index, queryset.explain())
+
+
+class RecentPostsTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="insta@user.com", username="insta", password="foo")
+        other = CustomUser.objects.create_user(email="other@user.com", username="other", password="foo")
+        published_at = timezone.now()
+        InstagramMedia.objects.bulk_create(
+            [InstagramMedia(instagram_media_id=f'm{i}', author=self.user, caption=f'Post {i}',
+                            published_at=published_at - datetime.timedelta(days=i)) for i in range(5)]
+            + [InstagramMedia(instagram_media_id='other', author=other, caption='Other', published_at=published_at)]
+        )
+        InstagramMediaComment.objects.bulk_create([
+            InstagramMediaComment(instagram_media_comment_id=f'm{i}c{j}', content='Miam', media_related_id=f'm{i}',
+                                  send_at=published_at + datetime.timedelta(minutes=j))
+            for i in range(5) for j in range(6)
+        ])
+        DraftReply.objects.create(comment_id='m0c5', content='Merci !')
+        self.client.force_login(self.user)
+
+    def test_feed_is_read_in_a_constant_number_of_queries(self):
+        # session, user, medias, comments
+        with self.assertNumQueries(4):
+            posts = self.client.get('/app/instagramManager/fetch_recent_posts/', {'posts': 4}).json()
+
+        self.assertEqual([post['media_id'] for post in posts], ['m0', 'm1', 'm2', 'm3'])
+        self.assertEqual([comment['instagram_media_comment_id'] for comment in posts[0]['comments']],
+                         ['m0c5', 'm0c4', 'm0c3'])
+        self.assertEqual(posts[0]['comments'][0]['draft'], 'Merci !')
+        self.assertIsNone(posts[1]['comments'][0]['draft'])
+
+
+class LibraryListingTests(TestCase):
+
+    def setUp(self):
+        caches['library'].clear()
+        self.bucket = mock.Mock()
+
+        def list_blobs(prefix, delimiter, max_results, page_token):
+            page = mock.MagicMock(prefixes=(f'{prefix}sub/',))
+            blobs = [mock.Mock(size=3, content_type='image/png', updated=None, metadata={'thumbnails': 'ready'}),
+                     mock.Mock(size=3, content_type='image/png', updated=None, metadata=None)]
+            blobs[0].name = f'{prefix}photo.png'
+            blobs[1].name = f'{prefix}new.png'
+            page.__iter__.return_value = iter(blobs)
+            return mock.Mock(pages=iter([page]), next_page_token='next')
+
+        self.bucket.list_blobs.side_effect = list_blobs
+        patcher = mock.patch('app.library.get_bucket', return_value=self.bucket)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_listing_is_cached_until_an_upload(self):
+        listing = list_folder('photos/')
+        self.assertEqual([(file['name'], file['thumbnails']) for file in listing['files']],
+                         [('photos/photo.png', True), ('photos/new.png', False)])
+        self.assertEqual((listing['folders'], listing['next_page_token']), (['photos/sub/'], 'next'))
+        self.assertEqual(list_folder('photos/'), listing)
+        self.assertEqual(self.bucket.list_blobs.call_count, 1)
+        self.bucket.list_blobs.assert_called_with(prefix='photos/', delimiter='/', max_results=100, page_token=None)
+
+        list_folder('')
+        invalidate_listing('photos/new.png')
+        list_folder('photos/')
+        list_folder('')
+        self.assertEqual(self.bucket.list_blobs.call_count, 4)
+
+    def test_library_page_renders_the_listing_with_thumbnails(self):
+        self.bucket.blob.side_effect = lambda name: mock.Mock(public_url=f'https://storage.example.com/{name}')
+        response = self.client.get('/app/librairy/photos/')
+        self.assertContains(response, 'href="/app/librairy/photos/sub"')
+        self.assertContains(response, 'srcset="https://storage.example.com/thumbnails/photos/photo.png/160.webp 160w')
+        self.assertContains(response, 'src="https://storage.example.com/thumbnails/photos/photo.png/160.jpeg"')
+        # Shown as is until its thumbnails are made
+        self.assertContains(response, '<img src="https://storage.example.com/photos/new.png"')
+        self.assertNotContains(response, 'thumbnails/photos/new.png')
+
+
+class TemplateTests(TestCase):
+
+    def test_every_template_compiles(self):
+        # e.g. a block defined twice only fails when the page is rendered
+        templates = Path(__file__).parent / 'templates'
+        for template in templates.rglob('*.html'):
+            get_template(template.relative_to(templates).as_posix())
+
+
+class LibraryUploadTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="photo@user.com", username="photo", password="foo")
+        self.client.force_login(self.user)
+        patcher = mock.patch('app.library.schedule_thumbnails')
+        self.schedule_thumbnails = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('app.library.GCS_UPLOAD_CHUNK_SIZE', 4)
+    @mock.patch('app.library.get_bucket')
+    def test_big_files_are_streamed_in_chunks(self, get_bucket):
+        for name, content in (('small.png', b'abc'), ('video.mp4', b'0123456789')):
+            upload = SimpleUploadedFile(name, content, content_type='image/png')
+            self.client.post('/app/librairy/upload/', {'file': upload, 'path': 'photos/'})
+
+        blobs = {call.args[0]: call.kwargs['chunk_size'] for call in get_bucket.return_value.blob.call_args_list}
+        self.assertEqual(blobs, {'photos/small.png': None, 'photos/video.mp4': 4})
+        upload = get_bucket.return_value.blob.return_value.upload_from_file
+        self.assertEqual([call.kwargs['size'] for call in upload.call_args_list], [3, 10])
+
+        response = self.client.post('/app/librairy/upload/', {'file': SimpleUploadedFile('x.webp', b'abc'),
+                                                              'path': 'thumbnails/'})
+        self.assertEqual(response.status_code, 400)
+        self.client.logout()
+        response = self.client.post('/app/librairy/upload/', {'file': SimpleUploadedFile('x.png', b'abc')})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(get_bucket.return_value.blob.call_count, 2)
+
+    @mock.patch('app.library.GCS_UPLOAD_CHUNK_SIZE', 4)
+    @mock.patch('app.library.get_bucket')
+    def test_files_are_uploaded_concurrently_with_progress(self, get_bucket):
+        def blob(name, chunk_size=None):
+            blob = mock.Mock()
+            blob.name = name
+            return blob
+        get_bucket.return_value.blob.side_effect = blob
+        files = [SimpleUploadedFile('small.png', b'abc', content_type='image/png'),
+                 SimpleUploadedFile('video.mp4', b'0123456789', content_type='video/mp4')]
+        response = self.client.post('/app/librairy/upload/multiple/', {'files': files, 'path': 'photos/'})
+        events = b''.join(response.streaming_content).decode().split('\n\n')
+
+        progress = [json.loads(event[len('data: '):]) for event in events[:2]]
+        self.assertEqual(sorted(event['name'] for event in progress), ['small.png', 'video.mp4'])
+        self.assertEqual((progress[-1]['done'], progress[-1]['done_bytes'], progress[-1]['total_bytes']), (2, 13, 13))
+        self.assertEqual(events[2], 'event: done\ndata: {}')
+        blobs = {call.args[0]: call.kwargs['chunk_size'] for call in get_bucket.return_value.blob.call_args_list}
+        self.assertEqual(blobs, {'photos/small.png': None, 'photos/video.mp4': 4})
+
+        response = self.client.post('/app/librairy/upload/multiple/',
+                                    {'files': [SimpleUploadedFile('x.webp', b'abc')], 'path': 'thumbnails/'})
+        error = json.loads(b''.join(response.streaming_content).decode().split('\n\n')[0][len('data: '):])['error']
+        self.assertEqual(error, "The thumbnails folder is reserved")
+        self.assertEqual(get_bucket.return_value.blob.call_count, 2)
+
+        self.client.logout()
+        response = self.client.post('/app/librairy/upload/multiple/', {'files': files})
+        self.assertEqual(response.status_code, 302)
+
+    @mock.patch('app.library.signing_options', return_value={})
+    @mock.patch('app.library.get_bucket')
+    def test_browser_uploads_straight_to_the_bucket(self, get_bucket, signing_options):
+        blob = get_bucket.return_value.blob.return_value
+        blob.generate_signed_url.return_value = 'https://storage.example.com/signed'
+        response = self.client.post('/app/librairy/upload/url/',
+                                    {'name': 'menu.png', 'content_type': 'image/png', 'path': 'photos/'},
+                                    content_type='application/json')
+        self.assertEqual(response.json()['upload_url'], 'https://storage.example.com/signed')
+        self.assertEqual(response.json()['object_name'], 'photos/menu.png')
+        get_bucket.return_value.blob.assert_called_once_with('photos/menu.png')
+        self.assertEqual(blob.generate_signed_url.call_args.kwargs['method'], 'PUT')
+        self.assertEqual(blob.generate_signed_url.call_args.kwargs['content_type'], 'image/png')
+
+        response = self.client.post('/app/librairy/upload/url/', {'name': 'x.webp', 'path': 'thumbnails/photos/'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        get_bucket.return_value.get_blob.return_value = None
+        response = self.client.post('/app/librairy/upload/complete/', {'object_name': 'photos/menu.png'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+        uploaded = get_bucket.return_value.get_blob.return_value = mock.Mock(
+            public_url='https://storage.example.com/bucket/photos/menu.png')
+        uploaded.name = 'photos/menu.png'
+        for status in (201, 200):
+            response = self.client.post('/app/librairy/upload/complete/', {'object_name': 'photos/menu.png'},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, status)
+        self.assertEqual(self.schedule_thumbnails.call_args.args[1], 'photos/menu.png')
+        photo = Photo.objects.get(author=self.user)
+        self.assertEqual((photo.title, photo.object_name, photo.url),
+                         ('menu.png', 'photos/menu.png', 'https://storage.example.com/bucket/photos/menu.png'))
+
+        self.client.logout()
+        for url in ('/app/librairy/upload/url/', '/app/librairy/upload/complete/'):
+            response = self.client.post(url, {'name': 'menu.png', 'object_name': 'photos/menu.png'},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(get_bucket.return_value.blob.call_count, 1)
+
+
+class LibraryBulkTests(TestCase):
+
+    def setUp(self):
+        caches['library'].clear()
+        self.user = CustomUser.objects.create_user(email="bulk@user.com", username="bulk", password="foo")
+        self.client.force_login(self.user)
+        self.objects = {'a/one.png', 'a/b/two.png', 'three.png', 'thumbnails/three.png/160.webp'}
+        self.bucket = mock.Mock()
+
+        def blob(name):
+            blob = mock.Mock(public_url=f'https://storage.example.com/{name}')
+            blob.name = name
+            blob.delete.side_effect = lambda: self.objects.remove(name)
+            return blob
+
+        def copy_blob(source, bucket, new_name):
+            if source.name not in self.objects:
+                raise ValueError("No such object")
+            self.objects.add(new_name)
+
+        self.bucket.blob.side_effect = blob
+        self.bucket.copy_blob.side_effect = copy_blob
+        self.bucket.list_blobs.side_effect = lambda prefix: [blob(name) for name in sorted(self.objects)
+                                                             if name.startswith(prefix)]
+        patcher = mock.patch('app.library.get_bucket', return_value=self.bucket)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bulk(self, action, items, destination=''):
+        return self.client.post('/app/librairy/bulk/', {'action': action, 'items': items, 'destination': destination},
+                                content_type='application/json').json()
+
+    def test_files_and_folders_are_moved_copied_and_deleted_with_a_result_each(self):
+        Photo.objects.create(title='three.png', url='https://storage.example.com/three.png', object_name='three.png',
+                             author=self.user)
+        response = self.bulk('move', ['a/', 'three.png', 'missing.png'], 'c/')
+        self.assertEqual((response['succeeded'], response['failed']), (3, 1))
+        self.assertEqual([(result['name'], result['new_name']) for result in response['results']],
+                         [('a/b/two.png', 'c/a/b/two.png'), ('a/one.png', 'c/a/one.png'), ('three.png', 'c/three.png'),
+                          ('missing.png', 'c/missing.png')])
+        self.assertEqual(self.objects, {'c/a/one.png', 'c/a/b/two.png', 'c/three.png',
+                                        'thumbnails/c/three.png/160.webp'})
+        self.assertEqual(Photo.objects.get().url, 'https://storage.example.com/c/three.png')
+
+        self.assertEqual(self.bulk('copy', ['c/three.png'], 'c')['results'][0]['error'],
+                         "The file is already in this folder")
+        self.assertEqual(self.bulk('copy', ['c/a/'])['succeeded'], 2)
+        self.assertIn('a/one.png', self.objects)
+
+        self.assertEqual(self.bulk('delete', ['c/'])['succeeded'], 3)
+        self.assertEqual(self.objects, {'a/one.png', 'a/b/two.png'})
+        self.assertFalse(Photo.objects.exists())
+
+    def test_only_the_photos_of_the_user_follow_and_anonymous_users_are_redirected(self):
+        other = CustomUser.objects.create_user(email="other@user.com", username="other", password="foo")
+        Photo.objects.create(title='three.png', url='https://storage.example.com/three.png', object_name='three.png',
+                             author=other)
+        self.assertEqual(self.bulk('move', ['three.png'], 'c/')['succeeded'], 1)
+        self.assertEqual(Photo.objects.get().object_name, 'three.png')
+        self.assertEqual(self.bulk('delete', ['c/'])['succeeded'], 1)
+        self.assertTrue(Photo.objects.exists())
+
+        self.client.logout()
+        response = self.client.post('/app/librairy/bulk/', {'action': 'delete', 'items': ['a/']},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('a/one.png', self.objects)
+
+    def test_the_thumbnails_folder_is_reserved(self):
+        for action, items, destination in (('delete', ['thumbnails/'], ''),
+                                           ('delete', ['thumbnails/three.png/160.webp'], ''),
+                                           ('copy', ['three.png'], 'thumbnails/')):
+            self.assertEqual(self.bulk(action, items, destination), {'error': "The thumbnails folder is reserved"})
+        response = self.client.post('/app/librairy/delete/thumbnails/three.png/160.webp/')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('thumbnails/three.png/160.webp', self.objects)
+
+    def test_single_files_are_deleted_by_post_only(self):
+        self.assertEqual(self.client.get('/app/librairy/delete/three.png/').status_code, 405)
+        self.client.logout()
+        self.assertEqual(self.client.post('/app/librairy/delete/three.png/').status_code, 302)
+        self.assertIn('three.png', self.objects)
+
+        self.client.force_login(self.user)
+        self.assertRedirects(self.client.post('/app/librairy/delete/three.png/'), '/app/librairy/',
+                             fetch_redirect_response=False)
+        self.assertEqual(self.objects, {'a/one.png', 'a/b/two.png'})
+
+
+class ThumbnailTests(TestCase):
+
+    def test_thumbnails_are_made_at_every_width_without_upscaling(self):
+        original = io.BytesIO()
+        Image.new('RGBA', (400, 200), 'red').save(original, format='PNG')
+        stored = {}
+        marks = {}
+        bucket = mock.Mock()
+
+        def blob(name):
+            blob = mock.Mock()
+            blob.name = name
+            blob.download_as_bytes.return_value = original.getvalue()
+            blob.upload_from_string.side_effect = lambda data, content_type: stored.update({name: data})
+            blob.patch.side_effect = lambda: marks.update({name: blob.metadata})
+            return blob
+
+        bucket.blob.side_effect = blob
+        names = generate_thumbnails(bucket, 'photos/menu.png')
+        self.assertEqual(sorted(names), sorted(stored))
+        self.assertEqual(len(names), 6)
+        self.assertEqual(marks, {'photos/menu.png': {'thumbnails': 'ready'}})
+        sizes = {name: Image.open(io.BytesIO(data)).size for name, data in stored.items()}
+        self.assertEqual(sizes['thumbnails/photos/menu.png/160.webp'], (160, 80))
+        self.assertEqual(sizes['thumbnails/photos/menu.png/640.jpeg'], (400, 200))
+        self.assertEqual(Image.open(io.BytesIO(stored['thumbnails/photos/menu.png/320.webp'])).format, 'WEBP')
+
+        unreadable = mock.Mock(download_as_bytes=mock.Mock(return_value=b'not an image'))
+        bucket.blob.side_effect = lambda name: unreadable
+        self.assertEqual(generate_thumbnails(bucket, 'photos/broken.png'), [])
+        self.assertEqual(unreadable.metadata, {'thumbnails': 'unsupported'})
+
+        too_big = mock.Mock(download_as_bytes=mock.Mock(return_value=original.getvalue()))
+        bucket.blob.side_effect = lambda name: too_big
+        with mock.patch('app.thumbnails.Image.MAX_IMAGE_PIXELS', 100):
+            with self.assertRaises(Image.DecompressionBombError):
+                generate_thumbnails(bucket, 'photos/huge.png')
+        self.assertEqual(too_big.metadata, {'thumbnails': 'failed'})
+        too_big.upload_from_string.assert_not_called()
+
+    @mock.patch('app.management.commands.generate_thumbnails.generate_thumbnails')
+    @mock.patch('app.management.commands.generate_thumbnails.get_bucket')
+    def test_backfill_makes_only_the_missing_thumbnails(self, get_bucket, generate):
+        blobs = [mock.Mock(content_type='image/png', metadata=None),
+                 mock.Mock(content_type='image/jpeg', metadata={'thumbnails': 'ready'}),
+                 mock.Mock(content_type='application/pdf', metadata=None),
+                 mock.Mock(content_type='image/webp', metadata=None)]
+        for blob, name in zip(blobs, ['old.png', 'done.jpeg', 'menu.pdf', 'thumbnails/old.png/160.webp']):
+            blob.name = name
+        get_bucket.return_value.list_blobs.return_value = blobs
 
-# Create your tests here.
+        call_command('generate_thumbnails', stdout=io.StringIO())
+        self.assertEqual([call.args[1] for call in generate.call_args_list], ['old.png'])
@@ -0,0 +1,172 @@
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from concurrent.futures import ThreadPoolExecutor
+
+import io, logging
+
+logger = logging.getLogger(__name__)
+
+# Widths in pixels of the thumbnails made for every image of the library
+THUMBNAIL_WIDTHS = getattr(settings, 'THUMBNAIL_WIDTHS', (160, 320, 640))
+
+# Formats of the thumbnails, the first ones are preferred by the browsers supporting them. JPEG must stay the last
+# one, as the fallback of the others.
+THUMBNAIL_FORMATS = getattr(settings, 'THUMBNAIL_FORMATS', ('webp', 'jpeg'))
+
+THUMBNAIL_QUALITY = getattr(settings, 'THUMBNAIL_QUALITY', 80)
+
+# Folder of the library bucket holding the thumbnails, mirroring the folders of the images
+THUMBNAIL_PREFIX = getattr(settings, 'THUMBNAIL_PREFIX', 'thumbnails/')
+
+# Number of images resized at the same time, in the background of the uploads
+THUMBNAIL_MAX_WORKERS = getattr(settings, 'THUMBNAIL_MAX_WORKERS', 2)
+
+# The thumbnails are named after their image only, an image uploaded again under the same name gets new thumbnails
+# under the same names. The browsers and caches keep the old ones at most this long.
+THUMBNAIL_CACHE_CONTROL = getattr(settings, 'THUMBNAIL_CACHE_CONTROL', 'public, max-age=3600')
+
+CONTENT_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+# Custom metadata set on an image once its thumbnails are all uploaded, 'ready', once it turned out Pillow can not
+# read it, 'unsupported', or once reading or resizing it failed otherwise, 'failed'. The marked images are skipped
+# by the backfill, unless forced.
+THUMBNAILS_METADATA_KEY = 'thumbnails'
+
+executor = ThreadPoolExecutor(max_workers=THUMBNAIL_MAX_WORKERS, thread_name_prefix='thumbnails')
+
+
+def is_thumbnail(name):
+    return name.startswith(THUMBNAIL_PREFIX)
+
+
+def has_thumbnails(name, content_type):
+    """
+    Returns whether thumbnails are made for an object of the library: the images, but not the thumbnails themselves.
+    """
+    return bool(content_type) and content_type.startswith('image/') and not is_thumbnail(name)
+
+
+def thumbnails_ready(metadata):
+    """
+    Returns whether the thumbnails of an image exist, from the custom metadata of the image.
+    """
+    return (metadata or {}).get(THUMBNAILS_METADATA_KEY) == 'ready'
+
+
+def needs_thumbnails(name, content_type, metadata):
+    """
+    Returns whether an object of the library is an image whose thumbnails were never made.
+    """
+    return has_thumbnails(name, content_type) and THUMBNAILS_METADATA_KEY not in (metadata or {})
+
+
+def thumbnail_name(name, width, format):
+    """
+    Returns the name of a thumbnail of an image, e.g. 'thumbnails/photos/menu.png/320.webp' for 'photos/menu.png'.
+    """
+    return f'{THUMBNAIL_PREFIX}{name}/{width}.{format}'
+
+
+def thumbnail_prefix(name):
+    """
+    Returns the prefix of every thumbnail of an image.
+    """
+    return f'{THUMBNAIL_PREFIX}{name}/'
+
+
+def resize(image, width, format):
+    """
+    Returns an image scaled down to a width, keeping its ratio and never scaled up, encoded in a format.
+    """
+    thumbnail = image.copy()
+    # Only the width is bounded
+    thumbnail.thumbnail((width, image.height), Image.LANCZOS)
+    if format == 'jpeg' and thumbnail.mode not in ('RGB', 'L'):
+        thumbnail = thumbnail.convert('RGB')
+    output = io.BytesIO()
+    thumbnail.save(output, format=format.upper(), quality=THUMBNAIL_QUALITY)
+    return output.getvalue()
+
+
+def generate_thumbnails(bucket, name):
+    """
+    Makes the thumbnails of an image of the library bucket, at every THUMBNAIL_WIDTHS and THUMBNAIL_FORMATS.
+
+    Images narrower than a width get a thumbnail of their own size under that width, so every width of `srcset`
+    exists. The image is then marked with the THUMBNAILS_METADATA_KEY metadata, which the pages read to show the
+    thumbnails instead of the original.
+
+    Parameters:
+    - bucket (Bucket): The library bucket.
+    - name (str): The name of the image.
+
+    Returns:
+    - list: The names of the uploaded thumbnails, empty if the object is not an image Pillow can read.
+
+    Raises:
+    - Exception: The error of an image Pillow could not resize, e.g. `Image.DecompressionBombError` for an image too
+      big to open safely, once the image is marked 'failed'. The errors of the bucket leave the image unmarked, so
+      the backfill tries it again.
+    """
+    original = bucket.blob(name)
+    data = original.download_as_bytes()
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Photos taken sideways are stored upright with an orientation tag, which the thumbnails do not keep
+        image = ImageOps.exif_transpose(image)
+        # Resized before any upload, which keeps the failures of Pillow apart from the ones of the bucket
+        resized = {(width, format): resize(image, width, format)
+                   for width in THUMBNAIL_WIDTHS for format in THUMBNAIL_FORMATS}
+    except (UnidentifiedImageError, OSError):
+        mark(original, 'unsupported')
+        return []
+    except Exception:
+        mark(original, 'failed')
+        raise
+
+    names = []
+    for (width, format), content in resized.items():
+        thumbnail = bucket.blob(thumbnail_name(name, width, format))
+        thumbnail.cache_control = THUMBNAIL_CACHE_CONTROL
+        thumbnail.upload_from_string(content, content_type=CONTENT_TYPES[format])
+        names.append(thumbnail.name)
+    mark(original, 'ready')
+    return names
+
+
+def mark(blob, state):
+    # Only the custom metadata is sent, the other ones of the object are kept
+    blob.metadata = {THUMBNAILS_METADATA_KEY: state}
+    blob.patch()
+
+
+def log_failure(future):
+    if future.exception() is not None:
+        logger.error("Thumbnail generation failed", exc_info=future.exception())
+
+
+def schedule_thumbnails(bucket, name, content_type):
+    """
+    Makes the thumbnails of a newly uploaded image in the background, see `generate_thumbnails`.
+
+    Returns:
+    - Future: The future of the list of thumbnail names, or None if the object is not an image.
+    """
+    if not has_thumbnails(name, content_type):
+        return None
+    future = executor.submit(generate_thumbnails, bucket, name)
+    future.add_done_callback(log_failure)
+    return future
+
+
+def srcset(public_url, name, format):
+    """
+    Returns the `srcset` attribute listing the thumbnails of an image in a format.
+
+    Parameters:
+    - public_url (callable): Returns the public URL of an object of the bucket from its name.
+    - name (str): The name of the image.
+    - format (str): One of THUMBNAIL_FORMATS.
+    """
+    return ', '.join(f'{public_url(thumbnail_name(name, width, format))} {width}w' for width in THUMBNAIL_WIDTHS)
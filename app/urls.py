@@ -17,12 +17,21 @@ urlpatterns = [
     path("instagramManager", views.insta_manager, name='instaManager'),
     path('instagramManager/fetch_recent_comments/<str:media_id>/', views.fetch_recent_comments, name='fetch_recent_comments'),
     path('instagramManager/fetch_recent_posts/', views.fetch_recent_posts, name='fetch_recent_posts'),
+    path('instagramManager/posts/', views.fetch_posts, name='fetch_posts'),
     path("InstagramManager/generate_response", views.generate_response, name="generate_response"),
+    path("InstagramManager/generate_response/stream", views.generate_response_stream,
+         name="generate_response_stream"),
+    path("drafts/regenerate", views.regenerate_draft_reply, name="regenerate_draft_reply"),
     path('InstagramManager/post_instagram_comment_reply/', views.post_instagram_comment_reply,
          name='post_instagram_comment_reply'),
     path('instagramManager/mediaDetails/<str:pk>/', InstagramMediaDetailView.as_view(), name='insta_media_detail'),
-    re_path(r'librairy/(?P<path>.*)', views.gcs_librairy, name='gcs_librairy'),
+    # Before the library listing, whose pattern matches every path under librairy/
     path('librairy/upload/', views.upload_file_to_gcs, name='upload_file_to_gcs'),
+    path('librairy/upload/multiple/', views.upload_files_to_gcs, name='upload_files_to_gcs'),
+    path('librairy/upload/url/', views.create_gcs_upload_url, name='create_gcs_upload_url'),
+    path('librairy/upload/complete/', views.complete_gcs_upload, name='complete_gcs_upload'),
+    path('librairy/bulk/', views.bulk_gcs_operation, name='bulk_gcs_operation'),
     re_path(r'librairy/delete/(?P<file_name>.+)/$', views.delete_file_from_gcs, name='delete_file_from_gcs'),
+    re_path(r'librairy/(?P<path>.*)', views.gcs_librairy, name='gcs_librairy'),
 
 ]
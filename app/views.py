@@ -1,31 +1,31 @@
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from google.cloud import storage
-
 from allauth.socialaccount.models import SocialToken, SocialAccount
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.views.generic import DetailView
-from django.conf import settings
-from django.http import JsonResponse, HttpResponseRedirect
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
+from django.http import JsonResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.views.decorators.http import require_POST
 
 from urllib.parse import unquote
 
 from .models import *
-from . import forms
+from .forms import ConfigForm, LocationParametersForm
+from .google_business import get_locations, save_locations, sync_reviews
+from .instagram import sync_instagram
+from .dashboard import comment_days, get_snapshot
+from .drafts import regenerate_draft
+from .library import (bulk_operation, create_upload_url, delete_file, finish_upload, list_folder, upload_file,
+                      upload_files, BULK_ACTIONS, GCS_DIRECT_UPLOADS, GCS_SIGNED_URL_EXPIRATION)
+from .thumbnails import is_thumbnail
+from .pagination import InvalidCursor, keyset_page, page_size
+from .llm import (get_openai_answer_default, get_openai_comment_answer, stream_openai_comment_answer,
+                  OPENAI_INTERACTIVE_DEADLINE)
 from users.forms import *
 
-import requests, openai, json, datetime
-
-STAR_RATING_MAP = {
-    'ONE': 1,
-    'TWO': 2,
-    'THREE': 3,
-    'FOUR': 4,
-    'FIVE': 5
-}
-
+import requests, json, logging
 
+logger = logging.getLogger(__name__)
 # Create your views here.
 
 @login_required
@@ -34,11 +34,9 @@ def dashboard(request):
     Renders the dashboard view for the authenticated user.
 
     If it is the user's first connection, redirects to the configuration page.
-    Otherwise, retrieves the user's locations and the last review of the last location.
+    Otherwise, reads the user's locations and the dashboard snapshot of the user, with the last review, the last
+    Instagram media and the last Instagram comment, and the review and comment figures.
     If a last review exists, generates lists of stars and empty stars based on the star rating.
-    Retrieves the social token for the user's Facebook account.
-    Retrieves the Instagram ID and media for the user's Instagram account.
-    Retrieves the last Instagram media and last Instagram media comment for the authenticated user.
 
     Args:
         request (HttpRequest): The HTTP request object.
@@ -48,59 +46,20 @@ def dashboard(request):
     """
     if request.user.first_connection:
         return redirect('app:config')
-    else:
-        locations = Location.objects.filter(owner=request.user)
-        last_review = Review.objects.filter(location=locations.last()).last()
-        if last_review:
-            stars = range(last_review.star_rating)
-            no_stars = range(5 - last_review.star_rating)
-
-        token = SocialToken.objects.get(account__user=request.user, account__provider='facebook')
-
-        insta_id = request_instagram_account(token)
-        medias = request_instagram_media(request, token, insta_id)
-
-        last_insta_media = InstagramMedia.objects.filter(author=request.user).last()
-        last_insta_comment = InstagramMediaComment.objects.filter(media_related=last_insta_media).last()
 
+    locations = Location.objects.filter(owner=request.user)
+    # Kept up to date by the syncs, one row whatever the size of the history
+    snapshot = get_snapshot(request.user)
+    last_review = snapshot.last_review
+    context = {'snapshot': snapshot,
+               'comment_days': comment_days(snapshot),
+               'last_insta_media': snapshot.last_media,
+               'last_insta_comment': snapshot.last_comment,
+               'locations': locations}
     if last_review:
-        return render(request, 'app/dashboard.html', {'last_review': last_review, 'stars': stars, 'no_stars': no_stars,
-                                                      'last_insta_media': last_insta_media,
-                                                      'last_insta_comment': last_insta_comment})
-    return render(request, 'app/dashboard.html',
-                  {'last_insta_media': last_insta_media, 'last_insta_comment': last_insta_comment})
-
-
-def generate_insta_caption(keywords):
-    """
-
-    Generate a caption for an Instagram post based on user-provided keywords.
-
-    Parameters:
-    - keywords (string): The keywords provided by the user to create the caption.
-
-    Returns:
-    - caption (string): The generated caption for the Instagram post.
-
-    Example Usage:
-    >>> keywords = "delicious food, restaurant, trendy"
-    >>> caption = generate_insta_caption(keywords)
-    >>> print(caption)
-    "Indulge in the delicious food at our trendy restaurant. #foodie #restaurant #trendy"
-
-    """
-    openai.api_key = settings.OPENAI_KEY
-    response = openai.ChatCompletion.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system",
-             "content": "You are a community manager. You will create a caption for a Instagram post for the new product thanks to the keywords that the user will give to you. The user preferences for the answer are formal and without emojis. But you can use trending hashtags. And the user's business is a restaurant"},
-            {"role": "user",
-             "content": keywords}
-        ]
-    )
-
-    return response['choices'][0]['message']['content']
+        context.update(last_review=last_review, stars=range(last_review.star_rating),
+                       no_stars=range(5 - last_review.star_rating))
+    return render(request, 'app/dashboard.html', context)
 
 
 def config(request):
@@ -116,13 +75,13 @@ def config(request):
         return redirect('app:dashboard')
 
     if request.method == "POST":
-        form = forms.ConfigForm(request.POST, instance=request.user)
+        form = ConfigForm(request.POST, instance=request.user)
         if form.is_valid():
             form.save()
             # Redirect to some page after updating names
             return redirect('app:authGoogle')
     else:
-        form = forms.ConfigForm(instance=request.user)
+        form = ConfigForm(instance=request.user)
 
     return render(request, 'app/config.html', {'form': form})
 
@@ -158,222 +117,6 @@ def auth_meta(request):
     return render(request, 'app/authMeta.html')
 
 
-def get_locations(access_token, token, account_id):
-    """
-    Retrieves a list of locations associated with the given account ID.
-
-    Parameters:
-    - access_token (str): The access token for authentication.
-    - token (Token): The token object containing the token secret for refreshing the access token.
-    - account_id (str): The ID of the account to retrieve locations from.
-
-    Returns:
-    - locations (dict): A dictionary containing the retrieved locations data.
-
-    Example:
-    access_token = "your_access_token"
-    token = Token("your_token_secret")
-    account_id = "your_account_id"
-    locations = get_locations(access_token, token, account_id)
-    """
-    credentials = Credentials(
-        token=access_token,
-        refresh_token=token.token_secret,
-        token_uri='https://oauth2.googleapis.com/token',
-        client_id=settings.CLIENT_ID,
-        client_secret=settings.CLIENT_SECRET
-    )
-    print()
-    service = build('mybusinessbusinessinformation', 'v1', credentials=credentials)
-
-    parentIUD = f"accounts/{account_id}"
-    locations = service.accounts().locations().list(parent=parentIUD,
-                                                    readMask="name,title,categories,profile").execute()
-    return locations
-
-
-def get_openai_answer_default(review):
-    """
-    Get responses from OpenAI GPT-3.5-Turbo model for a given review.
-
-    Parameters:
-        review (str): The review text.
-
-    Returns:
-        dict: A dictionary containing the formal, friendly, and emoji answers from the model.
-
-    Example:
-        >>> review = "This product is amazing!"
-        >>> answers = get_openai_answer_default(review)
-        >>> answers
-        {'formal': '', 'friendly': '', 'emoji': ''}
-    """
-    openai.api_key = settings.OPENAI_KEY
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system",
-             "content": "You are the owner of the business responding to those reviews in the corresponding language. I want three answers: one formal labeled 'formal', one more friendly labeled 'friendly', and one with emojis labeled 'emoji'. Provide your answers in JSON format"},
-            {"role": "user", "content": review},
-        ]
-    )
-    content = response['choices'][0]['message']['content']
-    parsed_content = json.loads(content)
-
-    # Ensure that the keys exist and provide default values if they don't
-    formal_answer = parsed_content.get('formal', '')
-    friendly_answer = parsed_content.get('friendly', '')
-    emoji_answer = parsed_content.get('emoji', '')
-
-    return {
-        'formal': formal_answer,
-        'friendly': friendly_answer,
-        'emoji': emoji_answer
-    }
-
-
-def get_openai_review_answer(review, preferences):
-    """
-    Retrieve an answer from OpenAI's GPT-3.5 Turbo model based on a given review and preferences.
-
-    Parameters:
-    - review (str): The review for which an answer is requested.
-    - preferences (str): The preferences for generating the answer.
-
-    Returns:
-    - content (str): The generated answer based on the given review and preferences.
-    """
-    openai.api_key = settings.OPENAI_KEY
-
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo-1106",
-        messages=[
-            {"role": "system",
-             "content": "You are the owner of the business responding to those reviews in the corresponding language. I want an answer generated respecting these preferences : " + preferences},
-            {"role": "user", "content": review},
-        ]
-    )
-    content = response['choices'][0]['message']['content']
-    return content
-
-
-def get_openai_comment_answer(comment, caption):
-    """
-
-    This method, `get_openai_comment_answer`, is used to retrieve a response from the OpenAI GPT-3.5-turbo chat-based language model, given a comment and a caption.
-
-    Parameters:
-    - `comment` (str): The comment from the user.
-    - `caption` (str): The caption of the post for context.
-
-    Returns:
-    - `content` (str): The response generated by the OpenAI model.
-
-    Example usage:
-    comment = "Great post!"
-    caption = "Check out our new product!"
-    response = get_openai_comment_answer(comment, caption)
-    print(response)
-    # Output: "Thank you! We're glad you like it. Don't forget to use the Instagram code: XXXX when placing an order!"
-
-    Note:
-    - Make sure to set the `settings.OPENAI_KEY` variable with the appropriate OpenAI API key before calling this method.
-
-    """
-    openai.api_key = settings.OPENAI_KEY
-
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo-1106",
-        messages=[
-            {"role": "system",
-             "content": "You are the community Manager of the business. Answer friendly and use Instagram code. This the caption of your post for context : " + caption},
-            {"role": "user", "content": comment},
-        ]
-    )
-
-    content = response['choices'][0]['message']['content']
-    return content
-
-
-def save_service(service_data):
-    """
-    Save a service to the database or update an existing service.
-
-    Args:
-        service_data (dict): A dictionary containing the service data including 'id' and 'name' fields.
-
-    Returns:
-        tuple: A tuple containing the saved or updated Service object and a boolean indicating whether it was created or not.
-
-    """
-    service_id = service_data['id']
-    name = service_data['name']
-    return Service.objects.get_or_create(service_id=service_id, name=name)
-
-
-def save_location(location, owner):
-    """
-    Save Location
-
-    Save the given location into the database.
-
-    Parameters:
-    - location (dict): A dictionary containing the details of the location.
-    - owner (User): The owner of the location.
-
-    Returns:
-    - loc (Location): The saved `Location` object.
-
-    Example Usage:
-    location = {'name': '/categories/gcid:12345', 'categories': {'primaryCategory': {'name': 'categories/gcid:12345', 'serviceTypes': [{'serviceTypeId': 'job_type_id:12345'}]}}}
-    owner = User.objects.get(username='admin')
-    saved_location = save_location(location, owner)
-    """
-    location_id = location['name'].split('/')[-1]
-    cat_id = location['categories']['primaryCategory']['name'].replace("categories/gcid:", '')
-    categorie = Categorie.objects.get(categorie_id=cat_id)
-
-    loc, _ = Location.objects.get_or_create(location_id=location_id, name=location['title'], categorie=categorie,
-                                            owner=owner)
-
-    for service_data in location['categories']['primaryCategory']['serviceTypes']:
-        service_id = service_data['serviceTypeId'].replace('job_type_id:', '')
-        service = Service.objects.get(service_id=service_id)
-        loc.services.add(service)
-
-    return loc
-
-
-def save_reviews(reviews_data, location_instance):
-    """
-    Saves reviews data in the database.
-
-    Parameters:
-    reviews_data (dict): A dictionary containing the reviews data.
-    location_instance (Location): An instance of the Location model.
-
-    Returns:
-    None
-    """
-    for review in reviews_data['reviews']:
-        star_rating_int = STAR_RATING_MAP.get(review['starRating'], 0)
-
-        # Only use unique fields in get_or_create
-        review_instance, created = Review.objects.get_or_create(
-            review_id=review['reviewId'],
-        )
-
-        # Update other fields
-        review_instance.reviewer_name = review['reviewer']['displayName']
-        review_instance.reviewer_picture_url = review['reviewer']['profilePhotoUrl']
-        review_instance.star_rating = star_rating_int
-        review_instance.comment = review['comment']
-        review_instance.location = location_instance
-
-        # Save the updated fields
-        review_instance.save()
-
-
 def config_google(request):
     """
 
@@ -392,48 +135,38 @@ def config_google(request):
     account_id = SocialAccount.objects.get(user=request.user, provider='google').uid
 
     locations = get_locations(token.token, token, account_id)
+    if not locations['locations']:
+        return render(request, 'app/configGoogle.html',
+                      {'error': "No location is associated with this Google account."})
+    saved_locations = save_locations(locations['locations'], request.user)
+    if not saved_locations:
+        return render(request, 'app/configGoogle.html',
+                      {'error': "The locations of this Google account are already connected by another user."})
+    loc = saved_locations[0]
 
-    services = [
-        {'id': service['serviceTypeId'].replace('job_type_id:', ''), 'name': service['displayName']}
-        for service in locations['locations'][0]['categories']['primaryCategory']['serviceTypes']
-    ]
-    for service_data in services:
-        save_service(service_data)
-
-    categorie_data = {
-        'categorie_id': locations['locations'][0]['categories']['primaryCategory']['name'].replace("categories/gcid:",
-                                                                                                   ''),
-        'name': locations['locations'][0]['categories']['primaryCategory']['displayName']
-    }
-    Categorie.objects.get_or_create(**categorie_data)
-
-    loc = save_location(locations['locations'][0], request.user)
-
-    headers = {
-        'Authorization': f'Bearer {token.token}',
-        'Content-Type': 'application/json'
-    }
-    url = f'https://mybusiness.googleapis.com/v4/accounts/{account_id}/locations/{loc.location_id}/reviews'
-    response = requests.get(url, headers=headers)
-
-    if response.status_code != 200:
-        error_msg = f"Failed to retrieve reviews. Status code: {response.status_code}. Response: {response.text}"
+    try:
+        sync_reviews(token.token, account_id, saved_locations)
+    except requests.RequestException as e:
+        # Timeouts and connection errors come without a response
+        if e.response is not None:
+            error_msg = (f"Failed to retrieve reviews. Status code: {e.response.status_code}. "
+                         f"Response: {e.response.text}")
+        else:
+            error_msg = f"Failed to retrieve reviews: {e}"
         return render(request, 'app/configGoogle.html', {'location': locations['locations'][0], 'error': error_msg})
 
-    reviews = response.json()
-    try:
-        review = reviews['reviews'][0]['comment']
-    except:
-        review = None
-    if review:
-        save_reviews(reviews, loc)
+    # Reviews synced before updated_at existed have none, they come after the others
+    last_review = (Review.objects.filter(location__owner=request.user).exclude(comment='')
+                   .order_by(F('updated_at').desc(nulls_last=True), '-pk').first())
+    if last_review:
+        review = last_review.comment
 
         answers = ""
-        if not 'reviewReply' in reviews['reviews'][0]:
-            answers = get_openai_answer_default(review)
+        if not last_review.reply:
+            answers = get_openai_answer_default(review, deadline=OPENAI_INTERACTIVE_DEADLINE)
     else:
         review = "Nous avons passé un super moment dans votre restaurant ! Merci pour tout !"
-        answers = get_openai_answer_default(review)
+        answers = get_openai_answer_default(review, deadline=OPENAI_INTERACTIVE_DEADLINE)
 
     if request.method == "POST":
         if 'answerGenerationPreferences' in request.POST:
@@ -444,7 +177,7 @@ def config_google(request):
                 request.user.save()
                 return redirect('app:authMeta')
 
-        locations_form = forms.LocationParametersForm(request.POST)
+        locations_form = LocationParametersForm(request.POST)
         if locations_form.is_valid():
             locations_form.save()
 
@@ -457,111 +190,13 @@ def config_google(request):
 
 
     else:
-        location_form = forms.LocationParametersForm(instance=loc)
+        location_form = LocationParametersForm(instance=loc)
 
     return render(request, 'app/configGoogle.html',
                   {'location': locations['locations'][0], 'review': review, 'answers': answers,
                    'locations_form': location_form})
 
 
-def request_instagram_account(token):
-    """
-    Request Instagram Account
-
-    This method makes a request to Facebook's Graph API to retrieve the Instagram Business Account ID of the specified Facebook page.
-
-    Parameters:
-        token (str): The access token required for authentication.
-
-    Returns:
-        str: The Instagram Business Account ID associated with the specified Facebook page.
-
-    Example:
-        >>> token = 'your_access_token'
-        >>> request_instagram_account(token)
-        '1234567890'
-    """
-    url = f'https://graph.facebook.com/v18.0/me/accounts?access_token={token}'
-
-    response = requests.get(url)
-    if response.status_code == 200:
-        pages_data = response.json()
-        page_id = pages_data['data'][0]['id']
-        page_name = pages_data['data'][0]['name']
-
-        url = "https://graph.facebook.com/v18.0/{0}?fields=instagram_business_account&access_token={1}".format(page_id,
-                                                                                                               token)
-        response = requests.get(url)
-        insta_id = response.json()['instagram_business_account']['id']
-
-        return insta_id
-
-
-def save_media(request, media):
-    """
-    Save the media in the database.
-
-    Parameters:
-    - request: The HTTP request object that contains the user information.
-    - media: A dictionary that contains the media information.
-
-    Returns:
-    None
-    """
-    media_instance, created = InstagramMedia.objects.get_or_create(instagram_media_id=media['id'], author=request.user)
-
-    media_instance.media_url = media['media_url']
-    media_instance.media_type = media['media_type']
-    media_instance.caption = media['caption']
-    media_instance.published_at = datetime.datetime.strptime(media['timestamp'], "%Y-%m-%dT%H:%M:%S%z")
-
-    media_instance.save()
-
-    if media['comments']:
-        save_comments(media['comments'], media['id'])
-
-
-def save_comments(comments, id):
-    """
-    Saves the comments for a given Instagram media.
-
-    Parameters:
-    comments (dict): The comments data.
-    id (int): The id of the Instagram media.
-
-    Returns:
-    None
-    """
-    for comment in comments['data']:
-        comment_instance, created = InstagramMediaComment.objects.get_or_create(
-            instagram_media_comment_id=comment['id'])
-
-        comment_instance.content = comment['text']
-        comment_instance.send_at = datetime.datetime.strptime(comment['timestamp'], "%Y-%m-%dT%H:%M:%S%z")
-        comment_instance.media_related = InstagramMedia.objects.get(instagram_media_id=id)
-
-        comment_instance.save()
-
-
-def request_instagram_media(request, token, insta_id):
-    """
-
-    """
-    url = "https://graph.facebook.com/v18.0/{0}/media?access_token={1}".format(insta_id, token)
-    response = requests.get(url)
-
-    medias = response.json()
-
-    for media in medias['data']:
-        url = "https://graph.facebook.com/v18.0/{0}/?fields={1}&access_token={2}".format(media['id'],
-                                                                                         "id, caption, media_type, media_url, comments, timestamp",
-                                                                                         token)
-        response = requests.get(url)
-        save_media(request, response.json())
-
-    return medias
-
-
 def config_meta(request):
     """
     This method config_meta is used to configure the meta information for a social media account. It takes a request object as a parameter.
@@ -575,10 +210,9 @@ def config_meta(request):
     Example usage:
     config_meta(request)
     """
-    token = SocialToken.objects.get(account__user=request.user, account__provider='facebook')
-
-    insta_id = request_instagram_account(token)
-    request_instagram_media(request, token, insta_id)
+    # The first sync happens here so the medias are shown right away, the next ones are made by the sync_instagram command
+    if request.user.instagram_synced_at is None:
+        sync_instagram(request.user)
 
     medias = (InstagramMedia.objects.filter(author=request.user)
               .prefetch_related('media_comment')  # Adjust this line based on your models and relationships
@@ -595,25 +229,35 @@ def config_meta(request):
     return render(request, 'app/configMeta.html', {'medias': medias, 'form': form})
 
 
+@login_required
 def google_manager(request):
     """
+    Renders the last reviews of every location of the user, with the draft reply of the last one.
 
+    Parameters:
+    - request (HttpRequest): The HTTP request object.
+
+    Returns:
+    - HttpResponse: The rendered 'app/googleManager.html' template.
     """
     locations = Location.objects.filter(owner=request.user)
 
-    last_review = Review.objects.filter(location=locations.last()).last()
+    reviews = Review.objects.filter(location__owner=request.user).select_related('location').order_by('-pub_at', '-pk')
+    last_review = reviews.first()
     if last_review:
         stars = range(last_review.star_rating)
         no_stars = range(5 - last_review.star_rating)
 
-        last_ten_reviews = Review.objects.filter(location=locations.last())[1:10]
-        generated_answer = get_openai_review_answer(last_review.comment, request.user.answerGenerationPreferences)
+        last_ten_reviews = reviews[1:10]
+        # The answer is drafted in the background by the sync_reviews command, it can be regenerated from the page
+        generated_answer = DraftReply.objects.filter(review=last_review).first()
 
         return render(request, 'app/googleManager.html',
                       {'last_review': last_review, 'stars': stars, 'no_stars': no_stars,
                        'generated_answer': generated_answer,
-                       'last_ten_reviews': last_ten_reviews})
-    return render(request, 'app/googleManager.html')
+                       'last_ten_reviews': last_ten_reviews,
+                       'locations': locations})
+    return render(request, 'app/googleManager.html', {'locations': locations})
 
 
 def google_preferences(request):
@@ -653,25 +297,48 @@ def fb_manager(request):
     return render(request, 'app/fbManager.html')
 
 
-def fetch_recent_posts(request):
+def draft_payload(comments):
     """
-    Fetches the most recent posts from Instagram associated with the given user's Facebook account.
+    Returns the comment values as sent to the browser, with the content of their draft reply under 'draft'.
+    """
+    # A 'draft' annotation would clash with the reverse relation of the same name
+    return [dict(comment, draft=comment.pop('draft__content')) for comment in comments]
 
-    :param request: The HTTP request object.
-    :return: JsonResponse containing the data of the most recent Instagram posts, including the post ID, caption, published date, and the three most recent comments for each post.
+
+@login_required
+def fetch_recent_posts(request):
     """
-    token = SocialToken.objects.get(account__user=request.user, account__provider='facebook')
+    Fetches the most recent Instagram posts of the user, with their most recent comments.
+
+    The whole feed is read with two queries whatever the number of posts: one for the posts, and one for their
+    comments, limited to the most recent ones of each post by a window function.
 
-    insta_id = request_instagram_account(token)
-    request_instagram_media(request, token, insta_id)
+    :param request: The HTTP request object. The 'posts' and 'comments' query string parameters set the number of
+        posts and of comments per post, 3 by default.
+    :return: JsonResponse containing the data of the most recent Instagram posts, including the post ID, caption, published date, and the most recent comments for each post with their draft reply.
+    """
+    comment_count = page_size(request.GET.get('comments'))
+    recent_comments = (InstagramMediaComment.objects
+                       .annotate(rank=Window(RowNumber(), partition_by=F('media_related'),
+                                             order_by=[F('send_at').desc(), F('pk').desc()]))
+                       .filter(rank__lte=comment_count)
+                       .select_related('draft')
+                       .order_by('-send_at', '-pk'))
+    insta_medias = (InstagramMedia.objects.filter(author=request.user).order_by('-published_at', '-pk')
+                    .prefetch_related(Prefetch('media_comment', queryset=recent_comments, to_attr='recent_comments'))
+                    [:page_size(request.GET.get('posts'))])
 
-    insta_medias = InstagramMedia.objects.prefetch_related('media_comment') \
-                       .all().order_by('-published_at')[:3]
     data = []
     for media in insta_medias:
-        # Fetch 3 most recent comments for each post
-        comments = list(media.media_comment.all().order_by('-send_at')[:3].values(
-            'instagram_media_comment_id', 'content', 'send_at'))
+        comments = []
+        for comment in media.recent_comments:
+            draft = getattr(comment, 'draft', None)
+            comments.append({
+                'instagram_media_comment_id': comment.instagram_media_comment_id,
+                'content': comment.content,
+                'send_at': comment.send_at,
+                'draft': draft.content if draft else None,
+            })
         data.append({
             'media_id': media.instagram_media_id,
             'caption': media.caption,
@@ -681,6 +348,30 @@ def fetch_recent_posts(request):
     return JsonResponse(data, safe=False)
 
 
+@login_required
+def fetch_posts(request):
+    """
+    Returns a page of the Instagram medias of the user, newest first.
+
+    Parameters:
+    - request (HttpRequest): The HTTP request object. The 'limit' query string parameter sets the page size, and
+      'cursor' takes the `next_cursor` of the previous page.
+
+    Returns:
+    - JsonResponse: The medias under 'posts', and the cursor of the next page under 'next_cursor', None on the
+      last page.
+    """
+    medias = InstagramMedia.objects.filter(author=request.user).values(
+        'instagram_media_id', 'caption', 'media_type', 'media_url', 'published_at')
+    try:
+        medias, next_cursor = keyset_page(medias, 'published_at', request.GET.get('cursor'),
+                                          page_size(request.GET.get('limit')))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    return JsonResponse({'posts': medias, 'next_cursor': next_cursor})
+
+
+@login_required
 def fetch_recent_comments(request, media_id):
     """
 
@@ -691,49 +382,37 @@ def fetch_recent_comments(request, media_id):
     - media_id (str): The unique identifier of the media.
 
     Returns:
-    - JsonResponse: A JSON response containing the comments for the specified media. If a media_id is provided, it returns the comments for that post. Otherwise, it returns an error message
-    * indicating that the media_id was not provided. If there are no comments available, an empty list will be returned. The response is formatted as follows:
+    - JsonResponse: A JSON response containing a page of the comments of the media, formatted as follows:
 
-        - If a media_id is provided:
             {
                 'comments': [
                     {
                         'instagram_media_comment_id': str,
                         'content': str,
-                        'send_at': str
+                        'send_at': str,
+                        'draft': str or None
                     },
                     ...
-                ]
-            }
-
-        - If no media_id is provided:
-            {
-                'error': 'Media ID not provided'
+                ],
+                'next_cursor': str or None
             }
 
     Note:
-    - This method uses the SocialToken model from the Django's SocialApp framework to retrieve the user's Facebook token.
-    - It also uses the request_instagram_account and request_instagram_media functions to obtain the Instagram account and media ID associated with the token.
-    - The 'offset' parameter can be passed in the request query string to specify the offset for fetching comments. By default, it is set to 0.
+    - The comments are read from the database, they are refreshed in the background by the sync_instagram command.
     - The returned comments are ordered by the 'send_at' field in descending order.
+    - The 'limit' query string parameter sets the number of comments, 3 by default. The older comments are loaded
+      by passing the 'next_cursor' of the previous response as the 'cursor' parameter, which costs the same however
+      deep in the history the page is.
 
     """
-    token = SocialToken.objects.get(account__user=request.user, account__provider='facebook')
-
-    insta_id = request_instagram_account(token)
-    request_instagram_media(request, token, insta_id)
-
-    offset = int(request.GET.get('offset', 0))
-
-    if media_id:
-        # Fetch additional comments for a specific post
-        media = InstagramMedia.objects.get(instagram_media_id=media_id)
-        comments = list(media.media_comment.all().order_by('-send_at')[offset: offset + 3].values(
-            'instagram_media_comment_id', 'content', 'send_at'))
-        return JsonResponse({'comments': comments}, safe=False)
-
-    else:
-        return JsonResponse({'error': 'Media ID not provided'}, status=400)
+    media = get_object_or_404(InstagramMedia, instagram_media_id=media_id, author=request.user)
+    comments = media.media_comment.values('instagram_media_comment_id', 'content', 'send_at', 'draft__content')
+    try:
+        comments, next_cursor = keyset_page(comments, 'send_at', request.GET.get('cursor'),
+                                            page_size(request.GET.get('limit')))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    return JsonResponse({'comments': draft_payload(comments), 'next_cursor': next_cursor})
 
 
 def insta_manager(request):
@@ -749,6 +428,7 @@ def insta_manager(request):
     return render(request, 'app/instaManager.html', context={})
 
 
+@login_required
 def generate_response(request):
     """
     Generates a response based on the given request.
@@ -765,11 +445,98 @@ def generate_response(request):
         data = json.loads(request.body)
         comment = data.get('comment')
         caption = data.get('caption')
-        response = get_openai_comment_answer(comment, caption)
+        response = get_openai_comment_answer(comment, caption, deadline=OPENAI_INTERACTIVE_DEADLINE)
         return JsonResponse({'response': response})
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 
+@login_required
+def generate_response_stream(request):
+    """
+    Generates an answer to an Instagram comment and streams it to the browser as it is written.
+
+    The answer is sent as Server-Sent Events: one 'data' event per piece of text, then a 'done' event. When the
+    generation fails, a 'data' event with an 'error' comes before the 'done' event. When the comment is given by its
+    ID, one of the comments of the user, the complete answer is saved as its draft reply.
+
+    :param request: A POST request whose JSON body contains either a 'comment_id', or a 'comment' and a 'caption'.
+    :type request: HttpRequest
+
+    :return: The stream of the generated answer.
+    :rtype: StreamingHttpResponse
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    comment = None
+    if data.get('comment_id'):
+        comment = get_object_or_404(InstagramMediaComment.objects.select_related('media_related'),
+                                    instagram_media_comment_id=data['comment_id'],
+                                    media_related__author=request.user)
+        pieces = stream_openai_comment_answer(comment.content, comment.media_related.caption,
+                                              request.user.answerGenerationPreferences, refresh=True,
+                                              deadline=OPENAI_INTERACTIVE_DEADLINE)
+    else:
+        pieces = stream_openai_comment_answer(data.get('comment', ''), data.get('caption', ''),
+                                              deadline=OPENAI_INTERACTIVE_DEADLINE)
+
+    def events():
+        answer = []
+        try:
+            for piece in pieces:
+                answer.append(piece)
+                yield f"data: {json.dumps({'token': piece})}\n\n"
+        except Exception:
+            # The status is already sent, the browser is told in the stream
+            logger.exception("Streaming the answer to a comment failed")
+            yield f"data: {json.dumps({'error': 'The answer could not be generated, please try again.'})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+            return
+        if comment:
+            DraftReply.objects.update_or_create(comment=comment, defaults={
+                'content': ''.join(answer), 'preferences': request.user.answerGenerationPreferences,
+            })
+        yield "event: done\ndata: {}\n\n"
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+def regenerate_draft_reply(request):
+    """
+    Generates a new draft reply for a review or an Instagram comment of the user.
+
+    Parameters:
+    - request (HttpRequest): A POST request whose JSON body contains either a 'review_id' or a 'comment_id'.
+
+    Returns:
+    - JsonResponse: The new draft under the 'response' key, or an error with a 400 status.
+    """
+    if request.method == 'POST':
+        data = json.loads(request.body)
+        if data.get('review_id'):
+            review = get_object_or_404(Review, review_id=data['review_id'], location__owner=request.user)
+            draft = DraftReply.objects.filter(review=review).first() or DraftReply(review=review)
+        elif data.get('comment_id'):
+            comment = get_object_or_404(InstagramMediaComment, instagram_media_comment_id=data['comment_id'],
+                                        media_related__author=request.user)
+            draft = DraftReply.objects.filter(comment=comment).first() or DraftReply(comment=comment)
+        else:
+            return JsonResponse({'error': 'Review or comment ID not provided'}, status=400)
+
+        draft = regenerate_draft(draft, request.user, deadline=OPENAI_INTERACTIVE_DEADLINE)
+        return JsonResponse({'response': draft.content})
+    return JsonResponse({'error': 'Invalid request'}, status=400)
+
+
 def post_instagram_comment_reply(request):
     """
     Posts a reply to an Instagram comment.
@@ -826,10 +593,10 @@ def post_instagram_comment_reply(request):
 
 def gcs_librairy(request, path=''):
     """
-    This method, gcs_librairy, retrieves the list of files and folders from a Google Cloud Storage bucket and renders them in a web page.
+    This method, gcs_librairy, retrieves a page of the files and folders of a folder of the Google Cloud Storage bucket and renders them in a web page.
 
     Parameters:
-    - request: An HTTP request object.
+    - request: An HTTP request object. The 'page_token' query string parameter takes the next page token of the previous page.
     - path: (Optional) A string representing the path within the bucket to list files and folders from. If not provided, the method lists the files and folders from the root directory of
     * the bucket.
 
@@ -840,85 +607,232 @@ def gcs_librairy(request, path=''):
     request = ...  # create an HTTP request object
     response = gcs_librairy(request, 'path/to/folder/')  # retrieve list of files and folders from 'path/to/folder/'
 
-    Note: This method requires the 'storage' library to be installed and imported, and the 'settings.GS_BUCKET_NAME' to be set to the desired Google Cloud Storage bucket name.
+    Note: The listing is cached for a few seconds and refreshed by the uploads and deletes, see app.library. The 'settings.GS_BUCKET_NAME' must be set to the desired Google Cloud Storage bucket name.
     """
-    client = storage.Client()
-    bucket_name = settings.GS_BUCKET_NAME
-    bucket = client.get_bucket(bucket_name)
-
     # Ensure the path ends with a '/' if it's not empty
     if path and not path.endswith('/'):
         path += '/'
 
-    if path:
-        blobs = bucket.list_blobs(prefix=path, delimiter='/')
-    else:
-        blobs = bucket.list_blobs()
-
-    files = []
-    folders = []
-    for blob in blobs:
-        # Remove the current path from the blob's name to get the relative path
-        relative_path = blob.name[len(path):]
-        if relative_path.endswith('/'):
-            folders.append(relative_path)
-        elif path:  # only add files to the list if not in the root directory
-            files.append(blob)
+    listing = list_folder(path, page_token=request.GET.get('page_token') or None)
+    folders = [{'name': folder[len(path):-1], 'path': folder[:-1]} for folder in listing['folders']]
 
     path_parts = [part for part in path.split('/') if part]
 
     context = {
-        'files': files,
+        'files': listing['files'],
         'folders': folders,
         'current_path': path,
         'path_parts': path_parts,
+        'next_page_token': listing['next_page_token'],
+        'is_first_page': not request.GET.get('page_token'),
+        'direct_uploads': GCS_DIRECT_UPLOADS,
     }
 
     return render(request, 'app/librairy.html', context)
 
 
+@login_required
 def upload_file_to_gcs(request):
     """
     Uploads a file to Google Cloud Storage.
 
+    The file is streamed from its handle in chunks, see app.library.upload_file.
+
     Parameters:
-    - request (HttpRequest): The HTTP request object containing the file to upload.
+    - request (HttpRequest): The HTTP request object containing the file to upload, and optionally the 'path' of the
+      folder to upload it to.
 
     Returns:
-    - HttpResponseRedirect: A redirect response to the '/app/librairy/' URL after successful upload.
+    - HttpResponseRedirect: A redirect response to the '/app/librairy/' URL after successful upload, or a 400 error
+      for the reserved thumbnails folder.
 
     """
     if request.method == 'POST':
-        uploaded_file = request.FILES['file']
-        client = storage.Client()
-        bucket = client.get_bucket(settings.GS_BUCKET_NAME)
-        blob = bucket.blob(uploaded_file.name)
-        blob.upload_from_string(
-            uploaded_file.read(),
-            content_type=uploaded_file.content_type
-        )
+        try:
+            upload_file(request.FILES['file'], request.POST.get('path', ''))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         return HttpResponseRedirect('/app/librairy/')
 
 
+@login_required
+def upload_files_to_gcs(request):
+    """
+    Uploads several files to Google Cloud Storage concurrently, and streams the progress to the browser. The library
+    page uses it when GCS_DIRECT_UPLOADS is turned off.
+
+    The progress is sent as Server-Sent Events: one 'data' event each time a file is uploaded or failed, with the
+    number of files and bytes done so far, then a 'done' event.
+
+    Parameters:
+    - request (HttpRequest): A POST request with the files under 'files', and optionally the 'path' of the folder to
+      upload them to.
+
+    Returns:
+    - StreamingHttpResponse: The stream of the upload progress.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    uploaded_files = request.FILES.getlist('files')
+    total_bytes = sum(uploaded_file.size for uploaded_file in uploaded_files)
+
+    def events():
+        done = 0
+        done_bytes = 0
+        for uploaded_file, error in upload_files(uploaded_files, request.POST.get('path', '')):
+            done += 1
+            done_bytes += uploaded_file.size
+            yield "data: {}\n\n".format(json.dumps({
+                'name': uploaded_file.name, 'error': str(error) if error else None,
+                'done': done, 'total': len(uploaded_files), 'done_bytes': done_bytes, 'total_bytes': total_bytes,
+            }))
+        yield "event: done\ndata: {}\n\n"
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+def create_gcs_upload_url(request):
+    """
+    Returns a URL the browser uploads a file to, straight to Google Cloud Storage, so its bytes never go through the
+    Django workers. The browser then calls `complete_gcs_upload` to register the file.
+
+    Parameters:
+    - request (HttpRequest): A POST request with a JSON body holding the 'name' and 'content_type' of the file, the
+      'path' of the folder to upload it to, and 'resumable' to get a resumable upload session instead of a V4 signed
+      URL.
+
+    Returns:
+    - JsonResponse: The 'upload_url', the 'object_name' to send to `complete_gcs_upload`, the 'method' to upload
+      with, and the number of seconds the URL is valid for in 'expires_in'.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    name = (data.get('name') or '').strip('/')
+    content_type = data.get('content_type') or 'application/octet-stream'
+    if not name:
+        return JsonResponse({'error': 'Missing file name'}, status=400)
+    path = (data.get('path') or '').strip('/')
+    object_name = f'{path}/{name}' if path else name
+    if is_thumbnail(object_name):
+        return JsonResponse({'error': 'The thumbnails folder is reserved'}, status=400)
+
+    resumable = bool(data.get('resumable'))
+    upload_url = create_upload_url(object_name, content_type, resumable=resumable,
+                                   origin=request.headers.get('Origin'))
+    return JsonResponse({
+        'upload_url': upload_url,
+        'object_name': object_name,
+        'method': 'PUT',
+        'expires_in': int(GCS_SIGNED_URL_EXPIRATION.total_seconds()),
+    })
+
+
+@login_required
+def complete_gcs_upload(request):
+    """
+    Registers a file uploaded by the browser with `create_gcs_upload_url` as a Photo of the user.
+
+    Parameters:
+    - request (HttpRequest): A POST request with a JSON body holding the 'object_name' of the uploaded file.
+
+    Returns:
+    - JsonResponse: The 'photo_id' and 'url' of the Photo, or a 404 error if the file was not uploaded.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    try:
+        object_name = json.loads(request.body).get('object_name')
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    if not object_name or is_thumbnail(object_name):
+        return JsonResponse({'error': 'Missing or reserved object name'}, status=400)
+
+    blob = finish_upload(object_name)
+    if blob is None:
+        return JsonResponse({'error': 'File not uploaded'}, status=404)
+
+    # Completing the same upload twice registers a single Photo
+    photo, created = Photo.objects.update_or_create(
+        object_name=blob.name, author=request.user,
+        defaults={'title': blob.name.rsplit('/', 1)[-1], 'url': blob.public_url},
+    )
+    return JsonResponse({'photo_id': photo.pk, 'url': photo.url}, status=201 if created else 200)
+
+
+@login_required
+@require_POST
 def delete_file_from_gcs(request, file_name):
     """
-    Deletes a file from Google Cloud Storage (GCS).
+    Deletes a file from Google Cloud Storage (GCS), with its thumbnails.
 
     Parameters:
-    - request: The HTTP request object.
+    - request: The HTTP POST request object.
     - file_name: The name or path of the file to be deleted from the GCS.
 
     Returns:
-    - An HttpResponseRedirect object that redirects to '/app/library/' after the file is deleted from GCS.
+    - An HttpResponseRedirect object that redirects to '/app/library/' after the file is deleted from GCS, or a 400
+      error for a thumbnail, which goes with its image.
     """
-    client = storage.Client()
-    bucket = client.get_bucket(settings.GS_BUCKET_NAME)
-    file_path = unquote(file_name)
-    blob = bucket.blob(file_path)
-    blob.delete()
+    file_name = unquote(file_name)
+    if is_thumbnail(file_name):
+        return JsonResponse({'error': 'The thumbnails folder is reserved'}, status=400)
+    delete_file(file_name)
     return HttpResponseRedirect('/app/librairy/')
 
 
+@login_required
+def bulk_gcs_operation(request):
+    """
+    Deletes, moves or copies many files and folders of Google Cloud Storage at once, see app.library.bulk_operation.
+
+    The Photos of the user for the deleted files are deleted, and those of the moved files follow them.
+
+    Parameters:
+    - request (HttpRequest): A POST request with a JSON body holding the 'action' ('delete', 'move' or 'copy'), the
+      'items' selected, as file names and folder prefixes ending with '/', and the 'destination' folder of a move or
+      a copy.
+
+    Returns:
+    - JsonResponse: The 'results' of every object, with their 'error' or None, and the number of objects that
+      'succeeded' and 'failed'.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    action = data.get('action')
+    items = [item for item in data.get('items') or [] if isinstance(item, str) and item.strip('/')]
+    if action not in BULK_ACTIONS or not items:
+        return JsonResponse({'error': 'Invalid action or empty selection'}, status=400)
+
+    try:
+        results = bulk_operation(action, items, (data.get('destination') or '').strip('/'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    done = [result for result in results if result['error'] is None]
+    if action == 'delete':
+        Photo.objects.filter(author=request.user, object_name__in=[result['name'] for result in done]).delete()
+    elif action == 'move':
+        for result in done:
+            Photo.objects.filter(author=request.user, object_name=result['name']).update(object_name=result['new_name'], url=result['url'])
+
+    return JsonResponse({'results': results, 'succeeded': len(done), 'failed': len(results) - len(done)})
+
+
 class InstagramMediaDetailView(DetailView):
     """
 
@@ -233,6 +233,25 @@ AUTH_USER_MODEL = "users.CustomUser"
 
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 
+# The 'llm' cache keeps the generated answers and the 'library' cache the listings of the GCS library, shared by
+# every worker and instance. Their tables are created with `python manage.py createcachetable`
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "llm": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "llm_cache",
+        "TIMEOUT": 7 * 24 * 60 * 60,
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+    "library": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "library_cache",
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+}
+
 OAUTHLIB_RELAX_TOKEN_SCOPE = True
 
 SOCIALACCOUNT_LOGIN_ON_GET = True
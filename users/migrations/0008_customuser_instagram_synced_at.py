@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_customuser_openaianswerspreferences'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='instagram_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_customuser_instagram_synced_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='facebook_page_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='facebook_page_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='instagram_business_account_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
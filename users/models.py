@@ -25,6 +25,13 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     is_google_managed = models.BooleanField(default=False)
     answerGenerationPreferences = models.CharField(max_length=255, blank=True)
 
+    instagram_synced_at = models.DateTimeField(null=True, blank=True)
+
+    # Facebook page and Instagram Business Account of the user, resolved once then kept until the account is re-linked
+    facebook_page_id = models.CharField(max_length=255, blank=True)
+    facebook_page_name = models.CharField(max_length=255, blank=True)
+    instagram_business_account_id = models.CharField(max_length=255, blank=True)
+
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username"]
 